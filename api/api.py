@@ -1,15 +1,55 @@
 print('Inicializando a estrutura da API...\nImportando as bibliotecas...')
+from time import time
+marcador_tempo_importacao = time()
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from sentence_transformers import SentenceTransformer
 from starlette.middleware.cors import CORSMiddleware
 
 from api.environment.environment import environment
 from api.gerador_de_respostas import GeradorDeRespostas, DadosChat
+from api.utils.cache import CacheLRU, CacheSemanticoRespostas
+from api.utils.controle_admissao import ControleAdmissao
+from api.utils.gravador_interacoes import GravadorInteracoes
+from api.utils.inicializacao import CarregadorComponentes
+from api.utils.metricas import metricas
+from api.utils.mensagem import MensagemErro
+from api.utils.sessoes import criar_armazenamento_sessoes
 from api.utils.utils import FuncaoEmbeddings
 
+tempo_importacao = time() - marcador_tempo_importacao
+print(f'Bibliotecas importadas ({tempo_importacao} segundos)')
+
+async def aquecer_llama():
+    try:
+        tempo_aquecimento = await gerador_de_respostas.interface_ollama.aquecer(num_requisicoes=environment.OLLAMA_NUM_PARALLEL)
+        print(f'{environment.MODELO_LLAMA} aquecido ({tempo_aquecimento} segundos)')
+    except Exception as excecao:
+        print(f'ERRO: falha no aquecimento do {environment.MODELO_LLAMA} (Ollama offline? {excecao.__class__.__name__})')
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Os modelos e o banco de vetores são carregados em segundo plano: a API já responde a /health/live
+    # e passa a aceitar perguntas quando /health/ready indicar que está pronta
+    tarefa_carregamento = asyncio.create_task(carregador_componentes.carregar())
+    gerador_de_respostas.interface_ollama.iniciar()
+    if gravador_interacoes is not None: gravador_interacoes.iniciar()
+    # O aquecimento roda em segundo plano, sem atrasar a inicialização da API
+    tarefa_aquecimento = asyncio.create_task(aquecer_llama()) if environment.OLLAMA_AQUECER_NA_INICIALIZACAO else None
+    yield
+    # Encerramento da API
+    if tarefa_aquecimento: tarefa_aquecimento.cancel()
+    if not tarefa_carregamento.done(): tarefa_carregamento.cancel()
+    await gerador_de_respostas.interface_ollama.encerrar()
+    if gravador_interacoes is not None: await gravador_interacoes.encerrar()
+    if armazenamento_sessoes is not None: armazenamento_sessoes.encerrar()
+    if cache_embeddings is not None: cache_embeddings.salvar()
+    if cache_bert is not None: cache_bert.salvar()
+
 print('Instanciando a api (FastAPI)...')
-app = FastAPI()
+app = FastAPI(lifespan=ciclo_de_vida)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],  # Allow all origins
@@ -19,15 +59,146 @@ app.add_middleware(
 )
 
 print(f'Criando GeradorDeRespostas (usando {environment.MODELO_DE_EMBEDDINGS} - device={environment.DEVICE})...')
-funcao_de_embeddings = FuncaoEmbeddings(nome_modelo=environment.MODELO_DE_EMBEDDINGS, tipo_modelo=SentenceTransformer, device=environment.DEVICE)
-gerador_de_respostas = GeradorDeRespostas(funcao_de_embeddings=funcao_de_embeddings, url_banco_vetores=environment.URL_BANCO_VETORES, device=environment.DEVICE)
+cache_embeddings = CacheLRU(
+    capacidade=environment.CACHE_EMBEDDINGS_CAPACIDADE,
+    ttl=environment.CACHE_EMBEDDINGS_TTL,
+    url_arquivo=environment.CACHE_EMBEDDINGS_URL_ARQUIVO) if environment.CACHE_EMBEDDINGS_CAPACIDADE > 0 else None
+funcao_de_embeddings = FuncaoEmbeddings(nome_modelo=environment.MODELO_DE_EMBEDDINGS, tipo_modelo=SentenceTransformer, device=environment.DEVICE, cache=cache_embeddings, carregar_modelo=False, backend=environment.INFERENCIA_EMBEDDINGS)
+cache_respostas = CacheSemanticoRespostas(
+    capacidade=environment.CACHE_RESPOSTAS_CAPACIDADE,
+    limiar_similaridade=environment.CACHE_RESPOSTAS_LIMIAR_SIMILARIDADE,
+    ttl=environment.CACHE_RESPOSTAS_TTL) if environment.CACHE_RESPOSTAS_CAPACIDADE > 0 else None
+cache_bert = CacheLRU(
+    capacidade=environment.CACHE_BERT_CAPACIDADE,
+    ttl=environment.CACHE_BERT_TTL,
+    url_arquivo=environment.CACHE_BERT_URL_ARQUIVO) if environment.CACHE_BERT_CAPACIDADE > 0 else None
+armazenamento_sessoes = criar_armazenamento_sessoes(
+    tipo=environment.SESSOES_ARMAZENAMENTO,
+    max_sessoes=environment.SESSOES_MAX,
+    ttl=environment.SESSOES_TTL,
+    max_memoria_mb=environment.SESSOES_MAX_MEMORIA_MB,
+    url_banco=environment.SESSOES_URL_SQLITE) if environment.SESSOES_ARMAZENAMENTO else None
+gravador_interacoes = GravadorInteracoes(
+    url_banco=environment.INTERACOES_URL_SQLITE,
+    tamanho_fila=environment.INTERACOES_TAMANHO_FILA,
+    tamanho_lote=environment.INTERACOES_TAMANHO_LOTE,
+    intervalo_gravacao=environment.INTERACOES_INTERVALO_GRAVACAO,
+    politica_fila_cheia=environment.INTERACOES_POLITICA_FILA_CHEIA,
+    tipo_dispositivo=environment.DEVICE) if environment.INTERACOES_ARMAZENAMENTO == 'sqlite' else None
+gerador_de_respostas = GeradorDeRespostas(
+    funcao_de_embeddings=funcao_de_embeddings,
+    url_banco_vetores=environment.URL_BANCO_VETORES,
+    device=environment.DEVICE,
+    cache_respostas=cache_respostas,
+    armazenamento_sessoes=armazenamento_sessoes,
+    gravador_interacoes=gravador_interacoes,
+    cache_bert=cache_bert,
+    carregar_modelos=False)
+
+carregador_componentes = CarregadorComponentes()
+carregador_componentes.registrar_tempo('importacao_bibliotecas', tempo_importacao)
+carregador_componentes.registrar('modelo_embeddings', funcao_de_embeddings.carregar)
+carregador_componentes.registrar('banco_vetores', gerador_de_respostas.carregar_banco_vetores)
+if not environment.BERT_CARREGAMENTO_SOB_DEMANDA: carregador_componentes.registrar('bert', gerador_de_respostas.carregar_bert)
+
+controle_admissao = ControleAdmissao(
+    max_concorrentes=environment.ADMISSAO_MAX_CONCORRENTES,
+    max_fila=environment.ADMISSAO_MAX_FILA,
+    tempo_max_espera=environment.ADMISSAO_TEMPO_MAX_ESPERA)
+
+def coletar_metricas_estado():
+    '''Medidores e contadores lidos das estatísticas dos componentes a cada consulta a /metrics.'''
+    estatisticas_admissao = controle_admissao.estatisticas()
+    estatisticas_ollama = gerador_de_respostas.interface_ollama.cliente_ollama.estatisticas()
+    servidores_ollama = estatisticas_ollama['backends']
+    caches = {nome: cache.estatisticas() for nome, cache in (('embeddings', cache_embeddings), ('respostas', cache_respostas), ('bert', cache_bert)) if cache is not None}
+    estatisticas_inicializacao = carregador_componentes.estatisticas()
+    coletadas = [
+        ('daphane_pronto', 'gauge', 'Indica se a API terminou de carregar os componentes e aceita perguntas (1 pronta)', [({}, int(estatisticas_inicializacao['pronto']))]),
+        ('daphane_tempo_carregamento_segundos', 'gauge', 'Tempo de carregamento de cada componente na inicialização',
+            [({'componente': nome}, componente['tempo']) for nome, componente in estatisticas_inicializacao['componentes'].items()]),
+        ('daphane_perguntas_em_andamento', 'gauge', 'Perguntas em atendimento', [({}, estatisticas_admissao['ativos'])]),
+        ('daphane_perguntas_na_fila', 'gauge', 'Perguntas aguardando na fila de admissão', [({}, estatisticas_admissao['fila'])]),
+        ('daphane_embeddings_fila', 'gauge', 'Perguntas aguardando o modelo de embeddings', [({}, gerador_de_respostas.fila_embeddings)]),
+        ('daphane_ollama_streams_ativos', 'gauge', 'Gerações em andamento em cada servidor do Ollama',
+            [({'servidor': servidor['url_llama']}, servidor['streams_ativos']) for servidor in servidores_ollama]),
+        ('daphane_ollama_servidor_saudavel', 'gauge', 'Situação de cada servidor do Ollama na última verificação (1 saudável)',
+            [({'servidor': servidor['url_llama']}, int(servidor['saudavel'])) for servidor in servidores_ollama]),
+        ('daphane_ollama_requisicoes_total', 'counter', 'Gerações enviadas a cada servidor do Ollama',
+            [({'servidor': servidor['url_llama']}, servidor['total_requisicoes']) for servidor in servidores_ollama]),
+        ('daphane_ollama_requisicoes_pool_saturado_total', 'counter', 'Gerações iniciadas com o pool de conexões do servidor saturado',
+            [({'servidor': servidor['url_llama']}, servidor['requisicoes_com_pool_saturado']) for servidor in servidores_ollama]),
+        ('daphane_ollama_failovers_total', 'counter', 'Gerações repetidas em outro servidor após falha', [({}, estatisticas_ollama['failovers'])]),
+        ('daphane_cache_itens', 'gauge', 'Itens em cada cache', [({'cache': nome}, estatisticas['itens']) for nome, estatisticas in caches.items()]),
+        ('daphane_cache_acertos_total', 'counter', 'Acertos em cada cache', [({'cache': nome}, estatisticas['acertos']) for nome, estatisticas in caches.items()]),
+        ('daphane_cache_falhas_total', 'counter', 'Falhas em cada cache', [({'cache': nome}, estatisticas['falhas']) for nome, estatisticas in caches.items()]),
+    ]
+    if armazenamento_sessoes is not None:
+        estatisticas_sessoes = armazenamento_sessoes.estatisticas()
+        coletadas += [
+            ('daphane_sessoes', 'gauge', 'Sessões de conversa armazenadas', [({}, estatisticas_sessoes['sessoes'])]),
+            ('daphane_sessoes_bytes', 'gauge', 'Bytes ocupados pelos contextos das sessões', [({}, estatisticas_sessoes['bytes'])]),
+        ]
+    if gravador_interacoes is not None:
+        estatisticas_interacoes = gravador_interacoes.estatisticas()
+        coletadas += [
+            ('daphane_interacoes_na_fila', 'gauge', 'Interações aguardando gravação', [({}, estatisticas_interacoes['fila'])]),
+            ('daphane_interacoes_gravadas_total', 'counter', 'Interações gravadas no banco', [({}, estatisticas_interacoes['gravadas'])]),
+            ('daphane_interacoes_descartadas_total', 'counter', 'Interações descartadas com a fila de gravação cheia', [({}, estatisticas_interacoes['descartadas'])]),
+            ('daphane_interacoes_falhas_total', 'counter', 'Interações perdidas por falha na gravação', [({}, estatisticas_interacoes['falhas'])]),
+        ]
+    return coletadas
+
+metricas.adicionar_coletor(coletar_metricas_estado)
 
 print('Definindo as rotas')
 
 @app.post('/chat/enviar_pergunta/')
 async def gerar_resposta(dadosRecebidos: DadosChat):
-    return StreamingResponse(gerador_de_respostas.consultar(dadosRecebidos), media_type='text/plain')
+    if not carregador_componentes.pronto():
+        return Response(
+            content=MensagemErro(
+                descricao='Servidor em inicialização',
+                mensagem='O assistente está sendo iniciado. Por favor, tente novamente em alguns instantes.'
+            ).json() + '\n',
+            status_code=503,
+            headers={'Retry-After': '10'},
+            media_type='text/plain')
+    # A vaga é solicitada em ControleAdmissao.atender, quando o stream começa: se o cliente desconectar
+    # antes disso, nenhuma vaga fica presa. Aqui só se verifica a lotação
+    if controle_admissao.fila_cheia():
+        controle_admissao.recusar()
+        # Fila cheia: recusa imediatamente, indicando quando tentar de novo
+        tempo_espera = controle_admissao.tempo_estimado_espera()
+        return Response(
+            content=MensagemErro(
+                descricao='Servidor sobrecarregado',
+                mensagem=f'O servidor está com muitas perguntas no momento. Por favor, tente novamente em {tempo_espera} segundos.'
+            ).json() + '\n',
+            status_code=429,
+            headers={'Retry-After': str(tempo_espera)},
+            media_type='text/plain')
+    return StreamingResponse(controle_admissao.atender(gerador_de_respostas.consultar(dadosRecebidos)), media_type='text/plain')
+
+
+@app.get('/health/live')
+async def verificar_atividade():
+    # O processo está no ar (mesmo que ainda carregando os modelos)
+    return {'situacao': 'ativo'}
+
+@app.get('/health/ready')
+async def verificar_prontidao():
+    # Só responde 200 quando os componentes obrigatórios estão carregados (usado pelo balanceador de carga)
+    estatisticas = carregador_componentes.estatisticas()
+    estatisticas['pendentes'] = carregador_componentes.pendentes()
+    estatisticas['ollama'] = [
+        {'url_llama': servidor['url_llama'], 'saudavel': servidor['saudavel']}
+        for servidor in gerador_de_respostas.interface_ollama.cliente_ollama.estatisticas()['backends']]
+    return JSONResponse(content=estatisticas, status_code=200 if estatisticas['pronto'] else 503)
 
+@app.get('/metrics')
+async def exportar_metricas():
+    return Response(content=metricas.exportar(), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.get('/chat/')
 async def pagina_chat(url_redirec: str = Query(None)):
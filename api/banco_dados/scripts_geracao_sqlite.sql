@@ -0,0 +1,33 @@
+-- Versão para SQLite das tabelas de interações de scripts_geracao.sql (usada por api/utils/gravador_interacoes.py).
+-- Os ids são gerados pelo SQLite (INTEGER PRIMARY KEY) e Id_Documento guarda o id do fragmento no banco de
+-- vetores ("rotulo:n"), já que a tabela Documento não é preenchida pela API.
+CREATE TABLE IF NOT EXISTS Interacao (
+    Id_Interacao INTEGER PRIMARY KEY,
+    Pergunta TEXT,
+    Tipo_Dispositivo_Aplicacao VARCHAR(500),
+    Tipo_Dispositivo_LLM VARCHAR(500),
+    LLM_Nome_Modelo VARCHAR(500),
+    LLM_Tempo_Total NUMERIC,
+    LLM_Tempo_Carregamento NUMERIC,
+    LLM_Num_Tokens_Prompt INT,
+    LLM_Tempo_Processamento_Prompt NUMERIC,
+    LLM_Num_Tokens_Resposta INT,
+    LLM_Tempo_Processamento_Resposta NUMERIC,
+    LLM_Contexto_Interacao TEXT,
+    LLM_Resposta TEXT,
+    LLM_Tempo_Inicio_Stream NUMERIC,
+    Tempo_Recuperacao_Documentos NUMERIC,
+    Tempo_Avaliacao_Bert NUMERIC
+);
+
+CREATE TABLE IF NOT EXISTS Documento_em_Interacao (
+    Id_Documento_Interacao INTEGER PRIMARY KEY,
+    Resposta_Bert TEXT,
+    Score_Bert NUMERIC,
+    Score_Distancia NUMERIC,
+    Score_Ponderado NUMERIC,
+    Id_Documento VARCHAR(500),
+    Id_Interacao INT REFERENCES Interacao (Id_Interacao)
+);
+
+CREATE INDEX IF NOT EXISTS Ix_Documento_em_Interacao_Interacao ON Documento_em_Interacao (Id_Interacao);
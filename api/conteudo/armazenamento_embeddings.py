@@ -0,0 +1,48 @@
+from array import array
+from hashlib import sha256
+from typing import Dict, List
+
+import json
+import os
+import sqlite3
+
+
+class ArmazenamentoEmbeddings:
+    '''
+    Armazenamento, em SQLite, dos embeddings de fragmentos já calculados, endereçados pelo conteúdo:
+    a chave é o hash de (modelo, instrução, texto). Um mesmo texto nunca é codificado duas vezes,
+    mesmo em bancos de vetores ou coleções diferentes.
+    '''
+    # Limite de parâmetros por consulta do SQLite
+    TAMANHO_CONSULTA = 500
+
+    def __init__(self, url_banco: str):
+        os.makedirs(os.path.dirname(os.path.abspath(url_banco)), exist_ok=True)
+        self.conexao = sqlite3.connect(url_banco)
+        self.conexao.execute('CREATE TABLE IF NOT EXISTS Embedding (Chave TEXT NOT NULL PRIMARY KEY, Vetor BLOB)')
+        self.conexao.commit()
+
+    @staticmethod
+    def calcular_chave(nome_modelo: str, instrucao: str, texto: str):
+        return sha256(json.dumps([nome_modelo, instrucao, texto], ensure_ascii=False).encode()).hexdigest()
+
+    def obter(self, chaves: List[str]) -> Dict[str, List[float]]:
+        embeddings = {}
+        for inicio in range(0, len(chaves), self.TAMANHO_CONSULTA):
+            parte = chaves[inicio:inicio + self.TAMANHO_CONSULTA]
+            registros = self.conexao.execute(
+                f'SELECT Chave, Vetor FROM Embedding WHERE Chave IN ({",".join("?" * len(parte))})', parte)
+            for chave, vetor in registros:
+                embedding = array('f')
+                embedding.frombytes(vetor)
+                embeddings[chave] = embedding.tolist()
+        return embeddings
+
+    def inserir(self, embeddings: Dict[str, List[float]]):
+        self.conexao.executemany(
+            'INSERT OR REPLACE INTO Embedding (Chave, Vetor) VALUES (?, ?)',
+            [(chave, array('f', embedding).tobytes()) for chave, embedding in embeddings.items()])
+        self.conexao.commit()
+
+    def encerrar(self):
+        self.conexao.close()
@@ -1,7 +1,14 @@
+import json
 import os
+import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from itertools import chain
+from time import time
 from ..environment.environment import environment
-from ..utils.utils import FuncaoEmbeddings
+from ..utils.utils import FuncaoEmbeddings, url_manifesto_colecao
+from .armazenamento_embeddings import ArmazenamentoEmbeddings
 from torch import cuda
 
 from sentence_transformers import SentenceTransformer
@@ -17,135 +24,194 @@ DEVICE='cuda' if cuda.is_available() else 'cpu'
 NOME_BANCO_VETORES=os.path.join(URL_LOCAL,"bancos_vetores/banco_teste_default")
 NOME_COLECAO='colecao_teste_default'
 COMPRIMENTO_MAX_FRAGMENTO = 300    
+# Quantidade de fragmentos codificados e incluídos no banco a cada chamada
+TAMANHO_LOTE = 64
+# Extração em paralelo: quantidade de processos (1 para extração sequencial) e páginas de PDF por tarefa
+NUM_PROCESSOS = 1
+PAGINAS_POR_TAREFA = 20
+# Tamanho dos blocos lidos dos arquivos de texto pelo fragmentador
+TAMANHO_BLOCO_LEITURA = 64 * 1024
+SEPARADOR_PALAVRAS = re.compile(r'[ \n\t]+')
+ORDINAL_ARTIGO = re.compile(r'((?:Art\. |art\. |§ )[1-9])º')
+# Embeddings já calculados, reaproveitados entre gerações/atualizações de bancos (None para não usar)
+URL_ARMAZENAMENTO_EMBEDDINGS=os.path.join(URL_LOCAL,"bancos_vetores/armazenamento_embeddings.sqlite3")
 
 class GeradorBancoVetores:
     
-    def processar_texto_articulado(self, texto, info, comprimento_max_fragmento):
+    @staticmethod
+    def normalizar_partes(partes):
+        '''
+        Normaliza os espaços de um texto recebido em partes (blocos de um arquivo, páginas...), sem reuni-lo:
+        ''.join(resultado) é igual ao texto inteiro com as sequências de ' ', '\n' e '\t' trocadas por um espaço.
+        '''
+        termina_em_espaco = False
+        for parte in partes:
+            parte = SEPARADOR_PALAVRAS.sub(' ', parte)
+            # Espaços no início da parte continuam o separador do fim da parte anterior
+            if termina_em_espaco and parte.startswith(' '): parte = parte[1:]
+            if not parte: continue
+            termina_em_espaco = parte.endswith(' ')
+            yield parte
+
+    @staticmethod
+    def dividir_partes(partes, separador):
+        '''Equivalente, em fluxo, a ''.join(partes).split(separador).'''
+        resto = ''
+        for parte in partes:
+            pedacos = (resto + parte).split(separador)
+            resto = pedacos.pop()
+            yield from pedacos
+        yield resto
+
+    def gerar_artigos(self, textos):
+        '''
+        Divide o texto normalizado em artigos (a cada " Art. "), gerando (artigo, quantidade de palavras).
+        O "º" após "Art. N", "art. N" e "§ N" (N de 1 a 9) é trocado por ".".
+        '''
+        for idx, artigo in enumerate(self.dividir_partes(textos, ' Art. ')):
+            if idx: artigo = 'Art. ' + artigo
+            if not artigo: continue
+            artigo = ORDINAL_ARTIGO.sub(r'\1.', artigo)
+            yield artigo, artigo.count(' ') + 1
+
+    def fragmentar_artigo(self, artigo, comprimento_max_fragmento):
+        '''Divide um artigo longo em partes (parágrafos, incisos...), repetindo o caput em cada fragmento.'''
+        item = (
+                artigo.replace('. §', '.\n§')
+                .replace('; §', ';\n§')
+                .replace(': §', ':\n§')
+                .replace(';', '\n')
+                .replace(':', '\n')
+                .replace('\n ', '\n')
+                .replace(' \n', '\n')
+                .split('\n')
+            )
+        caput = item[0]
+        qtd_palavras_caput = caput.count(' ') + 1
+        fragmento_artigo = caput
+        qtd_palavras_fragmento = qtd_palavras_caput
+        # AFAZER: considerar casos em que, mesmo após divisão das
+        # partes do artigo, haja alguma com mais palavras que o compr. máximo
+        for i in range(1, len(item)):
+            qtd_palavras_item = item[i].count(' ') + 1
+            if qtd_palavras_fragmento + qtd_palavras_item <= comprimento_max_fragmento:
+                fragmento_artigo = fragmento_artigo + ' ' + item[i]
+                qtd_palavras_fragmento += qtd_palavras_item
+            else:
+                yield fragmento_artigo
+                fragmento_artigo = caput + ' ' + item[i]
+                qtd_palavras_fragmento = qtd_palavras_caput + qtd_palavras_item
+        yield fragmento_artigo
+
+    def processar_textos_articulado(self, textos, info, comprimento_max_fragmento):
         '''Processa textos legais, divididos em artigos. Mantém o Caput dos artigos em cada um dos fragmentos.'''
-        
-        texto = texto.replace('\n', ' ')
-        while '  ' in texto: texto = texto.replace('  ', ' ')
-        texto = texto.replace(' Art. ', '\nArt. ')
-        
-        for num in range(1, 10):
-                texto = texto.replace(f'Art. {num}º', f'Art. {num}.')
-                texto = texto.replace(f'art. {num}º', f'art. {num}.')
-                texto = texto.replace(f'§ {num}º', f'§ {num}.')
-                
-        texto = texto.split('\n')
-        while '' in texto: texto.remove('')
-        
-        artigos = []
-        for art in texto:
-            item = art.split(' ')
-            qtd_palavras = len(item)
+        ocorrencias_titulos = {}
+        for artigo, qtd_palavras in self.gerar_artigos(textos):
             if qtd_palavras > comprimento_max_fragmento:
-                item = (
-                        art.replace('. §', '.\n§')
-                        .replace('; §', ';\n§')
-                        .replace(': §', ':\n§')
-                        .replace(';', '\n')
-                        .replace(':', '\n')
-                        .replace('\n ', '\n')
-                        .replace(' \n', '\n')
-                        .split('\n')
-                    )
-                caput = item[0]
-                fragmento_artigo = '' + caput
-                # AFAZER: considerar casos em que, mesmo após divisão das
-                # partes do artigo, haja alguma com mais palavras que o compr. máximo
-                for i in range(1, len(item)):
-                    if len(fragmento_artigo.split(' ')) + len(item[i].split(' ')) <= comprimento_max_fragmento:
-                        fragmento_artigo = fragmento_artigo + ' ' + item[i]
-                    else:
-                        artigos.append(fragmento_artigo)
-                        fragmento_artigo = '' + caput + ' ' + item[i]
-                artigos.append(fragmento_artigo)
+                fragmentos_artigo = self.fragmentar_artigo(artigo, comprimento_max_fragmento)
             else:
-                artigos.append(art)
-        
-        fragmentos = []
-        titulos = []
-        for artigo in artigos:
-            tit = artigo.split('. ')[1]
-            titulos.append(tit)
-            fragmento = {
-                'page_content': artigo,
+                fragmentos_artigo = [artigo]
+
+            for fragmento_artigo in fragmentos_artigo:
+                tit = fragmento_artigo.split('. ', 2)[1]
+                ocorrencias_titulos[tit] = ocorrencias_titulos.get(tit, 0) + 1
+                yield {
+                    'page_content': fragmento_artigo,
+                    'metadata': {
+                        'titulo': f'{info["titulo"]}',
+                        'subtitulo': f'Art. {tit} - {ocorrencias_titulos[tit]}',
+                        'autor': f'{info["autor"]}',
+                        'fonte': f'{info["fonte"]}',
+                        'pagina': None
+                    },
+                }
+
+    def gerar_linhas(self, textos):
+        # Uma linha termina em cada ". "; gera (linha, quantidade de palavras)
+        linha_anterior = None
+        for linha in self.dividir_partes(textos, '. '):
+            if linha_anterior is not None: yield linha_anterior + '.', linha_anterior.count(' ') + 1
+            linha_anterior = linha
+        if linha_anterior: yield linha_anterior, linha_anterior.count(' ') + 1
+
+    def processar_partes_texto(self, partes, info, comprimento_max_fragmento, pagina=None):
+        '''
+        Gera os fragmentos de um texto recebido em partes (ver normalizar_partes), em uma única passada:
+        a quantidade de palavras de cada fragmento é acumulada, em vez de recontada a cada linha incluída.
+        '''
+        def criar_fragmento(texto_fragmento, num_fragmento):
+            return {
+                'page_content': texto_fragmento,
                 'metadata': {
                     'titulo': f'{info["titulo"]}',
-                    'subtitulo': f'Art. {tit} - {titulos.count(tit)}',
+                    'subtitulo':
+                        f'Página {pagina} - Fragmento {num_fragmento}' if pagina
+                        else f'Fragmento {num_fragmento}',
                     'autor': f'{info["autor"]}',
                     'fonte': f'{info["fonte"]}',
-                    'pagina': None
+                    'pagina': pagina if pagina else None
                 },
             }
-            fragmentos.append(fragmento)
-        return fragmentos
-    
-    def processar_texto(self, texto, info, comprimento_max_fragmento, pagina=None):
-        texto = texto.replace('\n', ' ').replace('\t', ' ')
-        while '  ' in texto: texto = texto.replace('  ', ' ')
-        
+
+        textos = self.normalizar_partes(partes)
         if info['texto_articulado']:
-            return self.processar_texto_articulado(texto, info, comprimento_max_fragmento)
-        
-        if len(texto.split(' ')) <= comprimento_max_fragmento:
-            return [{
-                    'page_content': texto,
-                    'metadata': {
-                        'titulo': f'{info["titulo"]}',
-                        'subtitulo':
-                            f'Página {pagina} - Fragmento 1' if pagina
-                            else f'Fragmento 1',
-                        'autor': f'{info["autor"]}',
-                        'fonte': f'{info["fonte"]}',
-                        'pagina': pagina if pagina else None
-                    },
-                }]
-            
-        linhas = texto.replace('. ', '.\n')
-        linhas = linhas.split('\n')
-        while '' in linhas: linhas.remove('')
-        
-        fragmentos = []
+            yield from self.processar_textos_articulado(textos, info, comprimento_max_fragmento)
+            return
+
+        # Só o início do texto (até passar do comprimento máximo) é mantido para decidir se ele cabe em um fragmento
+        inicio = []
+        qtd_palavras = 1
+        for texto in textos:
+            inicio.append(texto)
+            qtd_palavras += texto.count(' ')
+            if qtd_palavras > comprimento_max_fragmento: break
+        if qtd_palavras <= comprimento_max_fragmento:
+            yield criar_fragmento(''.join(inicio), 1)
+            return
+
+        # AFAZER: a linha que excede o comprimento máximo não é incluída no fragmento seguinte
+        # e o último fragmento não é gerado (comportamento mantido da versão anterior)
+        num_fragmentos = 0
         texto_fragmento = ''
-        for idx in range(len(linhas)):
-            if len(texto_fragmento.split(' ')) + len(linhas[idx].split(' ')) < comprimento_max_fragmento:
-                texto_fragmento += ' ' + linhas[idx]
+        qtd_palavras_fragmento = 1
+        for linha, qtd_palavras_linha in self.gerar_linhas(chain(inicio, textos)):
+            if qtd_palavras_fragmento + qtd_palavras_linha < comprimento_max_fragmento:
+                texto_fragmento += ' ' + linha
+                qtd_palavras_fragmento += qtd_palavras_linha
             else:
-                fragmento = {
-                    'page_content': texto_fragmento,
-                    'metadata': {
-                        'titulo': f'{info["titulo"]}',
-                        'subtitulo':
-                            f'Página {pagina} - Fragmento {len(fragmentos)+1}' if pagina
-                            else f'Fragmento {len(fragmentos)+1}',
-                        'autor': f'{info["autor"]}',
-                        'fonte': f'{info["fonte"]}',
-                        'pagina': pagina if pagina else None
-                    },
-                }
-                fragmentos.append(fragmento)
+                num_fragmentos += 1
+                yield criar_fragmento(texto_fragmento, num_fragmentos)
                 texto_fragmento = ''
-            
-        return fragmentos       
+                qtd_palavras_fragmento = 1
+
+    def processar_texto_articulado(self, texto, info, comprimento_max_fragmento):
+        return list(self.processar_textos_articulado(self.normalizar_partes([texto]), info, comprimento_max_fragmento))
+
+    def processar_texto(self, texto, info, comprimento_max_fragmento, pagina=None):
+        return list(self.processar_partes_texto([texto], info, comprimento_max_fragmento, pagina=pagina))
     
     def extrair_fragmento_txt(self, rotulo, info, comprimento_max_fragmento):
         with open(os.path.join(URL_LOCAL,info['url']), 'r') as arq:
-            texto = arq.read()
-        
-        fragmentos = self.processar_texto(texto, info, comprimento_max_fragmento)
+            # O arquivo é lido em blocos, sem carregar o texto inteiro
+            blocos = iter(lambda: arq.read(TAMANHO_BLOCO_LEITURA), '')
+            fragmentos = list(self.processar_partes_texto(blocos, info, comprimento_max_fragmento))
         
         for idx in range(len(fragmentos)): fragmentos[idx]['id'] = f'{rotulo}:{idx+1}'
         return fragmentos
     
-    def extrair_fragmento_pdf(self, rotulo, info, comprimento_max_fragmento):
+    def extrair_paginas_pdf(self, info, comprimento_max_fragmento, pagina_inicial=0, pagina_final=None):
+        '''Extrai os fragmentos das páginas [pagina_inicial, pagina_final) de um PDF, sem atribuir os ids.'''
         fragmentos = []
         arquivo = PdfReader(os.path.join(URL_LOCAL,info['url']))
-        for idx in range(len(arquivo.pages)):
+        if pagina_final is None: pagina_final = len(arquivo.pages)
+        for idx in range(pagina_inicial, pagina_final):
             pagina = arquivo.pages[idx]
             texto = pagina.extract_text()
             fragmentos += self.processar_texto(texto, info, comprimento_max_fragmento, pagina=idx+1)
+        return fragmentos
+
+    def extrair_fragmento_pdf(self, rotulo, info, comprimento_max_fragmento):
+        fragmentos = self.extrair_paginas_pdf(info, comprimento_max_fragmento)
         for idx in range(len(fragmentos)): fragmentos[idx]['id'] = f'{rotulo}:{idx+1}'
         return fragmentos
         
@@ -154,10 +220,13 @@ class GeradorBancoVetores:
             conteudo_html = arq.read()
             
         pagina_html = BeautifulSoup(conteudo_html, 'html.parser')
-        tags = pagina_html.find_all()
-        texto = '\n'.join([tag.get_text() for tag in tags])
+        # Textos das tags, separados por '\n', passados ao fragmentador sem reuni-los em uma única string
+        def gerar_textos_tags():
+            for idx, tag in enumerate(pagina_html.find_all()):
+                if idx: yield '\n'
+                yield tag.get_text()
         
-        fragmentos = self.processar_texto(texto, info, comprimento_max_fragmento)
+        fragmentos = list(self.processar_partes_texto(gerar_textos_tags(), info, comprimento_max_fragmento))
         for idx in range(len(fragmentos)): fragmentos[idx]['id'] = f'{rotulo}:{idx+1}'
         return fragmentos
     
@@ -167,24 +236,105 @@ class GeradorBancoVetores:
         'html': extrair_fragmento_html,
     }    
     
+    def extrair_documento(self, rotulo, info, comprimento_max_fragmento):
+        tipo = info['url'].split('.')[-1]
+        return self.extrair_fragmento_por_tipo[tipo](self, rotulo=rotulo, info=info, comprimento_max_fragmento=comprimento_max_fragmento)
+
     def extrair_fragmentos(self,
         indice_documentos=environment.DOCUMENTOS,
-        comprimento_max_fragmento=COMPRIMENTO_MAX_FRAGMENTO):
+        comprimento_max_fragmento=COMPRIMENTO_MAX_FRAGMENTO,
+        num_processos=NUM_PROCESSOS,
+        paginas_por_tarefa=PAGINAS_POR_TAREFA):
+        if num_processos > 1:
+            return self.extrair_fragmentos_em_paralelo(indice_documentos, comprimento_max_fragmento, num_processos, paginas_por_tarefa)
+
         fragmentos = []
         for rotulo, info in indice_documentos.items():
             print(f'Processando {rotulo}')
-            url = info['url']
-            tipo = url.split('.')[-1]
-            fragmentos += self.extrair_fragmento_por_tipo[tipo](self, rotulo=rotulo, info=info, comprimento_max_fragmento=comprimento_max_fragmento)
+            fragmentos += self.extrair_documento(rotulo=rotulo, info=info, comprimento_max_fragmento=comprimento_max_fragmento)
         
         return fragmentos
+
+    def extrair_fragmentos_em_paralelo(self, indice_documentos, comprimento_max_fragmento, num_processos, paginas_por_tarefa):
+        '''
+        Distribui os documentos (e, nos PDFs, intervalos de páginas) entre processos. Os resultados são
+        reunidos na ordem do índice, de forma que os fragmentos e ids "rotulo:n" são os mesmos da extração
+        sequencial. Um documento com falha é ignorado (e informado), sem interromper os demais.
+        '''
+        fragmentos = []
+        falhas = []
+        with ProcessPoolExecutor(max_workers=num_processos) as executor:
+            tarefas = []
+            for rotulo, info in indice_documentos.items():
+                try:
+                    if info['url'].split('.')[-1] == 'pdf':
+                        qtd_paginas = len(PdfReader(os.path.join(URL_LOCAL,info['url'])).pages)
+                        futuros = [
+                            executor.submit(self.extrair_paginas_pdf, info, comprimento_max_fragmento, inicio, min(inicio + paginas_por_tarefa, qtd_paginas))
+                            for inicio in range(0, qtd_paginas, paginas_por_tarefa)]
+                    else:
+                        futuros = [executor.submit(self.extrair_documento, rotulo, info, comprimento_max_fragmento)]
+                    tarefas.append((rotulo, futuros))
+                except Exception as excecao:
+                    print(f'ERRO: falha ao preparar {rotulo} ({excecao.__class__.__name__}: {excecao}). Documento ignorado')
+                    falhas.append(rotulo)
+
+            for rotulo, futuros in tarefas:
+                print(f'Processando {rotulo}')
+                fragmentos_documento = []
+                try:
+                    for futuro in futuros: fragmentos_documento += futuro.result()
+                except Exception as excecao:
+                    print(f'ERRO: falha ao processar {rotulo} ({excecao.__class__.__name__}: {excecao}). Documento ignorado')
+                    falhas.append(rotulo)
+                    continue
+                for idx in range(len(fragmentos_documento)): fragmentos_documento[idx]['id'] = f'{rotulo}:{idx+1}'
+                fragmentos += fragmentos_documento
+
+        if falhas: print(f'{len(falhas)} documento(s) não processado(s): {", ".join(falhas)}')
+        return fragmentos
         
     
+    def calcular_embeddings(self, textos, funcao_de_embeddings, armazenamento_embeddings=None):
+        '''Calcula os embeddings dos textos, codificando (em uma única chamada) só os que não estão no armazenamento.'''
+        if armazenamento_embeddings is None: return funcao_de_embeddings(textos)
+
+        chaves = [ArmazenamentoEmbeddings.calcular_chave(EMBEDDING_INSTRUCTOR, funcao_de_embeddings.instrucao, texto) for texto in textos]
+        embeddings = armazenamento_embeddings.obter(list(set(chaves)))
+        faltantes = {chave: texto for chave, texto in zip(chaves, textos) if chave not in embeddings}
+        if faltantes:
+            # Listas de floats, como os vindos do armazenamento (o Chroma não aceita tipos misturados)
+            novos_embeddings = {chave: [float(valor) for valor in embedding] for chave, embedding in zip(faltantes.keys(), funcao_de_embeddings(list(faltantes.values())))}
+            armazenamento_embeddings.inserir(novos_embeddings)
+            embeddings.update(novos_embeddings)
+        return [embeddings[chave] for chave in chaves]
+
+    def incluir_em_lotes(self, collection, documentos, funcao_de_embeddings, armazenamento_embeddings, tamanho_lote):
+        # Cada lote é codificado em uma única chamada ao modelo e gravado com um único upsert
+        qtd_docs = len(documentos)
+        marcador_tempo_inicio = time()
+        for inicio in range(0, qtd_docs, tamanho_lote):
+            lote = documentos[inicio:inicio + tamanho_lote]
+            textos = [doc['page_content'] for doc in lote]
+            collection.upsert(
+                documents=textos,
+                embeddings=self.calcular_embeddings(textos, funcao_de_embeddings, armazenamento_embeddings),
+                ids=[str(doc['id']) for doc in lote],
+                metadatas=[doc['metadata'] for doc in lote],
+            )
+            qtd_incluidos = inicio + len(lote)
+            tempo_decorrido = time() - marcador_tempo_inicio
+            print(f'\r>>> Incluídos {qtd_incluidos} de {qtd_docs} documentos ({qtd_incluidos / max(tempo_decorrido, 1e-9):.1f} fragmentos/s)', end='')
+        tempo_total = time() - marcador_tempo_inicio
+        print(f'\n>>> {qtd_docs} documentos incluídos em {tempo_total:.1f} segundos ({qtd_docs / tempo_total if tempo_total else 0:.1f} fragmentos/s)')
+
     def gerar_banco(self,
             documentos,
             nome_banco_vetores=NOME_BANCO_VETORES,
             nome_colecao=NOME_COLECAO,
-            instrucao=None):
+            instrucao=None,
+            tamanho_lote=TAMANHO_LOTE,
+            url_armazenamento_embeddings=URL_ARMAZENAMENTO_EMBEDDINGS):
         
         # Utilizando o ChromaDb diretamente
         client = chromadb.PersistentClient(path=nome_banco_vetores)
@@ -194,54 +344,183 @@ class GeradorBancoVetores:
             tipo_modelo=SentenceTransformer,
             device=DEVICE,
             instrucao=instrucao)
+        armazenamento_embeddings = ArmazenamentoEmbeddings(url_armazenamento_embeddings) if url_armazenamento_embeddings else None
         
         collection = client.create_collection(name=nome_colecao, embedding_function=funcao_de_embeddings_sentence_tranformer, metadata={'hnsw:space': 'cosine'})
         
-        print(f'Gerando >>> Banco {nome_banco_vetores} - Coleção {nome_colecao} - Instrução: {instrucao}')
-        qtd_docs = len(documentos)
-        for idx in range(qtd_docs):
-            print(f'\r>>> Incluindo documento {idx+1} de {qtd_docs}', end='')
-            doc = documentos[idx]
-            collection.add(
-                documents=[doc['page_content']],
-                ids=[str(doc['id'])],
-                metadatas=[doc['metadata']],
-            )
+        tamanho_lote = min(tamanho_lote, client.get_max_batch_size())
+        print(f'Gerando >>> Banco {nome_banco_vetores} - Coleção {nome_colecao} - Instrução: {instrucao} - Lotes de {tamanho_lote}')
+        self.incluir_em_lotes(collection, documentos, funcao_de_embeddings_sentence_tranformer, armazenamento_embeddings, tamanho_lote)
+        if armazenamento_embeddings: armazenamento_embeddings.encerrar()
+        client._system.stop()
+
+    def calcular_hash_fonte(self, info):
+        # Considera o conteúdo do arquivo e as informações do documento no índice (título, autor...)
+        hash_fonte = sha256(json.dumps(info, sort_keys=True, ensure_ascii=False).encode())
+        with open(os.path.join(URL_LOCAL,info['url']), 'rb') as arq:
+            for bloco in iter(lambda: arq.read(1024 * 1024), b''): hash_fonte.update(bloco)
+        return hash_fonte.hexdigest()
+
+    def calcular_hash_fragmento(self, fragmento):
+        return sha256(json.dumps([fragmento['page_content'], fragmento['metadata']], sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def criar_manifesto(self, indice_documentos, fragmentos, comprimento_max_fragmento, instrucao):
+        '''Manifesto com os hashes de cada documento fonte e de cada um dos seus fragmentos.'''
+        fragmentos_por_documento = {}
+        for fragmento in fragmentos:
+            fragmentos_por_documento.setdefault(fragmento['id'].rsplit(':', 1)[0], {})[fragmento['id']] = self.calcular_hash_fragmento(fragmento)
+        return {
+            'parametros': {'modelo': EMBEDDING_INSTRUCTOR, 'instrucao': instrucao, 'comprimento_max_fragmento': comprimento_max_fragmento},
+            'documentos': {
+                rotulo: {'hash_fonte': self.calcular_hash_fonte(info), 'fragmentos': fragmentos_por_documento[rotulo]}
+                for rotulo, info in indice_documentos.items() if rotulo in fragmentos_por_documento}
+        }
+
+    def salvar_manifesto(self, url_manifesto, manifesto):
+        with open(url_manifesto, 'w', encoding='utf-8') as arq:
+            json.dump(manifesto, arq, ensure_ascii=False, indent=4)
+
+    def atualizar_banco(self,
+            indice_documentos=environment.DOCUMENTOS,
+            nome_banco_vetores=NOME_BANCO_VETORES,
+            nome_colecao=NOME_COLECAO,
+            comprimento_max_fragmento=COMPRIMENTO_MAX_FRAGMENTO,
+            instrucao=None,
+            tamanho_lote=TAMANHO_LOTE,
+            num_processos=NUM_PROCESSOS,
+            url_armazenamento_embeddings=URL_ARMAZENAMENTO_EMBEDDINGS):
+        '''
+        Atualiza a coleção (criando-a, se não existir) a partir do manifesto da última geração: só os documentos
+        cujo arquivo ou informações mudaram são extraídos novamente; fragmentos novos ou alterados são incluídos
+        (com upsert) e os que deixaram de existir, removidos. Embeddings de textos já vistos são reaproveitados.
+        '''
+        url_manifesto = url_manifesto_colecao(nome_banco_vetores, nome_colecao)
+        manifesto_anterior = None
+        if os.path.exists(url_manifesto):
+            with open(url_manifesto, 'r', encoding='utf-8') as arq: manifesto_anterior = json.load(arq)
+
+        client = chromadb.PersistentClient(path=nome_banco_vetores)
+        funcao_de_embeddings_sentence_tranformer = FuncaoEmbeddings(
+            nome_modelo=EMBEDDING_INSTRUCTOR,
+            tipo_modelo=SentenceTransformer,
+            device=DEVICE,
+            instrucao=instrucao)
+        armazenamento_embeddings = ArmazenamentoEmbeddings(url_armazenamento_embeddings) if url_armazenamento_embeddings else None
+        collection = client.get_or_create_collection(name=nome_colecao, embedding_function=funcao_de_embeddings_sentence_tranformer, metadata={'hnsw:space': 'cosine'})
+
+        parametros = {'modelo': EMBEDDING_INSTRUCTOR, 'instrucao': instrucao, 'comprimento_max_fragmento': comprimento_max_fragmento}
+        if manifesto_anterior is None:
+            # Sem manifesto, todos os documentos são considerados alterados e os ids existentes na coleção, antigos
+            documentos_anteriores = {}
+            ids_anteriores = set(collection.get(include=[])['ids'])
+        else:
+            documentos_anteriores = manifesto_anterior['documentos'] if manifesto_anterior['parametros'] == parametros else {}
+            ids_anteriores = {id for documento in manifesto_anterior['documentos'].values() for id in documento['fragmentos']}
+
+        documentos = {}
+        indice_alterados = {}
+        hashes_fonte = {}
+        for rotulo, info in indice_documentos.items():
+            hashes_fonte[rotulo] = self.calcular_hash_fonte(info)
+            anterior = documentos_anteriores.get(rotulo)
+            if anterior and anterior['hash_fonte'] == hashes_fonte[rotulo]: documentos[rotulo] = anterior
+            else: indice_alterados[rotulo] = info
+
+        print(f'Atualizando >>> Banco {nome_banco_vetores} - Coleção {nome_colecao} - {len(indice_alterados)} de {len(indice_documentos)} documento(s) alterado(s)')
+        fragmentos_por_documento = {}
+        for fragmento in self.extrair_fragmentos(indice_alterados, comprimento_max_fragmento, num_processos=num_processos):
+            fragmentos_por_documento.setdefault(fragmento['id'].rsplit(':', 1)[0], []).append(fragmento)
+
+        fragmentos_alterados = []
+        for rotulo in indice_alterados:
+            if rotulo not in fragmentos_por_documento:
+                # Falha na extração: mantém o que já estava na coleção
+                print(f'AVISO: nenhum fragmento extraído de {rotulo}. Os fragmentos anteriores são mantidos')
+                if rotulo in documentos_anteriores: documentos[rotulo] = documentos_anteriores[rotulo]
+                continue
+            hashes_anteriores = documentos_anteriores.get(rotulo, {}).get('fragmentos', {})
+            hashes = {fragmento['id']: self.calcular_hash_fragmento(fragmento) for fragmento in fragmentos_por_documento[rotulo]}
+            fragmentos_alterados += [fragmento for fragmento in fragmentos_por_documento[rotulo] if hashes_anteriores.get(fragmento['id']) != hashes[fragmento['id']]]
+            documentos[rotulo] = {'hash_fonte': hashes_fonte[rotulo], 'fragmentos': hashes}
+
+        ids_atuais = {id for documento in documentos.values() for id in documento['fragmentos']}
+        ids_removidos = sorted(ids_anteriores - ids_atuais)
+
+        tamanho_lote = min(tamanho_lote, client.get_max_batch_size())
+        print(f'>>> {len(fragmentos_alterados)} fragmento(s) novo(s) ou alterado(s), {len(ids_removidos)} removido(s)')
+        self.incluir_em_lotes(collection, fragmentos_alterados, funcao_de_embeddings_sentence_tranformer, armazenamento_embeddings, tamanho_lote)
+        for inicio in range(0, len(ids_removidos), tamanho_lote):
+            collection.delete(ids=ids_removidos[inicio:inicio + tamanho_lote])
+
+        self.salvar_manifesto(url_manifesto, {'parametros': parametros, 'documentos': documentos})
+        if armazenamento_embeddings: armazenamento_embeddings.encerrar()
         client._system.stop()
         
     def run(self,
             nome_banco_vetores=NOME_BANCO_VETORES,
             nome_colecao=NOME_COLECAO,
             comprimento_max_fragmento=COMPRIMENTO_MAX_FRAGMENTO,
-            instrucao=None):
+            instrucao=None,
+            tamanho_lote=TAMANHO_LOTE,
+            num_processos=NUM_PROCESSOS,
+            incremental=False):
+
+        if incremental:
+            self.atualizar_banco(
+                nome_banco_vetores=nome_banco_vetores,
+                nome_colecao=nome_colecao,
+                comprimento_max_fragmento=comprimento_max_fragmento,
+                instrucao=instrucao,
+                tamanho_lote=tamanho_lote,
+                num_processos=num_processos
+            )
+            return
         
         docs = self.extrair_fragmentos(
-            comprimento_max_fragmento=comprimento_max_fragmento
+            comprimento_max_fragmento=comprimento_max_fragmento,
+            num_processos=num_processos
         )
         
         self.gerar_banco(
             documentos=docs,
             nome_banco_vetores=nome_banco_vetores,
             nome_colecao=nome_colecao,
-            instrucao=instrucao
+            instrucao=instrucao,
+            tamanho_lote=tamanho_lote
         )
+
+        # Manifesto para permitir atualizações incrementais posteriores
+        self.salvar_manifesto(
+            url_manifesto_colecao(nome_banco_vetores, nome_colecao),
+            self.criar_manifesto(environment.DOCUMENTOS, docs, comprimento_max_fragmento, instrucao))
         
         
 if __name__ == "__main__":   
     gerador_banco_vetores = GeradorBancoVetores()
+    # --incremental: atualiza a coleção existente só com o que mudou desde a última geração
+    incremental = '--incremental' in sys.argv
+    if incremental: sys.argv.remove('--incremental')
     nome_banco_vetores=os.path.join(URL_LOCAL,"bancos_vetores/" + sys.argv[1])
     nome_colecao=sys.argv[2]
     comprimento_max_fragmento = int(sys.argv[3])
+    tamanho_lote = int(sys.argv[5]) if len(sys.argv) > 5 else TAMANHO_LOTE
+    num_processos = int(sys.argv[6]) if len(sys.argv) > 6 else NUM_PROCESSOS
     try:
         instrucao = sys.argv[4]
         gerador_banco_vetores.run(
             nome_banco_vetores=nome_banco_vetores,
             nome_colecao=nome_colecao,
             comprimento_max_fragmento=comprimento_max_fragmento,
-            instrucao=instrucao)
+            instrucao=instrucao,
+            tamanho_lote=tamanho_lote,
+            num_processos=num_processos,
+            incremental=incremental)
     except:
         gerador_banco_vetores.run(
             nome_banco_vetores=nome_banco_vetores,
             nome_colecao=nome_colecao,
             comprimento_max_fragmento=comprimento_max_fragmento,
-            instrucao=None)
+            instrucao=None,
+            tamanho_lote=tamanho_lote,
+            num_processos=num_processos,
+            incremental=incremental)
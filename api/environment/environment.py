@@ -9,24 +9,110 @@ load_dotenv(url_dotenv)
 class Environment:
     def __init__(self):
         self.URL_BANCO_VETORES = os.getenv('URL_BANCO_VETORES')
+        # Um ou mais servidores do Ollama, separados por vírgula (ver RoteadorOllama)
         self.URL_LLAMA=os.getenv('URL_LLAMA')
+        # Intervalo, em segundos, entre as verificações de saúde dos servidores (0 desativa)
+        self.OLLAMA_INTERVALO_VERIFICACAO=float(os.getenv('OLLAMA_INTERVALO_VERIFICACAO', 15))
+        # Pool de conexões com o Ollama: por padrão, uma conexão para cada requisição paralela do Ollama
+        self.OLLAMA_NUM_PARALLEL=int(os.getenv('OLLAMA_NUM_PARALLEL', 4))
+        self.OLLAMA_MAX_CONEXOES=int(os.getenv('OLLAMA_MAX_CONEXOES', self.OLLAMA_NUM_PARALLEL))
+        self.OLLAMA_MAX_CONEXOES_KEEPALIVE=int(os.getenv('OLLAMA_MAX_CONEXOES_KEEPALIVE', self.OLLAMA_MAX_CONEXOES))
+        self.OLLAMA_TEMPO_KEEPALIVE=float(os.getenv('OLLAMA_TEMPO_KEEPALIVE', 60))
+        # Timeouts (em segundos) para conexão, espera pelo primeiro byte e intervalo máximo entre tokens
+        self.OLLAMA_TIMEOUT_CONEXAO=float(os.getenv('OLLAMA_TIMEOUT_CONEXAO', 5))
+        self.OLLAMA_TIMEOUT_PRIMEIRO_BYTE=float(os.getenv('OLLAMA_TIMEOUT_PRIMEIRO_BYTE', 120))
+        self.OLLAMA_TIMEOUT_ENTRE_TOKENS=float(os.getenv('OLLAMA_TIMEOUT_ENTRE_TOKENS', 30))
+        # Mantém o modelo carregado no Ollama e o aquece (com o prefixo do prompt) na inicialização da API
+        self.OLLAMA_KEEP_ALIVE=os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+        self.OLLAMA_AQUECER_NA_INICIALIZACAO=os.getenv('OLLAMA_AQUECER_NA_INICIALIZACAO', 'true').lower() == 'true'
         self.URL_HOST=os.getenv('URL_HOST')
         self.TAGS_SUBSTITUICAO_HTML={
             'TAG_INSERCAO_URL_HOST': self.URL_HOST
             }
 
         self.THREADPOOL_MAX_WORKERS=int(os.getenv('THREADPOOL_MAX_WORKERS'))
+        # Executores dedicados às etapas que usam CPU/GPU (embedding da pergunta e scores do Bert)
+        self.THREADPOOL_MAX_WORKERS_EMBEDDINGS=int(os.getenv('THREADPOOL_MAX_WORKERS_EMBEDDINGS', self.THREADPOOL_MAX_WORKERS))
+        self.THREADPOOL_MAX_WORKERS_BERT=int(os.getenv('THREADPOOL_MAX_WORKERS_BERT', self.THREADPOOL_MAX_WORKERS))
+        # Quantidade máxima de requisições simultâneas em cada etapa (as demais aguardam a vez)
+        self.LIMITE_CONCORRENCIA_EMBEDDINGS=int(os.getenv('LIMITE_CONCORRENCIA_EMBEDDINGS', self.THREADPOOL_MAX_WORKERS_EMBEDDINGS))
+        self.LIMITE_CONCORRENCIA_BERT=int(os.getenv('LIMITE_CONCORRENCIA_BERT', self.THREADPOOL_MAX_WORKERS_BERT))
+        qtd_servidores_llama = len([url for url in (self.URL_LLAMA or '').split(',') if url.strip()]) or 1
+        self.LIMITE_CONCORRENCIA_LLM=int(os.getenv('LIMITE_CONCORRENCIA_LLM', self.OLLAMA_NUM_PARALLEL * qtd_servidores_llama))
+        # Controle de admissão das perguntas: máximo de perguntas em atendimento (0 desativa), tamanho da
+        # fila de espera (com a fila cheia, a API responde 429) e tempo máximo de espera na fila, em segundos
+        self.ADMISSAO_MAX_CONCORRENTES=int(os.getenv('ADMISSAO_MAX_CONCORRENTES', 0))
+        self.ADMISSAO_MAX_FILA=int(os.getenv('ADMISSAO_MAX_FILA', 20))
+        self.ADMISSAO_TEMPO_MAX_ESPERA=float(os.getenv('ADMISSAO_TEMPO_MAX_ESPERA', 60))
         self.NOME_COLECAO_DE_DOCUMENTOS=os.getenv('COLECAO_DE_DOCUMENTOS')
         self.EMBEDDING_INSTRUCTOR=os.getenv('EMBEDDING_INSTRUCTOR')
         self.EMBEDDING_SQUAD_PORTUGUESE=os.getenv('EMBEDDING_SQUAD_PORTUGUESE')
         self.MODELO_LLAMA=os.getenv('MODELO_LLAMA')
         self.DEVICE=os.getenv('DEVICE') # ['cpu', cuda']
         self.NUM_DOCUMENTOS_RETORNADOS=int(os.getenv('NUM_DOCUMENTOS_RETORNADOS'))
+        # Inicia a geração da resposta pelo Llama enquanto o Bert calcula os scores dos documentos
+        self.SOBREPOR_BERT_E_LLM=os.getenv('SOBREPOR_BERT_E_LLM', 'true').lower() == 'true'
+        # Responde perguntas que citam um artigo ("o que diz o art. 22") pelo índice de artigos, sem embeddings
+        self.INDICE_ARTIGOS=os.getenv('INDICE_ARTIGOS', 'true').lower() == 'true'
+        # Índice léxico BM25: combinado à busca densa por reciprocal rank fusion (BM25_FUSAO) e/ou usado sozinho
+        # quando houver BM25_LIMIAR_FILA_EMBEDDINGS ou mais perguntas aguardando o modelo de embeddings (0 desativa)
+        self.BM25_FUSAO=os.getenv('BM25_FUSAO', 'false').lower() == 'true'
+        self.BM25_LIMIAR_FILA_EMBEDDINGS=int(os.getenv('BM25_LIMIAR_FILA_EMBEDDINGS', 0))
+        # Profundidade adaptativa do Bert (ver api/utils/politica_rerank.py; 0 desativa cada critério): sem Bert quando
+        # o primeiro documento supera o segundo pela margem de dominância; só documentos na janela do primeiro; tempo
+        # máximo (orçamento, em segundos) até os scores; e profundidade reduzida com a fila do Bert no limiar
+        self.RERANK_MARGEM_DOMINANCIA=float(os.getenv('RERANK_MARGEM_DOMINANCIA', 0))
+        self.RERANK_JANELA=float(os.getenv('RERANK_JANELA', 0))
+        self.RERANK_ORCAMENTO=float(os.getenv('RERANK_ORCAMENTO', 0))
+        self.RERANK_LIMIAR_FILA_BERT=int(os.getenv('RERANK_LIMIAR_FILA_BERT', 0))
+        self.RERANK_PROFUNDIDADE_SOB_CARGA=int(os.getenv('RERANK_PROFUNDIDADE_SOB_CARGA', 1))
+        # Carrega o Bert só na primeira pergunta (a API fica pronta antes, sem esperar pelo modelo)
+        self.BERT_CARREGAMENTO_SOB_DEMANDA=os.getenv('BERT_CARREGAMENTO_SOB_DEMANDA', 'false').lower() == 'true'
 
         self.MODELO_DE_EMBEDDINGS = self.EMBEDDING_INSTRUCTOR
 
+        # Backend de inferência em CPU dos modelos: 'fp32' (padrão) ou 'int8' (quantização dinâmica); para o
+        # Bert, também 'onnx' e 'onnx_int8' (requer onnxruntime; o grafo exportado fica em INFERENCIA_URL_MODELOS_ONNX).
+        # Ver api/testes/avaliar_quantizacao.py para comparar a precisão com o fp32
+        self.INFERENCIA_EMBEDDINGS=os.getenv('INFERENCIA_EMBEDDINGS', 'fp32')
+        self.INFERENCIA_BERT=os.getenv('INFERENCIA_BERT', 'fp32')
+        self.INFERENCIA_URL_MODELOS_ONNX=os.getenv('INFERENCIA_URL_MODELOS_ONNX', 'api/conteudo/modelos_onnx')
+
+        # Cache dos embeddings das perguntas (capacidade 0 desativa; ttl em segundos; arquivo opcional para persistência)
+        self.CACHE_EMBEDDINGS_CAPACIDADE=int(os.getenv('CACHE_EMBEDDINGS_CAPACIDADE', 0))
+        self.CACHE_EMBEDDINGS_TTL=float(os.getenv('CACHE_EMBEDDINGS_TTL')) if os.getenv('CACHE_EMBEDDINGS_TTL') else None
+        self.CACHE_EMBEDDINGS_URL_ARQUIVO=os.getenv('CACHE_EMBEDDINGS_URL_ARQUIVO') or None
+
+        # Cache de respostas completas para perguntas semelhantes (capacidade 0 desativa; similaridade do cosseno mínima)
+        self.CACHE_RESPOSTAS_CAPACIDADE=int(os.getenv('CACHE_RESPOSTAS_CAPACIDADE', 0))
+        self.CACHE_RESPOSTAS_LIMIAR_SIMILARIDADE=float(os.getenv('CACHE_RESPOSTAS_LIMIAR_SIMILARIDADE', 0.97))
+        self.CACHE_RESPOSTAS_TTL=float(os.getenv('CACHE_RESPOSTAS_TTL')) if os.getenv('CACHE_RESPOSTAS_TTL') else None
+
+        # Cache dos scores do Bert por (pergunta, fragmento, modelo), esvaziado quando a coleção muda
+        # (capacidade 0 desativa; ttl em segundos; arquivo opcional para persistência)
+        self.CACHE_BERT_CAPACIDADE=int(os.getenv('CACHE_BERT_CAPACIDADE', 0))
+        self.CACHE_BERT_TTL=float(os.getenv('CACHE_BERT_TTL')) if os.getenv('CACHE_BERT_TTL') else None
+        self.CACHE_BERT_URL_ARQUIVO=os.getenv('CACHE_BERT_URL_ARQUIVO') or None
+
         self.CONTEXTO_BASE = []
 
+        # Sessões de conversa no servidor: 'memoria', 'sqlite' ou vazio (contexto enviado pelo cliente)
+        self.SESSOES_ARMAZENAMENTO=os.getenv('SESSOES_ARMAZENAMENTO', 'memoria')
+        self.SESSOES_URL_SQLITE=os.getenv('SESSOES_URL_SQLITE', 'api/banco_dados/sessoes.sqlite3')
+        self.SESSOES_MAX=int(os.getenv('SESSOES_MAX', 1000))
+        self.SESSOES_TTL=float(os.getenv('SESSOES_TTL', 3600))
+        self.SESSOES_MAX_MEMORIA_MB=float(os.getenv('SESSOES_MAX_MEMORIA_MB', 256))
+
+        # Registro das interações (pergunta, documentos, scores e tempos): 'sqlite' ou vazio (desativado).
+        # A gravação é feita em segundo plano, em lotes; com a fila cheia, a interação é descartada
+        # ('descartar') ou a resposta aguarda espaço na fila ('bloquear')
+        self.INTERACOES_ARMAZENAMENTO=os.getenv('INTERACOES_ARMAZENAMENTO', '')
+        self.INTERACOES_URL_SQLITE=os.getenv('INTERACOES_URL_SQLITE', 'api/banco_dados/interacoes.sqlite3')
+        self.INTERACOES_TAMANHO_FILA=int(os.getenv('INTERACOES_TAMANHO_FILA', 1000))
+        self.INTERACOES_TAMANHO_LOTE=int(os.getenv('INTERACOES_TAMANHO_LOTE', 50))
+        self.INTERACOES_INTERVALO_GRAVACAO=float(os.getenv('INTERACOES_INTERVALO_GRAVACAO', 2))
+        self.INTERACOES_POLITICA_FILA_CHEIA=os.getenv('INTERACOES_POLITICA_FILA_CHEIA', 'descartar')
+
         with open(os.getenv('URL_INDICE_DOCUMENTOS'), 'r') as arq:
             self.DOCUMENTOS = json.load(arq)
 
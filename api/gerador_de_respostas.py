@@ -1,11 +1,21 @@
+import asyncio
+import hashlib
+import threading
 import torch
+import uuid
 
 from concurrent.futures import ThreadPoolExecutor
 from time import time
-from transformers import BertTokenizer, BertForQuestionAnswering, pipeline
-from typing import Callable
+from typing import Any, Callable, List, Union
 
 from api.environment.environment import environment
+from api.utils import metricas
+from api.utils.cache import CacheLRU, CacheSemanticoRespostas
+from api.utils.gravador_interacoes import GravadorInteracoes
+from api.utils.indice_artigos import IndiceArtigos
+from api.utils.indice_bm25 import IndiceBM25, fundir_rrf
+from api.utils.inferencia import carregar_bert_qa
+from api.utils.politica_rerank import PoliticaRerank
 from api.utils.utils import InterfaceChroma, InterfaceOllama, DadosChat
 from api.utils.mensagem import MensagemControle, MensagemDados, MensagemErro, MensagemInfo
     
@@ -15,110 +25,455 @@ class GeradorDeRespostas:
     Classe cuja função é realizar consulta em um banco de vetores existente e, por meio de uma API de um LLM
     gera uma texto de resposta que condensa as informações resultantes da consulta.
     '''
+    # Intervalo, em segundos, em que a versão da coleção é reaproveitada (ver obter_versao_colecao)
+    INTERVALO_VERSAO_COLECAO = 5
+
     def __init__(self,
                 url_banco_vetores:str=environment.URL_BANCO_VETORES,
                 colecao_de_documentos:str=environment.NOME_COLECAO_DE_DOCUMENTOS,
                 funcao_de_embeddings:Callable=None,
                 fazer_log:bool=True,
-                device: str=None):
+                device: str=None,
+                sobrepor_bert_e_llm: bool=environment.SOBREPOR_BERT_E_LLM,
+                cache_respostas: CacheSemanticoRespostas=None,
+                armazenamento_sessoes: Any=None,
+                gravador_interacoes: GravadorInteracoes=None,
+                carregar_modelos: bool=True,
+                bert_sob_demanda: bool=environment.BERT_CARREGAMENTO_SOB_DEMANDA,
+                backend_bert: str=environment.INFERENCIA_BERT,
+                usar_indice_artigos: bool=environment.INDICE_ARTIGOS,
+                bm25_fusao: bool=environment.BM25_FUSAO,
+                bm25_limiar_fila_embeddings: int=environment.BM25_LIMIAR_FILA_EMBEDDINGS,
+                politica_rerank: PoliticaRerank=None,
+                cache_bert: CacheLRU=None):
 
         self.device = device
-        self.executor = ThreadPoolExecutor(max_workers=environment.THREADPOOL_MAX_WORKERS)
+        self.sobrepor_bert_e_llm = sobrepor_bert_e_llm
+        self.cache_respostas = cache_respostas
+        self.escopo_cache_respostas = None
+        # Quando definido, o contexto das conversas fica no servidor (ver api/utils/sessoes.py)
+        self.armazenamento_sessoes = armazenamento_sessoes
+        # Quando definido, as interações concluídas são gravadas em segundo plano (ver api/utils/gravador_interacoes.py)
+        self.gravador_interacoes = gravador_interacoes
+        # As etapas síncronas (ChromaDB e PyTorch) são executadas fora do event loop, para não travar
+        # os demais streams. Embeddings e Bert têm executores próprios, limitando a concorrência em CPU/GPU
+        self.executor = ThreadPoolExecutor(max_workers=environment.THREADPOOL_MAX_WORKERS, thread_name_prefix='consulta')
+        self.executor_embeddings = ThreadPoolExecutor(max_workers=environment.THREADPOOL_MAX_WORKERS_EMBEDDINGS, thread_name_prefix='embeddings')
+        self.executor_bert = ThreadPoolExecutor(max_workers=environment.THREADPOOL_MAX_WORKERS_BERT, thread_name_prefix='bert')
+        # Limites de concorrência por etapa: o excedente aguarda aqui (de forma cancelável), em vez de se
+        # acumular nas filas dos executores ou do Ollama
+        self.semaforo_embeddings = asyncio.Semaphore(environment.LIMITE_CONCORRENCIA_EMBEDDINGS)
+        self.semaforo_bert = asyncio.Semaphore(environment.LIMITE_CONCORRENCIA_BERT)
+        self.semaforo_llm = asyncio.Semaphore(environment.LIMITE_CONCORRENCIA_LLM)
         
         if fazer_log: print(f'-- Gerador de respostas em inicialização (device={self.device})...')
+        self.fazer_log = fazer_log
+        self.url_banco_vetores = url_banco_vetores
+        self.colecao_de_documentos = colecao_de_documentos
+        self.funcao_de_embeddings = funcao_de_embeddings
 
-        self.interface_chromadb = InterfaceChroma(url_banco_vetores, colecao_de_documentos, funcao_de_embeddings, fazer_log)
-
-        # Carregando modelo e tokenizador pre-treinados
-        # optou-se por não usar pipeline, por ser mais lento que usar o modelo diretamente
-        if fazer_log: print(f'--- preparando modelo e tokenizador do Bert (usando {environment.EMBEDDING_SQUAD_PORTUGUESE})...')
-        self.modelo_bert_qa = BertForQuestionAnswering.from_pretrained(environment.EMBEDDING_SQUAD_PORTUGUESE).to(self.device)
-        self.tokenizador_bert = BertTokenizer.from_pretrained(environment.EMBEDDING_SQUAD_PORTUGUESE, device=self.device)
-        
-        self.modelo_bert_qa_pipeline = pipeline("question-answering", environment.EMBEDDING_SQUAD_PORTUGUESE, device=self.device)
+        # Com carregar_modelos=False, o banco de vetores e o Bert são carregados depois, com carregar_banco_vetores
+        # e carregar_bert (a API os carrega em paralelo, ver api/utils/inicializacao.py). Com bert_sob_demanda,
+        # o Bert só é carregado na primeira pergunta
+        self.interface_chromadb = None
+        self.modelo_bert_qa = None
+        self.tokenizador_bert = None
+        self.bert_sob_demanda = bert_sob_demanda
+        self.backend_bert = backend_bert
+        self.trava_bert = threading.Lock()
+        # Perguntas que citam um artigo ("o que diz o art. 22") são respondidas pelo índice, sem embeddings
+        self.usar_indice_artigos = usar_indice_artigos
+        self.indice_artigos = None
+        # Índice BM25 dos mesmos fragmentos: combinado à busca densa (bm25_fusao) e/ou usado sozinho quando
+        # houver bm25_limiar_fila_embeddings ou mais perguntas aguardando o modelo de embeddings (0 desativa)
+        self.bm25_fusao = bm25_fusao
+        self.bm25_limiar_fila_embeddings = bm25_limiar_fila_embeddings
+        self.indice_bm25 = None
+        self.versao_indices = None
+        self.versao_colecao = None
+        self.momento_versao_colecao = 0
+        self.fila_embeddings = 0
+        # Quantos documentos passam pelo Bert em cada pergunta (ver api/utils/politica_rerank.py)
+        self.politica_rerank = politica_rerank or PoliticaRerank(
+            margem_dominancia=environment.RERANK_MARGEM_DOMINANCIA,
+            janela=environment.RERANK_JANELA,
+            orcamento=environment.RERANK_ORCAMENTO,
+            limiar_fila=environment.RERANK_LIMIAR_FILA_BERT,
+            profundidade_sob_carga=environment.RERANK_PROFUNDIDADE_SOB_CARGA)
+        self.fila_bert = 0
+        # Scores do Bert por (pergunta, fragmento, modelo), válidos enquanto a coleção não mudar
+        self.cache_bert = cache_bert
+        if carregar_modelos:
+            self.carregar_banco_vetores()
+            if not bert_sob_demanda: self.carregar_bert()
 
         if fazer_log: print(f'--- preparando o Llama (usando {environment.MODELO_LLAMA})...')
         self.interface_ollama = InterfaceOllama(url_llama=environment.URL_LLAMA, nome_modelo=environment.MODELO_LLAMA)
 
+    def carregar_banco_vetores(self):
+        self.interface_chromadb = InterfaceChroma(self.url_banco_vetores, self.colecao_de_documentos, self.funcao_de_embeddings, self.fazer_log)
+        if self.usar_indice_artigos or self.usar_bm25(): self.atualizar_indices_lexicos()
+
+    def usar_bm25(self):
+        return self.bm25_fusao or self.bm25_limiar_fila_embeddings > 0
+
+    def atualizar_indices_lexicos(self):
+        '''Monta o índice de artigos e o BM25 a partir dos fragmentos da coleção (uma só leitura do banco).'''
+        versao = self.interface_chromadb.versao_colecao()
+        dados = self.interface_chromadb.colecao_documentos.get(include=['metadatas', 'documents'])
+        if self.usar_indice_artigos:
+            self.indice_artigos = IndiceArtigos(dados['ids'], dados['metadatas'], dados['documents'], versao)
+            if self.fazer_log: print(f'--- índice de artigos montado ({self.indice_artigos.estatisticas()})')
+        if self.usar_bm25():
+            self.indice_bm25 = IndiceBM25(dados['ids'], dados['metadatas'], dados['documents'], versao=versao)
+            if self.fazer_log: print(f'--- índice BM25 montado ({self.indice_bm25.estatisticas()})')
+        self.versao_indices = versao
+
+    async def obter_versao_colecao(self):
+        '''
+        Versão da coleção (ver InterfaceChroma.versao_colecao). A consulta ao ChromaDB é feita fora do event loop
+        e reaproveitada por INTERVALO_VERSAO_COLECAO segundos, em vez de repetida a cada pergunta.
+        '''
+        if self.versao_colecao is None or time() - self.momento_versao_colecao >= self.INTERVALO_VERSAO_COLECAO:
+            loop = asyncio.get_running_loop()
+            self.versao_colecao = await loop.run_in_executor(self.executor, self.interface_chromadb.versao_colecao)
+            self.momento_versao_colecao = time()
+        return self.versao_colecao
+
+    def verificar_versao_indices(self, versao: str=None):
+        # Se o banco de vetores foi atualizado, os índices são montados de novo
+        if versao is None: versao = self.interface_chromadb.versao_colecao()
+        if versao != self.versao_indices: self.atualizar_indices_lexicos()
+
+    def buscar_no_indice_artigos(self, pergunta: str, num_resultados: int, versao: str=None):
+        self.verificar_versao_indices(versao)
+        return self.indice_artigos.buscar(pergunta, num_resultados)
+
+    def buscar_no_indice_bm25(self, pergunta: str, num_resultados: int, versao: str=None):
+        self.verificar_versao_indices(versao)
+        return self.indice_bm25.buscar(pergunta, num_resultados)
+
+    async def consultar_indice_bm25(self, pergunta: str, num_resultados:int=environment.NUM_DOCUMENTOS_RETORNADOS):
+        versao = await self.obter_versao_colecao()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.buscar_no_indice_bm25, pergunta, num_resultados, versao)
+
+    def embeddings_sobrecarregados(self):
+        return self.indice_bm25 is not None and 0 < self.bm25_limiar_fila_embeddings <= self.fila_embeddings
+
+    async def consultar_indice_artigos(self, pergunta: str, num_resultados:int=environment.NUM_DOCUMENTOS_RETORNADOS):
+        '''Documentos do artigo citado na pergunta (no formato do ChromaDB) ou None, se não houver citação.'''
+        if self.indice_artigos is None or self.indice_artigos.interpretar(pergunta) is None: return None
+        versao = await self.obter_versao_colecao()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.buscar_no_indice_artigos, pergunta, num_resultados, versao)
+
+    def carregar_bert(self):
+        with self.trava_bert:
+            if self.modelo_bert_qa is not None: return
+            # Carregando modelo e tokenizador pre-treinados
+            # optou-se por não usar pipeline, por ser mais lento que usar o modelo diretamente
+            # (o trecho de resposta que o pipeline oferecia é calculado em estimar_respostas)
+            if self.fazer_log: print(f'--- preparando modelo e tokenizador do Bert (usando {environment.EMBEDDING_SQUAD_PORTUGUESE}, backend {self.backend_bert})...')
+            self.modelo_bert_qa, self.tokenizador_bert = carregar_bert_qa(
+                environment.EMBEDDING_SQUAD_PORTUGUESE,
+                device=self.device,
+                backend=self.backend_bert,
+                url_modelos_onnx=environment.INFERENCIA_URL_MODELOS_ONNX,
+                fazer_log=self.fazer_log)
+
+    async def gerar_embeddings_pergunta(self, pergunta: str):
+        loop = asyncio.get_running_loop()
+        # fila_embeddings: perguntas aguardando a vez no modelo de embeddings (ver embeddings_sobrecarregados)
+        self.fila_embeddings += 1
+        try:
+            await self.semaforo_embeddings.acquire()
+        finally:
+            self.fila_embeddings -= 1
+        try:
+            return await loop.run_in_executor(self.executor_embeddings, self.interface_chromadb.gerar_embeddings_consulta, pergunta)
+        finally:
+            self.semaforo_embeddings.release()
+
+    async def consultar_documentos_por_embeddings(self, embeddings, num_resultados:int=environment.NUM_DOCUMENTOS_RETORNADOS):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.interface_chromadb.consultar_documentos_por_embeddings, embeddings, num_resultados)
+
     async def consultar_documentos_banco_vetores(self, pergunta: str, num_resultados:int=environment.NUM_DOCUMENTOS_RETORNADOS):
-        return self.interface_chromadb.consultar_documentos(pergunta, num_resultados)
+        embeddings = await self.gerar_embeddings_pergunta(pergunta)
+        return await self.consultar_documentos_por_embeddings(embeddings, num_resultados)
     
     def formatar_lista_documentos(self, documentos: dict):
-        return [
+        lista_documentos = [
             {
                 'id': documentos['ids'][0][idx],
-                 'score_distancia': 1 - documentos['distances'][0][idx], # Distância do cosseno vaia entre 1 e 0
+                 # Distância do cosseno vaia entre 1 e 0 (nula quando a recuperação foi só pelo BM25)
+                 'score_distancia': 1 - documentos['distances'][0][idx] if documentos['distances'][0][idx] is not None else None,
                  'metadados': documentos['metadatas'][0][idx],
                  'conteudo': f"{documentos['documents'][0][idx]}"
             }
             for idx in range(len(documentos['ids'][0]))]
+        # Scores das recuperações léxica e híbrida, em campos próprios
+        for chave, campo in (('scores_bm25', 'score_bm25'), ('scores_rrf', 'score_rrf')):
+            if chave in documentos:
+                for documento, score in zip(lista_documentos, documentos[chave][0]): documento[campo] = score
+        return lista_documentos
 
-    async def estimar_resposta(self, pergunta, texto_documento: str):
-        # Optou-se por não utilizar a abordagem com pipeline por ser mais lenta
-        res = self.modelo_bert_qa_pipeline(question=pergunta, context=texto_documento)
-        inputs = self.tokenizador_bert.encode_plus(
-            pergunta,
-            texto_documento,
+    async def estimar_respostas(self, pergunta: str, textos_documentos: List[str], comprimento_max_resposta: int=15, ids_documentos: List[str]=None):
+        '''
+        Com ids_documentos e cache_bert, só os documentos ausentes do cache passam pelo Bert.
+        Retorna as respostas e a quantidade de documentos que passaram pelo modelo.
+        '''
+        loop = asyncio.get_running_loop()
+        self.fila_bert += 1
+        try:
+            await self.semaforo_bert.acquire()
+        finally:
+            self.fila_bert -= 1
+        try:
+            if self.cache_bert is not None and ids_documentos is not None:
+                versao_colecao = await self.obter_versao_colecao()
+                return await loop.run_in_executor(
+                    self.executor_bert, self.aplicar_bert_com_cache, pergunta, textos_documentos, ids_documentos, comprimento_max_resposta, versao_colecao)
+            respostas = await loop.run_in_executor(self.executor_bert, self.aplicar_bert, pergunta, textos_documentos, comprimento_max_resposta)
+            return respostas, len(textos_documentos)
+        finally:
+            self.semaforo_bert.release()
+
+    @staticmethod
+    def listar_perguntas(pergunta: Union[str, List[str]], qtd_documentos: int):
+        # Uma só pergunta para todos os documentos ou uma pergunta por documento (avaliação em lote)
+        return pergunta if isinstance(pergunta, list) else [pergunta] * qtd_documentos
+
+    def obter_chaves_cache_bert(self, pergunta: Union[str, List[str]], ids_documentos: List[str], comprimento_max_resposta: int):
+        # O Bert diferencia maiúsculas de minúsculas: a pergunta só é normalizada quanto aos espaços
+        hashes = {texto: hashlib.sha256(' '.join(texto.split()).encode('utf-8')).hexdigest() for texto in set(self.listar_perguntas(pergunta, 1))}
+        modelo = f'{environment.EMBEDDING_SQUAD_PORTUGUESE}:{self.backend_bert}:{comprimento_max_resposta}'
+        return [
+            (hashes[texto], id_documento, modelo)
+            for texto, id_documento in zip(self.listar_perguntas(pergunta, len(ids_documentos)), ids_documentos)]
+
+    def aplicar_bert_com_cache(self, pergunta: Union[str, List[str]], textos_documentos: List[str], ids_documentos: List[str], comprimento_max_resposta: int=15, versao_colecao: str=None):
+        '''Retorna as respostas e a quantidade de documentos calculados pelo Bert (ausentes do cache).'''
+        # Se o banco de vetores foi atualizado, os scores anteriores deixam de valer
+        if versao_colecao is None: versao_colecao = self.interface_chromadb.versao_colecao()
+        self.cache_bert.definir_escopo(f'{self.interface_chromadb.nome_colecao}:{versao_colecao}')
+        chaves = self.obter_chaves_cache_bert(pergunta, ids_documentos, comprimento_max_resposta)
+        resultados = [self.cache_bert.obter(chave) for chave in chaves]
+        ausentes = [idx for idx, resultado in enumerate(resultados) if resultado is None]
+        if ausentes:
+            perguntas = self.listar_perguntas(pergunta, len(textos_documentos))
+            calculados = self.aplicar_bert(
+                [perguntas[idx] for idx in ausentes], [textos_documentos[idx] for idx in ausentes], comprimento_max_resposta)
+            for idx, resultado in zip(ausentes, calculados):
+                self.cache_bert.inserir(chaves[idx], resultado)
+                resultados[idx] = resultado
+        return resultados, len(ausentes)
+
+    def aplicar_bert(self, pergunta: Union[str, List[str]], textos_documentos: List[str], comprimento_max_resposta: int=15):
+        '''
+        Aplica o Bert a todos os documentos recuperados em um único lote (batch), com uma só passagem pelo modelo.
+        Os scores e a resposta de cada documento são calculados com operações vetorizadas sobre os tensores.
+        pergunta pode ser uma lista, com uma pergunta por documento (pares de várias perguntas no mesmo lote).
+        '''
+        if not textos_documentos: return []
+        if self.modelo_bert_qa is None: self.carregar_bert()
+
+        entradas = self.tokenizador_bert(
+            self.listar_perguntas(pergunta, len(textos_documentos)),
+            textos_documentos,
             return_tensors="pt",
+            padding=True,
             truncation=True,
             max_length=512
         )
 
-        inputs = {key: value.to(self.device) for key, value in inputs.items()}
-        
+        entradas = {chave: valor.to(self.device) for chave, valor in entradas.items()}
+
         with torch.no_grad():
-            outputs = self.modelo_bert_qa(**inputs)
+            saidas = self.modelo_bert_qa(**entradas)
 
         # AFAZER: Avaliar se score ponderado faz sentido
-        # Extraindo os logits como tensores
-        logits_inicio = outputs.start_logits
-        logits_fim = outputs.end_logits
+        # Extraindo os logits como tensores (um documento por linha)
+        logits_inicio = saidas.start_logits
+        logits_fim = saidas.end_logits
 
-        # Obtenção dos logits positivos
-        logits_inicio_positivos = logits_inicio[0][logits_inicio[0] > 0]
-        logits_fim_positivos = logits_fim[0][logits_fim[0] > 0]
+        # Desconsidera os tokens de padding em todos os cálculos
+        mascara = entradas['attention_mask'].bool()
+        logits_inicio_validos = logits_inicio.masked_fill(~mascara, float('-inf'))
+        logits_fim_validos = logits_fim.masked_fill(~mascara, float('-inf'))
 
-        # Média dos logits positivos
-        media_logits_inicio_positivos = logits_inicio_positivos.mean().item() if logits_inicio_positivos.numel() > 0 else 0
-        media_logits_fim_positivos = logits_fim_positivos.mean().item() if logits_fim_positivos.numel() > 0 else 0
+        # Média dos logits positivos (0 quando não há logits positivos)
+        positivos_inicio = (logits_inicio > 0) & mascara
+        positivos_fim = (logits_fim > 0) & mascara
+        medias_logits_inicio_positivos = (logits_inicio * positivos_inicio).sum(dim=1) / positivos_inicio.sum(dim=1).clamp(min=1)
+        medias_logits_fim_positivos = (logits_fim * positivos_fim).sum(dim=1) / positivos_fim.sum(dim=1).clamp(min=1)
+        medias_logits_positivos = (medias_logits_inicio_positivos + medias_logits_fim_positivos) / 2
 
         # Obtendo os índices e valores dos melhores logits
-        indice_melhor_logit_inicio = logits_inicio[0].argmax().item()
-        melhor_logit_inicio = logits_inicio[0][indice_melhor_logit_inicio].item()
-
-        indice_melhor_logit_fim = logits_fim[0].argmax().item()
-        melhor_logit_fim = logits_fim[0][indice_melhor_logit_fim].item()
-
-        # Calcula media_logits_positivos
-        media_logits_positivos = (media_logits_inicio_positivos + media_logits_fim_positivos) / 2
+        melhores_logits_inicio, indices_melhor_logit_inicio = logits_inicio_validos.max(dim=1)
+        melhores_logits_fim, indices_melhor_logit_fim = logits_fim_validos.max(dim=1)
 
-        # scores em formato float para serialização com JSON
-        score = float(melhor_logit_inicio + melhor_logit_fim)
-        score_ponderado = float(score * media_logits_positivos)
+        scores = melhores_logits_inicio + melhores_logits_fim
+        scores_ponderados = scores * medias_logits_positivos
 
         # calculando score estimado
-        start_logits_softmax = torch.softmax(logits_inicio, dim=-1)
-        end_logits_softmax = torch.softmax(logits_fim, dim=-1)
-        score_estimado = float(torch.max(start_logits_softmax).item() * torch.max(end_logits_softmax).item())
+        scores_estimados = torch.softmax(logits_inicio_validos, dim=-1).max(dim=1).values * torch.softmax(logits_fim_validos, dim=-1).max(dim=1).values
+
+        # Melhor trecho de resposta, nos moldes do pipeline de question-answering do transformers:
+        # considera somente tokens do documento, com fim após o início e no máximo comprimento_max_resposta tokens
+        tokens_contexto = (entradas['token_type_ids'] == 1) & mascara & (entradas['input_ids'] != self.tokenizador_bert.sep_token_id)
+        probabilidades_inicio = torch.softmax(logits_inicio.masked_fill(~tokens_contexto, -10000.0), dim=-1)
+        probabilidades_fim = torch.softmax(logits_fim.masked_fill(~tokens_contexto, -10000.0), dim=-1)
+        comprimento_sequencia = logits_inicio.shape[1]
+        trechos_validos = torch.tril(torch.triu(torch.ones(comprimento_sequencia, comprimento_sequencia, device=logits_inicio.device)), comprimento_max_resposta - 1)
+        candidatos = probabilidades_inicio.unsqueeze(2) * probabilidades_fim.unsqueeze(1) * trechos_validos
+        scores_trecho, indices_trecho = candidatos.flatten(start_dim=1).max(dim=1)
+        indices_inicio_trecho = indices_trecho // comprimento_sequencia
+        indices_fim_trecho = indices_trecho % comprimento_sequencia
 
         # score: soma do melhor Logit inicial com o melhor logit final
+        # score_trecho: probabilidade do melhor trecho de resposta (equivalente ao score do pipeline)
         # score_estimado: multiplicação do softmax dos logits de inicio pelo dos logits de fim
-        # -- (manter somente se a performance do score do Bert pelo pipeline ficar lenta)
         # score_ponderado: score ponderado pela média dos logits de inicio e fim, só quando positivos 
         # -- (quanto mais logits positivos, mais o documento tem melhor avaliação)
 
-        tokens_resposta = inputs['input_ids'][0][indice_melhor_logit_inicio:indice_melhor_logit_fim + 1]
-        resposta = self.tokenizador_bert.decode(tokens_resposta, skip_special_tokens=True)
-        
-        return {
-            'resposta': (resposta, res['answer']),
-            'score': (score, res['score'], score_estimado),
-            'score_ponderado': score_ponderado
-        }
+        # scores em formato float para serialização com JSON
+        scores, scores_trecho, scores_estimados, scores_ponderados = (
+            scores.tolist(), scores_trecho.tolist(), scores_estimados.tolist(), scores_ponderados.tolist())
+        indices_melhor_logit_inicio, indices_melhor_logit_fim = indices_melhor_logit_inicio.tolist(), indices_melhor_logit_fim.tolist()
+        indices_inicio_trecho, indices_fim_trecho = indices_inicio_trecho.tolist(), indices_fim_trecho.tolist()
+
+        resultados = []
+        for idx in range(len(textos_documentos)):
+            ids_documento = entradas['input_ids'][idx]
+            resposta = self.tokenizador_bert.decode(
+                ids_documento[indices_melhor_logit_inicio[idx]:indices_melhor_logit_fim[idx] + 1], skip_special_tokens=True)
+            resposta_trecho = self.tokenizador_bert.decode(
+                ids_documento[indices_inicio_trecho[idx]:indices_fim_trecho[idx] + 1], skip_special_tokens=True)
+            resultados.append({
+                'resposta': (resposta, resposta_trecho),
+                'score': (float(scores[idx]), float(scores_trecho[idx]), float(scores_estimados[idx])),
+                'score_ponderado': float(scores_ponderados[idx])
+            })
+        return resultados
+
+    async def estimar_resposta(self, pergunta, texto_documento: str):
+        respostas, _ = await self.estimar_respostas(pergunta, [texto_documento])
+        return respostas[0]
+
+    async def atribuir_scores_bert(self, pergunta: str, lista_documentos: List[dict], fazer_log:bool=True, profundidade: int=None):
+        '''
+        Atribui aos documentos (in place) os scores do Bert. Retorna o tempo gasto e se houve falha.
+        Com profundidade, só os primeiros documentos são avaliados (os demais ficam com scores nulos).
+        '''
+        marcador_tempo_inicio = time()
+        falha = False
+        avaliados = lista_documentos if profundidade is None else lista_documentos[:profundidade]
+        # Documentos que passaram pelo modelo (os encontrados no cache_bert não entram na estimativa de tempo)
+        qtd_calculados = 0
+        try:
+            if avaliados:
+                respostas_estimadas, qtd_calculados = await self.estimar_respostas(
+                    pergunta, [documento['conteudo'] for documento in avaliados], ids_documentos=[documento['id'] for documento in avaliados])
+            else:
+                respostas_estimadas = []
+        except Exception:
+            respostas_estimadas = [None] * len(avaliados)
+            falha = True
+        respostas_estimadas += [None] * (len(lista_documentos) - len(avaliados))
+        for documento, resposta_estimada in zip(lista_documentos, respostas_estimadas):
+            documento['score_bert'] = resposta_estimada['score'] if resposta_estimada else None
+            documento['score_ponderado'] = resposta_estimada['score_ponderado'] if resposta_estimada else None
+            documento['resposta_bert'] = resposta_estimada['resposta'] if resposta_estimada else None
+        marcador_tempo_fim = time()
+        tempo_bert = marcador_tempo_fim - marcador_tempo_inicio
+        if not falha and qtd_calculados: self.politica_rerank.registrar_tempo(tempo_bert, qtd_calculados)
+        if fazer_log: print(f'--- scores atribuídos a {len(avaliados)} de {len(lista_documentos)} documento(s) ({tempo_bert} segundos)')
+        return tempo_bert, falha
+
+    def obter_escopo_cache_respostas(self, versao_colecao: str):
+        return (
+            self.interface_chromadb.nome_colecao,
+            versao_colecao,
+            environment.MODELO_DE_EMBEDDINGS,
+            getattr(self.interface_chromadb.funcao_de_embeddings, 'instrucao', None),
+            environment.MODELO_LLAMA)
+
+    def buscar_resposta_em_cache(self, embedding_pergunta, versao_colecao: str):
+        escopo = self.obter_escopo_cache_respostas(versao_colecao)
+        # Se o banco de vetores foi regerado, as respostas anteriores deixam de valer
+        if escopo != self.escopo_cache_respostas:
+            self.cache_respostas.invalidar()
+            self.escopo_cache_respostas = escopo
+        return self.cache_respostas.buscar(escopo, embedding_pergunta)
+
+    def formatar_conteudo_resposta(self, conteudo: dict, id_sessao: str=None):
+        # Com sessões, o contexto do Ollama fica no servidor e não é enviado ao cliente
+        if not id_sessao: return conteudo
+        return dict(
+            conteudo,
+            resposta_llama={chave: valor for chave, valor in conteudo['resposta_llama'].items() if chave != 'context'},
+            id_sessao=id_sessao)
+
+    # O armazenamento de sessões pode ser em SQLite (leitura e gravação em disco): fora do event loop
+    async def obter_contexto_sessao(self, id_sessao: str):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.armazenamento_sessoes.obter_contexto, id_sessao)
+
+    async def salvar_contexto_sessao(self, id_sessao: str, contexto: List[int]):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.armazenamento_sessoes.salvar_contexto, id_sessao, contexto)
+
+    def reproduzir_resposta_em_cache(self, pergunta: str, resposta_em_cache: dict, id_sessao: str=None):
+        '''Reproduz uma resposta do cache no mesmo formato de mensagens de uma resposta gerada pelo Llama.'''
+        yield MensagemControle(
+            descricao='Informação de Status',
+            dados={'tag':'status', 'conteudo':'Gerando resposta'}
+            ).json() + '\n'
+        for fragmento in resposta_em_cache['fragmentos']:
+            yield MensagemDados(
+                descricao='Fragmento de Resposta do LLM',
+                dados={
+                    'tag': 'frag-resposta-llm',
+                    'conteudo': fragmento
+                }
+                ).json() + '\n'
+        yield MensagemDados(
+                descricao='Resposta completa',
+                dados={
+                    'tag': 'resposta-completa-llm',
+                    'conteudo': self.formatar_conteudo_resposta(dict(
+                        resposta_em_cache['conteudo'],
+                        pergunta=pergunta,
+                        cache_respostas={
+                            'pergunta_original': resposta_em_cache['pergunta'],
+                            'similaridade': resposta_em_cache['similaridade']
+                        }), id_sessao)
+                }
+            ).json()
+
+    def registrar_metricas_llama(self, resposta_final: dict, tempo_inicio_resposta: float, tempo_llama: float):
+        metricas.tempo_inicio_resposta.observar(tempo_inicio_resposta)
+        metricas.tempo_llama_total.observar(tempo_llama)
+        # eval_count e eval_duration (em nanossegundos) vêm no último registro do stream do Ollama
+        num_tokens = resposta_final.get('eval_count')
+        duracao = resposta_final.get('eval_duration')
+        if num_tokens and duracao:
+            metricas.tokens_gerados.incrementar(num_tokens)
+            metricas.tempo_geracao_tokens.incrementar(duracao / 10**9)
+            metricas.tokens_por_segundo.observar(num_tokens / (duracao / 10**9))
 
     async def consultar(self, dados_chat: DadosChat, fazer_log:bool=True):
         contexto = dados_chat.contexto
         pergunta = dados_chat.pergunta
+
+        # Recupera o contexto da sessão (sessões expiradas ou desconhecidas recomeçam a conversa).
+        # Clientes que enviam o próprio contexto continuam sendo atendidos sem sessão
+        id_sessao = None
+        if self.armazenamento_sessoes is not None and not contexto:
+            id_sessao = dados_chat.id_sessao or uuid.uuid4().hex
+            if dados_chat.id_sessao: contexto = await self.obter_contexto_sessao(id_sessao) or []
         
         if len(pergunta.split(' ')) > 300:
             #AFAZER: decidir se mantém essa limitação. Colocada a princípio para evitar
@@ -127,6 +482,7 @@ class GeradorDeRespostas:
                     descricao='Pergunta com mais de 300 palavras',
                     mensagem='Por motivos de segurança, a pergunta deve ter no máximo 300 palavras. Por favor, reformule o que você deseja perguntar, para ficar dentro desse limite.'
                 ).json() + '\n'
+            metricas.erros.incrementar(tipo='pergunta_longa')
             print('CONCLUÍDO POR ERRO: pergunta com mais de 300 palavras.')
             return
 
@@ -138,100 +494,155 @@ class GeradorDeRespostas:
         
         # Recuperando documentos usando o ChromaDB
         marcador_tempo_inicio = time()
+        # O cache de respostas só é usado no início das conversas, já que a resposta depende do contexto
+        usar_cache_respostas = self.cache_respostas is not None and not contexto
+        resposta_em_cache = None
+        embeddings_pergunta = None
         try:
-            documentos = await self.consultar_documentos_banco_vetores(pergunta)
-            lista_documentos = self.formatar_lista_documentos(documentos)
+            documentos = await self.consultar_indice_artigos(pergunta)
+            metodo_recuperacao = 'densa' if documentos is None else 'indice_artigos'
+            if documentos is None and self.embeddings_sobrecarregados():
+                # Muitas perguntas aguardando o modelo de embeddings: responde só com o BM25
+                documentos = await self.consultar_indice_bm25(pergunta)
+                metodo_recuperacao = 'bm25'
+            if documentos is None:
+                embeddings_pergunta = await self.gerar_embeddings_pergunta(pergunta)
+                if usar_cache_respostas:
+                    versao_colecao = await self.obter_versao_colecao()
+                    resposta_em_cache = self.buscar_resposta_em_cache(embeddings_pergunta[0], versao_colecao)
+                if not resposta_em_cache and self.bm25_fusao and self.indice_bm25 is not None:
+                    # Mais candidatos de cada busca, combinados por reciprocal rank fusion
+                    num_candidatos = 2 * environment.NUM_DOCUMENTOS_RETORNADOS
+                    documentos = fundir_rrf([
+                        await self.consultar_documentos_por_embeddings(embeddings_pergunta, num_candidatos),
+                        await self.consultar_indice_bm25(pergunta, num_candidatos)], environment.NUM_DOCUMENTOS_RETORNADOS)
+                    # Fragmentos vindos só do BM25 recebem a distância do cosseno, para score_distancia ter uma só escala
+                    documentos = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, self.interface_chromadb.completar_distancias, documentos, embeddings_pergunta)
+                    metodo_recuperacao = 'fusao_rrf'
+                elif not resposta_em_cache: documentos = await self.consultar_documentos_por_embeddings(embeddings_pergunta)
+            if not resposta_em_cache: lista_documentos = self.formatar_lista_documentos(documentos)
         except Exception as excecao:
             yield MensagemErro(
                 descricao='Falha na Consulta ao Banco Vetorial',
                 mensagem=f'Houve um problema na consulta de documentos. Tente mais tarde. (Tipo do erro: {excecao.__class__.__name__})'
             ).json() + '\n'
+            metricas.erros.incrementar(tipo='consulta_banco_vetores')
+            return
+
+        if resposta_em_cache:
+            if fazer_log: print(f'--- resposta recuperada do cache (similaridade {resposta_em_cache["similaridade"]} com "{resposta_em_cache["pergunta"]}")')
+            if id_sessao: await self.salvar_contexto_sessao(id_sessao, resposta_em_cache['conteudo']['resposta_llama'].get('context', []))
+            for mensagem in self.reproduzir_resposta_em_cache(pergunta, resposta_em_cache, id_sessao): yield mensagem
+            metricas.respostas.incrementar(origem='cache')
+            print('Concluído')
             return
             
         marcador_tempo_fim = time()
         tempo_consulta = marcador_tempo_fim - marcador_tempo_inicio
-        if fazer_log: print(f'--- consulta no banco concluída ({tempo_consulta} segundos)')
+        if fazer_log: print(f'--- consulta no banco concluída ({tempo_consulta} segundos, recuperação {metodo_recuperacao})')
+        metricas.tempo_consulta.observar(tempo_consulta)
+        metricas.recuperacoes.incrementar(metodo=metodo_recuperacao)
 
         # Atribuindo scores usando Bert
-        if fazer_log: print(f'--- aplicando scores do Bert aos documentos recuperados...')
-        marcador_tempo_inicio = time()
-        for documento in lista_documentos:
+        # O prompt do Llama não depende dos scores do Bert. No modo com sobreposição, a geração da
+        # resposta começa logo após a consulta e os scores são calculados ao mesmo tempo.
+        decisao_rerank = self.politica_rerank.decidir(
+            [documento['score_distancia'] for documento in lista_documentos], tempo_decorrido=tempo_consulta, fila_bert=self.fila_bert,
+            recuperacao=metodo_recuperacao)
+        if fazer_log: print(f'--- aplicando scores do Bert aos documentos recuperados (profundidade {decisao_rerank["profundidade"]}, {", ".join(decisao_rerank["motivos"])})...')
+        metricas.profundidade_rerank.observar(decisao_rerank['profundidade'])
+        tarefa_bert = asyncio.ensure_future(self.atribuir_scores_bert(pergunta, lista_documentos, fazer_log, decisao_rerank['profundidade']))
+        # Se o cliente desconectar durante o stream, o Bert deixa de ocupar o executor
+        try:
+            if not self.sobrepor_bert_e_llm: await asyncio.wait([tarefa_bert])
+
+            # Gerando resposta utilizando o Llama
+            if fazer_log: print(f'--- gerando resposta com o Llama')
+            yield MensagemControle(
+                descricao='Informação de Status',
+                dados={'tag':'status', 'conteudo':'Gerando resposta'}
+                ).json() + '\n'
+        
             try:
-                resposta_estimada = await self.estimar_resposta(pergunta, documento['conteudo'])
-                documento['score_bert'] = resposta_estimada['score']
-                documento['score_ponderado'] = resposta_estimada['score_ponderado']
-                documento['resposta_bert'] = resposta_estimada['resposta']
+                marcador_tempo_inicio = time()
+                texto_resposta_llama = ''
+                fragmentos_resposta = []
+                flag_tempo_resposta = False
+                tempo_inicio_resposta = None
+                # Não são enviadas ao Ollama mais gerações simultâneas que ele consegue atender
+                async with self.semaforo_llm:
+                    async for item in self.interface_ollama.gerar_resposta_llama(
+                                pergunta=pergunta,
+                                # Inclui o título dos documentos no prompt do Llama
+                                documentos=[f"{doc[0]['titulo']} - {doc[1]}" for doc in zip(documentos['metadatas'][0], documentos['documents'][0])],
+                                contexto=contexto):
+                    
+                        texto_resposta_llama += item['response']
+                        fragmentos_resposta.append(item['response'])
+                        yield MensagemDados(
+                            descricao='Fragmento de Resposta do LLM',
+                            dados={
+                                'tag': 'frag-resposta-llm',
+                                'conteudo': item['response']
+                            }
+                            ).json() + '\n'
+                        if not flag_tempo_resposta:
+                            flag_tempo_resposta = True
+                            tempo_inicio_resposta = time() - marcador_tempo_inicio
+                            if fazer_log: print(f'----- iniciou retorno da resposta ({tempo_inicio_resposta} segundos)')
+
+                item['response'] = texto_resposta_llama
+                marcador_tempo_fim = time()
+                tempo_llama = marcador_tempo_fim - marcador_tempo_inicio
+                if fazer_log: print(f'--- resposta do Llama concluída ({tempo_llama} segundos)')
+                self.registrar_metricas_llama(item, tempo_inicio_resposta, tempo_llama)
             except Exception as excecao:
-                documento['score_bert'] = None
-                documento['score_ponderado'] = None
-                documento['resposta_bert'] = None
-                yield MensagemInfo(
-                    descricao='Falha na aplicação do BERT',
-                    mensagem='Houve erro na aplicação dos valores, mas o processo continuou. Scores atribuídos com valor nulo'
+                yield MensagemErro(
+                    descricao=f'Falha na Geração da Resposta (Ollama offline ou {environment.MODELO_LLAMA} não disponível. {excecao.__class__.__name__})',
+                    mensagem=f'Houve um problema geração de sua resposta. Tente mais tarde. (Tipo do erro: {excecao.__class__.__name__})'
                 ).json() + '\n'
-        marcador_tempo_fim = time()
-        tempo_bert = marcador_tempo_fim - marcador_tempo_inicio
-        if fazer_log: print(f'--- scores atribuídos ({tempo_bert} segundos)')
+                print(f'CONCLUÍDO POR ERRO: Falha na conexão com o LLM. Ollama offline ou {environment.MODELO_LLAMA} não disponível. {excecao.__class__.__name__}')
+                metricas.erros.incrementar(tipo='geracao_llm')
+                return
         
-        # Gerando resposta utilizando o Llama
-        if fazer_log: print(f'--- gerando resposta com o Llama')
-        yield MensagemControle(
-            descricao='Informação de Status',
-            dados={'tag':'status', 'conteudo':'Gerando resposta'}
+            tempo_bert, falha_bert = await tarefa_bert
+        finally:
+            if not tarefa_bert.done(): tarefa_bert.cancel()
+        metricas.tempo_bert.observar(tempo_bert)
+        if falha_bert:
+            metricas.erros.incrementar(tipo='bert')
+            yield MensagemInfo(
+                descricao='Falha na aplicação do BERT',
+                mensagem='Houve erro na aplicação dos valores, mas o processo continuou. Scores atribuídos com valor nulo'
             ).json() + '\n'
-        
-        try:
-            marcador_tempo_inicio = time()
-            texto_resposta_llama = ''
-            flag_tempo_resposta = False
-            async for item in self.interface_ollama.gerar_resposta_llama(
-                        pergunta=pergunta,
-                        # Inclui o título dos documentos no prompt do Llama
-                        documentos=[f"{doc[0]['titulo']} - {doc[1]}" for doc in zip(documentos['metadatas'][0], documentos['documents'][0])],
-                        contexto=contexto):
-                
-                texto_resposta_llama += item['response']
-                yield MensagemDados(
-                    descricao='Fragmento de Resposta do LLM',
-                    dados={
-                        'tag': 'frag-resposta-llm',
-                        'conteudo': item['response']
-                    }
-                    ).json() + '\n'
-                if not flag_tempo_resposta:
-                    flag_tempo_resposta = True
-                    tempo_inicio_resposta = time() - marcador_tempo_inicio
-                    if fazer_log: print(f'----- iniciou retorno da resposta ({tempo_inicio_resposta} segundos)')
-
-            item['response'] = texto_resposta_llama
-            marcador_tempo_fim = time()
-            tempo_llama = marcador_tempo_fim - marcador_tempo_inicio
-            if fazer_log: print(f'--- resposta do Llama concluída ({tempo_llama} segundos)')
-        except Exception as excecao:
-            yield MensagemErro(
-                descricao=f'Falha na Geração da Resposta (Ollama offline ou {environment.MODELO_LLAMA} não disponível. {excecao.__class__.__name__})',
-                mensagem=f'Houve um problema geração de sua resposta. Tente mais tarde. (Tipo do erro: {excecao.__class__.__name__})'
-            ).json() + '\n'
-            print(f'CONCLUÍDO POR ERRO: Falha na conexão com o LLM. Ollama offline ou {environment.MODELO_LLAMA} não disponível. {excecao.__class__.__name__}')
-            return
-        
 
         # Retornando dados compilados
+        conteudo = {
+            "pergunta": pergunta,
+            "documentos": lista_documentos,
+            "resposta_llama": item,
+            "resposta": texto_resposta_llama.replace('\n\n', '\n'),
+            "tempo_consulta": tempo_consulta,
+            "recuperacao": metodo_recuperacao,
+            "rerank": decisao_rerank,
+            "tempo_bert": tempo_bert,
+            "tempo_inicio_resposta": tempo_inicio_resposta,
+            "tempo_llama_total": tempo_llama
+        }
+        if id_sessao: await self.salvar_contexto_sessao(id_sessao, item.get('context', []))
+        # Registrada antes do envio da resposta completa, para não se perder se o cliente desconectar
+        if self.gravador_interacoes is not None: await self.gravador_interacoes.registrar(conteudo)
         yield MensagemDados(
                 descricao='Resposta completa',
                 dados={
                     'tag': 'resposta-completa-llm',
-                    'conteudo': {
-                        "pergunta": pergunta,
-                        "documentos": lista_documentos,
-                        "resposta_llama": item,
-                        "resposta": texto_resposta_llama.replace('\n\n', '\n'),
-                        "tempo_consulta": tempo_consulta,
-                        "tempo_bert": tempo_bert,
-                        "tempo_inicio_resposta": tempo_inicio_resposta,
-                        "tempo_llama_total": tempo_llama
-                    }
+                    'conteudo': self.formatar_conteudo_resposta(conteudo, id_sessao)
                 }
             ).json()
-        print('Concluído')
 
+        metricas.respostas.incrementar(origem='llm')
+
+        if usar_cache_respostas and not falha_bert and embeddings_pergunta is not None:
+            self.cache_respostas.inserir(self.obter_escopo_cache_respostas(versao_colecao), embeddings_pergunta[0], pergunta, fragmentos_resposta, conteudo)
+        print('Concluído')
@@ -0,0 +1,178 @@
+## Compara um backend de inferência quantizado (ver api/utils/inferencia.py) com o fp32, nas perguntas de um
+## conjunto de avaliação (mesmo formato usado em avaliar_recuperacao_documentos.py): tempo de encoding, similaridade
+## dos embeddings, concordância dos documentos recuperados e diferença nos scores do Bert
+print('Importando bibliotecas...')
+import argparse
+import json
+import os
+from time import time
+
+import chromadb
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from ..environment.environment import environment
+from ..gerador_de_respostas import GeradorDeRespostas
+from ..utils.inferencia import BACKENDS_BERT, BACKENDS_EMBEDDINGS
+from ..utils.utils import FuncaoEmbeddings
+
+URL_LOCAL = os.path.abspath(os.path.join(os.path.dirname(__file__), "./"))
+DEVICE = 'cpu'
+
+
+def carregar_perguntas(url_arquivo_entrada: str, max_perguntas: int=None):
+    with open(url_arquivo_entrada, 'r') as arq:
+        docs = json.load(arq)
+    perguntas = [
+        {'id': item['id'], 'pergunta': pergunta['pergunta']}
+        for item in docs['dados'] for pergunta in item['perguntas'] if pergunta.get('resposta')]
+    return perguntas[:max_perguntas] if max_perguntas else perguntas
+
+def medir_encoding(funcao_de_embeddings: FuncaoEmbeddings, textos, tamanho_lote: int):
+    # Uma passagem de aquecimento, para não medir a alocação inicial
+    funcao_de_embeddings.gerar_embeddings(textos[:tamanho_lote])
+    marcador_tempo_inicio = time()
+    embeddings = []
+    for idx in range(0, len(textos), tamanho_lote):
+        embeddings += funcao_de_embeddings.gerar_embeddings(textos[idx:idx + tamanho_lote])
+    return np.array(embeddings), time() - marcador_tempo_inicio
+
+def concordancia_pares(scores_referencia, scores_avaliados):
+    '''Fração dos pares de documentos ordenados da mesma forma pelos dois conjuntos de scores (tau de Kendall normalizado).'''
+    pares = [(i, j) for i in range(len(scores_referencia)) for j in range(i + 1, len(scores_referencia))]
+    if not pares: return 1.0
+    return sum(
+        (scores_referencia[i] - scores_referencia[j]) * (scores_avaliados[i] - scores_avaliados[j]) >= 0
+        for i, j in pares) / len(pares)
+
+def comparar_recuperacao(colecao, perguntas, embeddings_referencia, embeddings_avaliados, num_resultados: int):
+    resultados_referencia = colecao.query(query_embeddings=embeddings_referencia.tolist(), n_results=num_resultados)
+    resultados_avaliados = colecao.query(query_embeddings=embeddings_avaliados.tolist(), n_results=num_resultados)
+    top1, sobreposicao, acertos_referencia, acertos_avaliados = 0, 0, 0, 0
+    for idx, pergunta in enumerate(perguntas):
+        ids_referencia = resultados_referencia['ids'][idx]
+        ids_avaliados = resultados_avaliados['ids'][idx]
+        top1 += ids_referencia[:1] == ids_avaliados[:1]
+        sobreposicao += len(set(ids_referencia) & set(ids_avaliados)) / max(1, len(ids_referencia))
+        acertos_referencia += pergunta['id'] in ids_referencia
+        acertos_avaliados += pergunta['id'] in ids_avaliados
+    qtd_perguntas = len(perguntas)
+    return {
+        'concordancia_top1': top1 / qtd_perguntas,
+        f'sobreposicao_top{num_resultados}': sobreposicao / qtd_perguntas,
+        f'acerto_top{num_resultados}_fp32': acertos_referencia / qtd_perguntas,
+        f'acerto_top{num_resultados}_avaliado': acertos_avaliados / qtd_perguntas,
+    }, resultados_referencia
+
+def comparar_bert(gerador_referencia: GeradorDeRespostas, gerador_avaliado: GeradorDeRespostas, perguntas, documentos):
+    diferencas, concordancias, top1 = [], [], 0
+    tempo_referencia, tempo_avaliado = 0, 0
+    for idx, pergunta in enumerate(perguntas):
+        textos = documentos['documents'][idx]
+        marcador_tempo_inicio = time()
+        respostas_referencia = gerador_referencia.aplicar_bert(pergunta['pergunta'], textos)
+        tempo_referencia += time() - marcador_tempo_inicio
+        marcador_tempo_inicio = time()
+        respostas_avaliadas = gerador_avaliado.aplicar_bert(pergunta['pergunta'], textos)
+        tempo_avaliado += time() - marcador_tempo_inicio
+
+        scores_referencia = [resposta['score'][0] for resposta in respostas_referencia]
+        scores_avaliados = [resposta['score'][0] for resposta in respostas_avaliadas]
+        diferencas += [abs(a - b) for a, b in zip(scores_referencia, scores_avaliados)]
+        concordancias.append(concordancia_pares(scores_referencia, scores_avaliados))
+        top1 += int(np.argmax(scores_referencia) == np.argmax(scores_avaliados))
+    qtd_perguntas = len(perguntas)
+    return {
+        'diferenca_media_score': float(np.mean(diferencas)),
+        'diferenca_max_score': float(np.max(diferencas)),
+        'concordancia_pares_ordenacao': float(np.mean(concordancias)),
+        'concordancia_top1': top1 / qtd_perguntas,
+        'tempo_fp32': tempo_referencia,
+        'tempo_avaliado': tempo_avaliado,
+        'aceleracao': tempo_referencia / tempo_avaliado if tempo_avaliado else None,
+    }
+
+def avaliar_quantizacao(
+    url_arquivo_entrada,
+    nome_banco_vetores,
+    nome_colecao,
+    backend_embeddings='int8',
+    backend_bert='int8',
+    instrucao=None,
+    num_resultados=10,
+    tamanho_lote=16,
+    max_perguntas=None,
+    url_arquivo_saida=None):
+
+    perguntas = carregar_perguntas(url_arquivo_entrada, max_perguntas)
+    textos = [pergunta['pergunta'] for pergunta in perguntas]
+    print(f'{len(perguntas)} perguntas carregadas de {url_arquivo_entrada} ({torch.get_num_threads()} threads)')
+    relatorio = {'perguntas': len(perguntas), 'backend_embeddings': backend_embeddings, 'backend_bert': backend_bert}
+
+    print(f'Gerando embeddings com {environment.MODELO_DE_EMBEDDINGS} (fp32 e {backend_embeddings})...')
+    parametros_embeddings = {'nome_modelo': environment.MODELO_DE_EMBEDDINGS, 'tipo_modelo': SentenceTransformer, 'device': DEVICE}
+    if instrucao is not None: parametros_embeddings['instrucao'] = instrucao
+    funcao_referencia = FuncaoEmbeddings(**parametros_embeddings, backend='fp32')
+    embeddings_referencia, tempo_referencia = medir_encoding(funcao_referencia, textos, tamanho_lote)
+    del funcao_referencia
+    funcao_avaliada = FuncaoEmbeddings(**parametros_embeddings, backend=backend_embeddings)
+    embeddings_avaliados, tempo_avaliado = medir_encoding(funcao_avaliada, textos, tamanho_lote)
+    del funcao_avaliada
+
+    similaridades = (embeddings_referencia * embeddings_avaliados).sum(axis=1) / (
+        np.linalg.norm(embeddings_referencia, axis=1) * np.linalg.norm(embeddings_avaliados, axis=1))
+    relatorio['embeddings'] = {
+        'tempo_fp32': tempo_referencia,
+        'tempo_avaliado': tempo_avaliado,
+        'aceleracao': tempo_referencia / tempo_avaliado if tempo_avaliado else None,
+        'similaridade_media': float(similaridades.mean()),
+        'similaridade_min': float(similaridades.min()),
+    }
+
+    # Os documentos do banco continuam com os embeddings fp32, como na API com o backend quantizado
+    url_banco_vetores = os.path.join(URL_LOCAL, f"../conteudo/bancos_vetores/{nome_banco_vetores}")
+    colecao = chromadb.PersistentClient(path=url_banco_vetores).get_collection(name=nome_colecao)
+    relatorio['recuperacao'], documentos = comparar_recuperacao(colecao, perguntas, embeddings_referencia, embeddings_avaliados, num_resultados)
+
+    print(f'Aplicando o Bert ({environment.EMBEDDING_SQUAD_PORTUGUESE}, fp32 e {backend_bert}) aos documentos recuperados...')
+    geradores = []
+    for backend in ('fp32', backend_bert):
+        gerador = GeradorDeRespostas(url_banco_vetores=url_banco_vetores, colecao_de_documentos=nome_colecao, fazer_log=False,
+                                     device=DEVICE, carregar_modelos=False, backend_bert=backend)
+        gerador.carregar_bert()
+        geradores.append(gerador)
+    relatorio['bert'] = comparar_bert(*geradores, perguntas, documentos)
+
+    print(json.dumps(relatorio, indent=4, ensure_ascii=False))
+    if url_arquivo_saida:
+        with open(url_arquivo_saida, 'w', encoding='utf-8') as arq:
+            json.dump(relatorio, arq, indent=4, ensure_ascii=False)
+    return relatorio
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara a precisão e o tempo dos backends quantizados com o fp32")
+
+    parser.add_argument('--url_entrada', type=str, required=True, help="caminho para arquivo com as perguntas")
+    parser.add_argument('--nome_banco_vetores', type=str, required=True, help="nome do banco de vetores a ser consultado")
+    parser.add_argument('--nome_colecao', type=str, required=True, help="coleção do banco a ser utilizada")
+    parser.add_argument('--backend_embeddings', type=str, default='int8', choices=BACKENDS_EMBEDDINGS, help="backend avaliado para o modelo de embeddings")
+    parser.add_argument('--backend_bert', type=str, default='int8', choices=BACKENDS_BERT, help="backend avaliado para o Bert")
+    parser.add_argument('--instrucao', type=str, help="instrucao a ser utilizada na função de embeddings")
+    parser.add_argument('--num_resultados', type=int, default=10, help="documentos recuperados por pergunta")
+    parser.add_argument('--tamanho_lote', type=int, default=16, help="perguntas por chamada ao modelo de embeddings")
+    parser.add_argument('--max_perguntas', type=int, help="limita a quantidade de perguntas avaliadas")
+    parser.add_argument('--url_saida', type=str, help="caminho para arquivo em que será salvo o relatório")
+
+    args = parser.parse_args()
+    avaliar_quantizacao(
+        url_arquivo_entrada=args.url_entrada,
+        nome_banco_vetores=args.nome_banco_vetores,
+        nome_colecao=args.nome_colecao,
+        backend_embeddings=args.backend_embeddings,
+        backend_bert=args.backend_bert,
+        instrucao=args.instrucao,
+        num_resultados=args.num_resultados,
+        tamanho_lote=args.tamanho_lote,
+        max_perguntas=args.max_perguntas,
+        url_arquivo_saida=args.url_saida)
@@ -1,13 +1,17 @@
 ## print('Para simplicidade, mover o arquivo para a pasta principal para executar')
+## Avaliação em lotes: as perguntas de cada lote são codificadas em uma só chamada ao modelo de embeddings,
+## consultadas no ChromaDB em uma só query e reordenadas pelo Bert em lotes de pares (pergunta, documento).
+## Com saída .jsonl, cada lote concluído é acrescentado ao arquivo e uma execução interrompida é retomada
+## a partir das perguntas que ainda não estão nele
 print('Importando bibliotecas...')
 import json
 import sys
 from sentence_transformers import SentenceTransformer
 from ..environment.environment import environment
 from ..gerador_de_respostas import GeradorDeRespostas
+from ..utils.cache import CacheLRU
 from ..utils.utils import FuncaoEmbeddings
 from time import time
-import asyncio
 import os
 import argparse
 from torch import cuda
@@ -16,23 +20,107 @@ URL_LOCAL = os.path.abspath(os.path.join(os.path.dirname(__file__), "./"))
 EMBEDDING_INSTRUCTOR="hkunlp/instructor-xl"
 DEVICE='cuda' if cuda.is_available() else 'cpu'
 
-async def avaliar_recuperacao_documentos(
+def chave_pergunta(pergunta: dict):
+    return (pergunta['id'], pergunta['pergunta'])
+
+def carregar_resultados_anteriores(url_arquivo_saida: str):
+    '''Resultados já salvos (para retomar a avaliação). Linhas incompletas de uma execução interrompida são descartadas.'''
+    if not os.path.exists(url_arquivo_saida): return []
+    with open(url_arquivo_saida, 'r', encoding='utf-8') as arq:
+        if not url_arquivo_saida.endswith('.jsonl'): return json.load(arq)
+        linhas = arq.readlines()
+    resultados = []
+    for linha in linhas:
+        try:
+            resultados.append(json.loads(linha))
+        except json.JSONDecodeError:
+            continue
+    if len(resultados) != sum(1 for linha in linhas if linha.strip()) or (linhas and not linhas[-1].endswith('\n')):
+        with open(url_arquivo_saida, 'w', encoding='utf-8') as arq:
+            arq.writelines(json.dumps(resultado, ensure_ascii=False) + '\n' for resultado in resultados)
+    return resultados
+
+def salvar_resultados(url_arquivo_saida: str, novos_resultados: list, todos_resultados: list):
+    if url_arquivo_saida.endswith('.jsonl'):
+        with open(url_arquivo_saida, 'a', encoding='utf-8') as arq:
+            arq.writelines(json.dumps(resultado, ensure_ascii=False) + '\n' for resultado in novos_resultados)
+            arq.flush()
+            os.fsync(arq.fileno())
+    else:
+        with open(url_arquivo_saida, 'w', encoding='utf-8') as arq:
+            json.dump(todos_resultados, arq, indent=4, ensure_ascii=False)
+
+def avaliar_lote(gerador_de_respostas: GeradorDeRespostas, lote: list, num_resultados: int, tamanho_lote_bert: int):
+    textos_perguntas = [pergunta['pergunta'] for pergunta in lote]
+
+    # Recuperando documentos usando o ChromaDB: embeddings do lote em uma chamada e uma só consulta
+    marcador_tempo_inicio = time()
+    embeddings = gerador_de_respostas.interface_chromadb.funcao_de_embeddings(textos_perguntas)
+    documentos = gerador_de_respostas.interface_chromadb.consultar_documentos_por_embeddings(embeddings, num_resultados)
+    listas_documentos = [
+        gerador_de_respostas.formatar_lista_documentos({chave: [documentos[chave][idx]] for chave in ('ids', 'distances', 'metadatas', 'documents')})
+        for idx in range(len(lote))]
+    tempo_consulta = time() - marcador_tempo_inicio
+
+    # Atribuindo scores usando Bert, em lotes de pares (pergunta, documento) de várias perguntas
+    marcador_tempo_inicio = time()
+    pares = [(pergunta, documento) for pergunta, lista_documentos in zip(textos_perguntas, listas_documentos) for documento in lista_documentos]
+    for idx in range(0, len(pares), tamanho_lote_bert):
+        perguntas_pares = [pergunta for pergunta, _ in pares[idx:idx + tamanho_lote_bert]]
+        documentos_pares = [documento for _, documento in pares[idx:idx + tamanho_lote_bert]]
+        textos_documentos = [documento['conteudo'] for documento in documentos_pares]
+        if gerador_de_respostas.cache_bert is not None:
+            respostas_estimadas, _ = gerador_de_respostas.aplicar_bert_com_cache(
+                perguntas_pares, textos_documentos, [documento['id'] for documento in documentos_pares])
+        else:
+            respostas_estimadas = gerador_de_respostas.aplicar_bert(perguntas_pares, textos_documentos)
+        for documento, resposta_estimada in zip(documentos_pares, respostas_estimadas):
+            documento['score_bert'] = resposta_estimada['score']
+            documento['score_ponderado'] = resposta_estimada['score_ponderado']
+            documento['resposta_bert'] = resposta_estimada['resposta']
+    tempo_bert = time() - marcador_tempo_inicio
+
+    # Os tempos são do lote inteiro, divididos igualmente entre as perguntas
+    for pergunta, lista_documentos in zip(lote, listas_documentos):
+        pergunta.update({
+            'documentos': [
+                {'id': doc['id'],
+                'titulo': doc['metadados']['titulo'],
+                'subtitulo': doc['metadados']['subtitulo'],
+                'score_bert': doc['score_bert'],
+                'score_distancia': doc['score_distancia'],
+                'score_ponderado': doc['score_ponderado'],
+                'resposta_bert': doc['resposta_bert']
+                } for doc in lista_documentos],
+            'tempo_consulta': tempo_consulta / len(lote),
+            'tempo_bert': tempo_bert / len(lote)
+            })
+    return tempo_consulta, tempo_bert
+
+def avaliar_recuperacao_documentos(
     url_arquivo_entrada,
     nome_banco_vetores,
     nome_colecao,
     url_arquivo_saida=None,
     instrucao=None,
+    url_cache_bert=None,
+    capacidade_cache_bert=100000,
+    tamanho_lote=64,
+    tamanho_lote_bert=32,
+    num_resultados=10,
     fazer_log=False):
-    
-    if not url_arquivo_saida: url_arquivo_saida = url_arquivo_entrada.split('.')[0] + '_recup_docs.json'
+
+    if not url_arquivo_saida: url_arquivo_saida = url_arquivo_entrada.split('.')[0] + '_recup_docs.jsonl'
     url_banco_vetores = os.path.join(URL_LOCAL, f"../conteudo/bancos_vetores/{nome_banco_vetores}")
     print(f'Criando GeradorDeRespostas (usando {EMBEDDING_INSTRUCTOR} e instrução "{instrucao}")...')
     funcao_de_embeddings = FuncaoEmbeddings(nome_modelo=EMBEDDING_INSTRUCTOR, tipo_modelo=SentenceTransformer, device=DEVICE, instrucao=instrucao)
-    gerador_de_respostas = GeradorDeRespostas(funcao_de_embeddings=funcao_de_embeddings, url_banco_vetores=url_banco_vetores, colecao_de_documentos=nome_colecao, device=DEVICE)
+    # Com url_cache_bert, os scores do Bert são reaproveitados entre execuções (enquanto a coleção não mudar)
+    cache_bert = CacheLRU(capacidade=capacidade_cache_bert, url_arquivo=url_cache_bert) if url_cache_bert else None
+    gerador_de_respostas = GeradorDeRespostas(funcao_de_embeddings=funcao_de_embeddings, url_banco_vetores=url_banco_vetores, colecao_de_documentos=nome_colecao, device=DEVICE, cache_bert=cache_bert)
 
     with open(url_arquivo_entrada, 'r') as arq:
         docs = json.load(arq)
-    
+
     print(f'Recuperando lista de documentos com perguntas ({url_arquivo_entrada})...')
     print(f'Os resultados serão salvos em {url_arquivo_saida}')
     perguntas = []
@@ -43,60 +131,42 @@ async def avaliar_recuperacao_documentos(
             except:
                 print(pergunta)
 
-    qtd_perguntas = len(perguntas)
-    for idx in range(qtd_perguntas):
-        pergunta = perguntas[idx]
-        print(f'\rPergunta {idx+1} de {qtd_perguntas}', end='')
-        if fazer_log: print(f'''-- realizando consulta para: "{pergunta['pergunta']}"...''')
-
-        # Recuperando documentos usando o ChromaDB
-        marcador_tempo_inicio = time()
-        documentos = await gerador_de_respostas.consultar_documentos_banco_vetores(pergunta['pergunta'], num_resultados=10)
-        lista_documentos = gerador_de_respostas.formatar_lista_documentos(documentos)
-        marcador_tempo_fim = time()
-        tempo_consulta = marcador_tempo_fim - marcador_tempo_inicio
-        if fazer_log: print(f'--- consulta no banco concluída ({tempo_consulta} segundos)')
-
-        # Atribuindo scores usando Bert
-        if fazer_log: print(f'--- aplicando scores do Bert aos documentos recuperados...')
-        marcador_tempo_inicio = time()
-        for documento in lista_documentos:
-            resposta_estimada = await gerador_de_respostas.estimar_resposta(pergunta['pergunta'], documento['conteudo'])
-            documento['score_bert'] = resposta_estimada['score']
-            documento['score_ponderado'] = resposta_estimada['score_ponderado']
-            documento['resposta_bert'] = resposta_estimada['resposta']
-        marcador_tempo_fim = time()
-        tempo_bert = marcador_tempo_fim - marcador_tempo_inicio
-        if fazer_log: print(f'--- scores atribuídos ({tempo_bert} segundos)\n\n\n')
-        pergunta.update({
-            'documentos': [
-                {'id': doc['id'],
-                'titulo': doc['metadados']['titulo'],
-                'subtitulo': doc['metadados']['subtitulo'],
-                'score_bert': doc['score_bert'],
-                'score_distancia': doc['score_distancia'],
-                'score_ponderado': doc['score_ponderado'],
-                'resposta_bert': doc['resposta_bert']
-                } for doc in lista_documentos],
-            'tempo_consulta': tempo_consulta,
-            'tempo_bert': tempo_bert
-            })
+    resultados = carregar_resultados_anteriores(url_arquivo_saida)
+    concluidas = {chave_pergunta(resultado) for resultado in resultados}
+    pendentes = [pergunta for pergunta in perguntas if chave_pergunta(pergunta) not in concluidas]
+    if concluidas: print(f'Retomando avaliação: {len(perguntas) - len(pendentes)} pergunta(s) já avaliada(s)')
 
-
-        with open(url_arquivo_saida, 'w', encoding='utf-8') as arq:
-            json.dump(perguntas, arq, indent=4, ensure_ascii=False)
+    qtd_perguntas = len(pendentes)
+    marcador_tempo_inicio = time()
+    try:
+        for idx in range(0, qtd_perguntas, tamanho_lote):
+            lote = pendentes[idx:idx + tamanho_lote]
+            tempo_consulta, tempo_bert = avaliar_lote(gerador_de_respostas, lote, num_resultados, tamanho_lote_bert)
+            resultados += lote
+            salvar_resultados(url_arquivo_saida, lote, resultados)
+            if fazer_log: print(f'\n-- lote de {len(lote)} pergunta(s): consulta {tempo_consulta} segundos, Bert {tempo_bert} segundos')
+            print(f'\rPergunta {idx + len(lote)} de {qtd_perguntas} ({(idx + len(lote)) / (time() - marcador_tempo_inicio):.1f} perguntas/s)', end='')
+    finally:
+        if cache_bert is not None:
+            cache_bert.salvar()
+            print(f'\nCache do Bert: {cache_bert.estatisticas()}')
 
 
 
 # Run the `avaliar` function
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Gera resultados de busca por documentos a partir de uma lista de perguntas")
-    
+
     parser.add_argument('--url_entrada', type=str, required=True, help="caminho para arquivo com as perguntas")
     parser.add_argument('--nome_banco_vetores', type=str, required=True, help="nome do banco de vetores a ser consultado")
     parser.add_argument('--nome_colecao', type=str, required=True, help="coleçaõ do banco a ser utilizada")
-    parser.add_argument('--url_saida', type=str, help="caminho para arquivo em que serão salvos os resultados")
+    parser.add_argument('--url_saida', type=str, help="caminho para arquivo em que serão salvos os resultados (.jsonl, incremental e retomável, ou .json)")
     parser.add_argument('--instrucao', type=str, help="instrucao a ser utilizada na função de embeddings")
+    parser.add_argument('--url_cache_bert', type=str, help="arquivo do cache de scores do Bert, reaproveitado entre execuções")
+    parser.add_argument('--capacidade_cache_bert', type=int, default=100000, help="capacidade do cache de scores do Bert")
+    parser.add_argument('--tamanho_lote', type=int, default=64, help="perguntas por lote (embeddings e consulta ao ChromaDB)")
+    parser.add_argument('--tamanho_lote_bert', type=int, default=32, help="pares (pergunta, documento) por passagem do Bert")
+    parser.add_argument('--num_resultados', type=int, default=10, help="documentos recuperados por pergunta")
 
     args = parser.parse_args()
     url_entrada = args.url_entrada
@@ -104,9 +174,14 @@ if __name__ == "__main__":
     nome_colecao = args.nome_colecao
     url_saida = None if not args.url_saida else args.url_saida
     instrucao = None if not args.instrucao else args.instrucao
-    asyncio.run(avaliar_recuperacao_documentos(
+    avaliar_recuperacao_documentos(
         url_arquivo_entrada=url_entrada,
         nome_banco_vetores=nome_banco_vetores,
         nome_colecao=nome_colecao,
         url_arquivo_saida=url_saida,
-        instrucao=instrucao))
+        instrucao=instrucao,
+        url_cache_bert=args.url_cache_bert,
+        capacidade_cache_bert=args.capacidade_cache_bert,
+        tamanho_lote=args.tamanho_lote,
+        tamanho_lote_bert=args.tamanho_lote_bert,
+        num_resultados=args.num_resultados)
@@ -24,55 +24,130 @@ URL_BANCO_VETORES=os.path.join(URL_LOCAL,"../conteudo/bancos_vetores/banco_vetor
 NOME_COLECAO='regimento_resolucoes_rh'
 DEVICE='cuda' if cuda.is_available() else 'cpu'
 
-async def avaliar_respostas_llama(url_arquivo_entrada, nome_banco_vetores, nome_colecao, url_arquivo_saida=None, instrucao=None):
+def carregar_checkpoint(url_checkpoint: str):
+    '''Respostas já geradas (uma por linha). Linhas incompletas de uma execução interrompida são descartadas.'''
+    if not os.path.exists(url_checkpoint): return []
+    registros = []
+    with open(url_checkpoint, 'r', encoding='utf-8') as arq:
+        for linha in arq:
+            try:
+                registros.append(json.loads(linha))
+            except json.JSONDecodeError:
+                continue
+    return registros
+
+def salvar_dados(url_arquivo_saida: str, conteudo: dict):
+    # Mantém a estrutura do arquivo de entrada, para que a saída possa ser usada para retomar a avaliação
+    with open(url_arquivo_saida, 'w', encoding='utf-8') as arq:
+        arq.write(json.dumps(conteudo, ensure_ascii=False, indent=4))
+
+async def gerar_resposta_item(interface_ollama: InterfaceOllama, item: dict, documentos: dict):
+    texto_resposta_llama = ''
+    async for resp_llama in interface_ollama.gerar_resposta_llama(
+                pergunta=item['pergunta'],
+                # Inclui o título dos documentos no prompt do Llama
+                documentos=[f"{documentos[doc['id']][0]['titulo']} - {documentos[doc['id']][1]}" for doc in item['documentos'] if doc['id'] in documentos],
+                contexto=[]):
+
+        texto_resposta_llama += resp_llama['response']
+
+    resp_llama['response'] = texto_resposta_llama
+    resp_llama['context'] = []
+    return resp_llama
+
+async def avaliar_respostas_llama(
+        url_arquivo_entrada,
+        nome_banco_vetores,
+        nome_colecao,
+        url_arquivo_saida=None,
+        instrucao=None,
+        num_trabalhadores=None,
+        tentativas=3,
+        timeout=600,
+        url_checkpoint=None):
+    '''
+    Gera as respostas do Llama com num_trabalhadores requisições simultâneas (por padrão, os slots paralelos
+    de todos os servidores: OLLAMA_NUM_PARALLEL por servidor). Cada resposta é acrescentada ao checkpoint
+    (JSONL) assim que fica pronta; o arquivo de saída é gravado ao final (ou na interrupção) com todos os itens.
+    Itens que já têm a resposta do llama, no arquivo de entrada ou no checkpoint, não são gerados de novo.
+    '''
     if not url_arquivo_saida: url_arquivo_saida = url_arquivo_entrada
+    if not url_checkpoint: url_checkpoint = os.path.splitext(url_arquivo_saida)[0] + '_checkpoint_llama.jsonl'
     if FAZER_LOG: print('Carregando JSON')
     with open(url_arquivo_entrada, 'r', encoding='utf-8') as arq:
-        dados = json.load(arq)
-        dados=dados['dados'] # por motivodfe mudança na estrutura do arquivo
+        conteudo = json.load(arq)
+        dados=conteudo['dados'] # por motivodfe mudança na estrutura do arquivo
+
+    for registro in carregar_checkpoint(url_checkpoint):
+        # O índice só é aceito se a pergunta for a mesma (checkpoint de outro arquivo de entrada)
+        if registro['indice'] < len(dados) and dados[registro['indice']]['pergunta'] == registro['pergunta']:
+            dados[registro['indice']]['llama'] = registro['llama']
+
+    # Ignora Cada item que já tem uma resposta do llama
+    pendentes = [idx for idx, item in enumerate(dados) if 'llama' not in item]
+    print(f'{len(dados) - len(pendentes)} de {len(dados)} item(ns) já com resposta do llama ({url_checkpoint})')
+    if not pendentes:
+        salvar_dados(url_arquivo_saida, conteudo)
+        return
+
     if FAZER_LOG: print('Criando interface Ollama')
     interface_ollama = InterfaceOllama(url_llama=URL_LLAMA, nome_modelo=MODELO_LLAMA)
+    if not num_trabalhadores: num_trabalhadores = environment.OLLAMA_NUM_PARALLEL * len(interface_ollama.cliente_ollama.clientes)
+    # O pool de conexões de cada servidor precisa comportar os trabalhadores (é criado na primeira requisição)
+    conexoes_por_servidor = -(-num_trabalhadores // len(interface_ollama.cliente_ollama.clientes))
+    for cliente in interface_ollama.cliente_ollama.clientes:
+        cliente.max_conexoes = cliente.max_conexoes_keepalive = max(cliente.max_conexoes, conexoes_por_servidor)
 
     if FAZER_LOG: print('Criando cliente Chroma')
     url_banco_vetores = os.path.join(URL_LOCAL, f"../conteudo/bancos_vetores/{nome_banco_vetores}")
     client = chromadb.PersistentClient(path=url_banco_vetores)
     if FAZER_LOG: print('Criando função de embeddings')
-    funcao_de_embeddings_sentence_tranformer = FuncaoEmbeddings(nome_modelo=EMBEDDING_INSTRUCTOR, tipo_modelo=SentenceTransformer, instrucao=instrucao, device=DEVICE)
+    funcao_de_embeddings_sentence_tranformer = FuncaoEmbeddings(nome_modelo=EMBEDDING_INSTRUCTOR, tipo_modelo=SentenceTransformer, instrucao=instrucao, device=DEVICE, carregar_modelo=False)
     if FAZER_LOG: print('Definindo Coleção')
     collection = client.get_collection(name=nome_colecao, embedding_function=funcao_de_embeddings_sentence_tranformer)
-    
-    if FAZER_LOG: print('Processando perguntas')
-    num_itens = len(dados)
-    for idx in range(num_itens):
-        print(f'\rPergunta {idx+1} de {num_itens}', end="")
-        item = dados[idx]
-
-        # Ignora Cada item que já tem uma resposta do llama
-        if 'llama' in item: continue
-
-        pergunta = item['pergunta']
-        if FAZER_LOG: print('Recuperando documentos')
-        documentos = collection.get(
-            ids=[doc['id'] for doc in item['documentos']]
-        )
-        if FAZER_LOG: print('Enviando dados para o ollama')
-        texto_resposta_llama = ''
-        async for resp_llama in interface_ollama.gerar_resposta_llama(
-                    pergunta=pergunta,
-                    # Inclui o título dos documentos no prompt do Llama
-                    documentos=[f"{doc[0]['titulo']} - {doc[1]}" for doc in zip(documentos['metadatas'], documentos['documents'])],
-                    contexto=[]):
-            
-            texto_resposta_llama += resp_llama['response']
-
-        resp_llama['response'] = texto_resposta_llama
-        resp_llama['context'] = []
-
-        item['llama'] = resp_llama
 
+    if FAZER_LOG: print('Recuperando documentos')
+    # Uma só consulta ao banco com os documentos de todos os itens pendentes
+    ids_documentos = list({doc['id'] for idx in pendentes for doc in dados[idx]['documentos']})
+    recuperados = collection.get(ids=ids_documentos)
+    documentos = {id_doc: (metadado, texto) for id_doc, metadado, texto in zip(recuperados['ids'], recuperados['metadatas'], recuperados['documents'])}
+
+    if FAZER_LOG: print(f'Processando perguntas ({num_trabalhadores} requisições simultâneas)')
+    fila = asyncio.Queue()
+    for idx in pendentes: fila.put_nowait(idx)
+    concluidos, falhas = 0, 0
+    marcador_tempo_inicio = time()
+
+    async def trabalhador(arq_checkpoint):
+        nonlocal concluidos, falhas
+        while not fila.empty():
+            idx = fila.get_nowait()
+            item = dados[idx]
+            for tentativa in range(tentativas):
+                try:
+                    item['llama'] = await asyncio.wait_for(gerar_resposta_item(interface_ollama, item, documentos), timeout=timeout)
+                    break
+                except Exception as excecao:
+                    if FAZER_LOG: print(f'\nFalha no item {idx} (tentativa {tentativa + 1} de {tentativas}): {excecao.__class__.__name__}')
+                    if tentativa + 1 < tentativas: await asyncio.sleep(2 ** tentativa)
+            if 'llama' in item:
+                # Uma linha por resposta, gravada de uma vez (o event loop não alterna no meio da escrita)
+                arq_checkpoint.write(json.dumps({'indice': idx, 'pergunta': item['pergunta'], 'llama': item['llama']}, ensure_ascii=False) + '\n')
+                arq_checkpoint.flush()
+                concluidos += 1
+            else:
+                # Fica sem resposta e é gerado de novo na próxima execução
+                falhas += 1
+            print(f'\rPergunta {concluidos + falhas} de {len(pendentes)} ({falhas} falha(s), {concluidos / (time() - marcador_tempo_inicio):.2f} respostas/s)', end='')
+
+    try:
+        with open(url_checkpoint, 'a', encoding='utf-8') as arq_checkpoint:
+            await asyncio.gather(*[trabalhador(arq_checkpoint) for _ in range(min(num_trabalhadores, len(pendentes)))])
+    finally:
+        await interface_ollama.encerrar()
         if FAZER_LOG: print('salvando json')
-        with open(os.path.join(url_arquivo_saida), 'w', encoding='utf-8') as arq:
-            arq.write(json.dumps(dados, ensure_ascii=False, indent=4))
+        salvar_dados(url_arquivo_saida, conteudo)
+    print(f'\nConcluído: {concluidos} resposta(s) gerada(s), {falhas} falha(s) em {time() - marcador_tempo_inicio:.1f} segundos')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Gera resultados de busca por documentos a partir de uma lista de perguntas")
@@ -82,6 +157,10 @@ if __name__ == '__main__':
     parser.add_argument('--nome_colecao', type=str, required=True, help="coleçaõ do banco a ser utilizada")
     parser.add_argument('--url_saida', type=str, help="caminho para arquivo em que serão salvos os resultados")
     parser.add_argument('--instrucao', type=str, help="instrucao a ser utilizada na função de embeddings")
+    parser.add_argument('--num_trabalhadores', type=int, help="requisições simultâneas ao Ollama (padrão: OLLAMA_NUM_PARALLEL por servidor)")
+    parser.add_argument('--tentativas', type=int, default=3, help="tentativas por item antes de desistir (o item fica para a próxima execução)")
+    parser.add_argument('--timeout', type=float, default=600, help="tempo máximo de cada tentativa, em segundos")
+    parser.add_argument('--url_checkpoint', type=str, help="arquivo JSONL com as respostas já geradas (padrão: <saída>_checkpoint_llama.jsonl)")
 
     args = parser.parse_args()
     url_entrada = args.url_entrada
@@ -94,7 +173,11 @@ if __name__ == '__main__':
         nome_banco_vetores=nome_banco_vetores,
         nome_colecao=nome_colecao,
         url_arquivo_saida=url_saida,
-        instrucao=instrucao
+        instrucao=instrucao,
+        num_trabalhadores=args.num_trabalhadores,
+        tentativas=args.tentativas,
+        timeout=args.timeout,
+        url_checkpoint=args.url_checkpoint
     ))
 # else:
 #     avaliar_respostas_llama(
@@ -0,0 +1,80 @@
+## Compara a decodificação antiga (json.loads em cada fragmento de bytes) com o DecodificadorNDJSON,
+## reproduzindo um stream do Ollama dividido em fragmentos de tamanhos aleatórios
+import argparse
+import json
+import random
+from time import perf_counter
+
+from ..utils.decodificador_ndjson import DecodificadorNDJSON, orjson
+
+
+def gerar_stream_sintetico(num_tokens):
+    # Imita o formato das linhas do /api/generate do Ollama
+    linhas = [
+        json.dumps({'model': 'llama3.1', 'created_at': '2024-11-13T12:00:00.000000Z', 'response': f' palavra{idx}', 'done': False}, ensure_ascii=False)
+        for idx in range(num_tokens)]
+    linhas.append(json.dumps({'model': 'llama3.1', 'response': '', 'done': True, 'context': list(range(2048)), 'eval_count': num_tokens, 'eval_duration': num_tokens * 10**7}))
+    return ('\n'.join(linhas) + '\n').encode()
+
+def fragmentar(dados, tamanho_max_fragmento, semente=0):
+    # Fragmentos de tamanho aleatório: podem conter várias linhas, ou só parte de uma
+    aleatorio = random.Random(semente)
+    fragmentos = []
+    inicio = 0
+    while inicio < len(dados):
+        fim = inicio + aleatorio.randint(1, tamanho_max_fragmento)
+        fragmentos.append(dados[inicio:fim])
+        inicio = fim
+    return fragmentos
+
+def decodificar_antigo(fragmentos):
+    registros = []
+    for fragmento in fragmentos:
+        try:
+            registros.append(json.loads(fragmento.decode()))
+        except:
+            pass
+    return registros
+
+def decodificar_novo(fragmentos, usar_orjson):
+    decodificador = DecodificadorNDJSON(usar_orjson=usar_orjson)
+    registros = []
+    for fragmento in fragmentos:
+        registros += decodificador.alimentar(fragmento)
+    registros += decodificador.finalizar()
+    return registros
+
+def medir(nome, funcao, fragmentos, num_esperado, repeticoes):
+    inicio = perf_counter()
+    for _ in range(repeticoes):
+        registros = funcao(fragmentos)
+    tempo = (perf_counter() - inicio) / repeticoes
+    print(f'{nome:<28} {len(registros):>8} de {num_esperado} registros | {tempo*1000:9.2f} ms | {num_esperado/tempo:12.0f} tokens/s')
+
+def executar(num_tokens, tamanho_max_fragmento, repeticoes, url_gravacao=None):
+    if url_gravacao:
+        with open(url_gravacao, 'rb') as arq: dados = arq.read()
+    else:
+        dados = gerar_stream_sintetico(num_tokens)
+    num_esperado = sum(1 for linha in dados.split(b'\n') if linha.strip())
+    fragmentos = fragmentar(dados, tamanho_max_fragmento)
+
+    print(f'Stream com {num_esperado} registros ({len(dados)} bytes) em {len(fragmentos)} fragmentos de até {tamanho_max_fragmento} bytes')
+    medir('json.loads por fragmento', decodificar_antigo, fragmentos, num_esperado, repeticoes)
+    medir('DecodificadorNDJSON (json)', lambda frags: decodificar_novo(frags, False), fragmentos, num_esperado, repeticoes)
+    if orjson: medir('DecodificadorNDJSON (orjson)', lambda frags: decodificar_novo(frags, True), fragmentos, num_esperado, repeticoes)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mede a decodificação de streams NDJSON do Ollama com fragmentação arbitrária")
+
+    parser.add_argument('--url_gravacao', type=str, help="caminho para um stream NDJSON gravado do Ollama (se omitido, usa um stream sintético)")
+    parser.add_argument('--num_tokens', type=int, default=100000, help="quantidade de tokens do stream sintético")
+    parser.add_argument('--tamanho_max_fragmento', type=int, default=512, help="tamanho máximo, em bytes, de cada fragmento")
+    parser.add_argument('--repeticoes', type=int, default=5, help="quantidade de repetições de cada medição")
+
+    args = parser.parse_args()
+    executar(
+        num_tokens=args.num_tokens,
+        tamanho_max_fragmento=args.tamanho_max_fragmento,
+        repeticoes=args.repeticoes,
+        url_gravacao=args.url_gravacao)
@@ -0,0 +1,73 @@
+## Confere os fragmentos gerados para a Lei Maria da Penha com os de referência (gerados pelo fragmentador
+## anterior, em dados/fragmentos_lei_maria_da_penha.json) e mede o fragmentador em um corpus N vezes maior
+import argparse
+import json
+import os
+import sys
+from time import perf_counter
+
+from ..conteudo.gerador_banco_vetores import GeradorBancoVetores, URL_LOCAL
+
+URL_REFERENCIA = os.path.join(os.path.dirname(__file__), 'dados/fragmentos_lei_maria_da_penha.json')
+
+
+def dividir_em_blocos(texto, tamanho_bloco):
+    return (texto[inicio:inicio + tamanho_bloco] for inicio in range(0, len(texto), tamanho_bloco))
+
+def verificar_referencia(gerador, texto, referencia, tamanho_bloco):
+    '''Compara com a referência o texto inteiro e o texto passado em blocos (fluxo).'''
+    num_divergencias = 0
+    for configuracao, fragmentos_esperados in referencia['fragmentos'].items():
+        tipo, comprimento_max_fragmento = configuracao.split(':')
+        info = dict(referencia['info'], texto_articulado=tipo == 'articulado')
+        resultados = {
+            'texto inteiro': gerador.processar_texto(texto, info, int(comprimento_max_fragmento)),
+            f'blocos de {tamanho_bloco}': list(gerador.processar_partes_texto(dividir_em_blocos(texto, tamanho_bloco), info, int(comprimento_max_fragmento))),
+        }
+        for modo, fragmentos in resultados.items():
+            if fragmentos == fragmentos_esperados:
+                print(f'OK         {configuracao:<16} {modo:<18} {len(fragmentos)} fragmentos')
+                continue
+            num_divergencias += 1
+            idx = next((idx for idx, (obtido, esperado) in enumerate(zip(fragmentos, fragmentos_esperados)) if obtido != esperado), min(len(fragmentos), len(fragmentos_esperados)))
+            print(f'DIVERGENTE {configuracao:<16} {modo:<18} {len(fragmentos)} de {len(fragmentos_esperados)} fragmentos; primeira divergência no fragmento {idx+1}')
+    return num_divergencias
+
+def medir(gerador, texto, info, comprimento_max_fragmento, tamanho_bloco, repeticoes):
+    inicio = perf_counter()
+    for _ in range(repeticoes):
+        fragmentos = list(gerador.processar_partes_texto(dividir_em_blocos(texto, tamanho_bloco), info, comprimento_max_fragmento))
+    tempo = (perf_counter() - inicio) / repeticoes
+    tipo = 'articulado' if info['texto_articulado'] else 'simples'
+    print(f'{tipo:<11} {comprimento_max_fragmento:>5} palavras | {len(fragmentos):>7} fragmentos | {tempo*1000:9.1f} ms | {len(texto) / tempo / 2**20:7.2f} MB/s')
+
+def executar(fator_corpus, tamanho_bloco, repeticoes):
+    with open(URL_REFERENCIA, 'r', encoding='utf-8') as arq:
+        referencia = json.load(arq)
+    with open(os.path.join(URL_LOCAL, referencia['documento']), 'r') as arq:
+        texto = arq.read()
+
+    gerador = GeradorBancoVetores()
+    num_divergencias = verificar_referencia(gerador, texto, referencia, tamanho_bloco)
+
+    corpus = '\n'.join([texto] * fator_corpus)
+    print(f'\nCorpus com {fator_corpus}x o documento ({len(corpus) / 2**20:.1f} MB), lido em blocos de {tamanho_bloco} caracteres')
+    for texto_articulado in (True, False):
+        for comprimento_max_fragmento in sorted({int(configuracao.split(':')[1]) for configuracao in referencia['fragmentos']}):
+            medir(gerador, corpus, dict(referencia['info'], texto_articulado=texto_articulado), comprimento_max_fragmento, tamanho_bloco, repeticoes)
+
+    return num_divergencias
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Confere o fragmentador com a saída de referência e mede seu desempenho em um corpus maior")
+
+    parser.add_argument('--fator_corpus', type=int, default=100, help="quantas vezes o documento é repetido no corpus da medição")
+    parser.add_argument('--tamanho_bloco', type=int, default=64 * 1024, help="tamanho, em caracteres, dos blocos passados ao fragmentador")
+    parser.add_argument('--repeticoes', type=int, default=3, help="quantidade de repetições de cada medição")
+
+    args = parser.parse_args()
+    num_divergencias = executar(
+        fator_corpus=args.fator_corpus,
+        tamanho_bloco=args.tamanho_bloco,
+        repeticoes=args.repeticoes)
+    sys.exit(1 if num_divergencias else 0)
@@ -7,6 +7,7 @@ from torch import cuda
 
 from sentence_transformers import SentenceTransformer
 
+from ..utils.decodificador_ndjson import DecodificadorNDJSON
 from ..utils.utils import FuncaoEmbeddings
 from ..environment.environment import environment
 URL_LLAMA = 'http://localhost:11434/api/generate'
@@ -45,10 +46,12 @@ class GeradorPerguntas:
         resposta = requests.post(self.URL_LLAMA, json=payload, stream=True)
         resposta.raise_for_status()
         texto_resposta = ''
+        decodificador = DecodificadorNDJSON()
         for fragmento in resposta.iter_content(chunk_size=None):
-            if fragmento:
-                dados = json.loads(fragmento.decode())
+            for dados in decodificador.alimentar(fragmento):
                 texto_resposta += dados['response']
+        for dados in decodificador.finalizar():
+            texto_resposta += dados['response']
         return texto_resposta
 
     def run(self, url_arquivo_saida='documentos_perguntas.json', carregar_arquivo=False):
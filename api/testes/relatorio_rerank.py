@@ -0,0 +1,95 @@
+## Relatório offline da profundidade adaptativa do Bert (ver api/utils/politica_rerank.py): aplica a política,
+## com cada combinação de margem de dominância e janela, aos resultados de avaliar_recuperacao_documentos.py e
+## compara o tempo de Bert economizado com a perda de qualidade da ordenação (acerto@1 e MRR do fragmento
+## esperado, em relação a avaliar todos os documentos)
+import argparse
+import json
+
+from ..utils.politica_rerank import PoliticaRerank
+
+
+def carregar_resultados(url_arquivo_entrada: str):
+    with open(url_arquivo_entrada, 'r', encoding='utf-8') as arq:
+        if url_arquivo_entrada.endswith('.jsonl'): return [json.loads(linha) for linha in arq if linha.strip()]
+        return json.load(arq)
+
+def score_bert(documento):
+    return documento['score_bert'][0] if documento.get('score_bert') else float('-inf')
+
+def ordenar(documentos, profundidade: int):
+    # Os documentos avaliados são ordenados pelo Bert e ficam à frente dos demais, que mantêm a ordem da recuperação
+    return sorted(documentos[:profundidade], key=score_bert, reverse=True) + documentos[profundidade:]
+
+def posicao(documentos, id_esperado):
+    ids = [documento['id'] for documento in documentos]
+    return ids.index(id_esperado) + 1 if id_esperado in ids else None
+
+def avaliar_configuracao(resultados, num_documentos: int, margem_dominancia: float, janela: float, orcamento: float):
+    politica = PoliticaRerank(margem_dominancia=margem_dominancia, janela=janela, orcamento=orcamento)
+    tempo_total, tempo_economizado, profundidades = 0, 0, []
+    acertos, acertos_completa, rr, rr_completa, concordancia_top1 = 0, 0, 0, 0, 0
+    for resultado in resultados:
+        documentos = resultado['documentos'][:num_documentos]
+        if not documentos: continue
+        # Tempo do Bert por documento na avaliação (todos os documentos avaliados em um só lote)
+        tempo_por_documento = resultado.get('tempo_bert', 0) / max(1, len(resultado['documentos']))
+        politica.tempo_por_documento = tempo_por_documento
+        decisao = politica.decidir([documento['score_distancia'] for documento in documentos], tempo_decorrido=resultado.get('tempo_consulta', 0))
+        profundidade = decisao['profundidade']
+        profundidades.append(profundidade)
+        tempo_total += tempo_por_documento * len(documentos)
+        tempo_economizado += tempo_por_documento * (len(documentos) - profundidade)
+
+        ordem = ordenar(documentos, profundidade)
+        ordem_completa = ordenar(documentos, len(documentos))
+        concordancia_top1 += ordem[0]['id'] == ordem_completa[0]['id']
+        posicao_esperado, posicao_esperado_completa = posicao(ordem, resultado['id']), posicao(ordem_completa, resultado['id'])
+        acertos += posicao_esperado == 1
+        acertos_completa += posicao_esperado_completa == 1
+        rr += 1 / posicao_esperado if posicao_esperado else 0
+        rr_completa += 1 / posicao_esperado_completa if posicao_esperado_completa else 0
+
+    qtd = max(1, len(profundidades))
+    return {
+        'margem_dominancia': margem_dominancia,
+        'janela': janela,
+        'orcamento': orcamento,
+        'profundidade_media': sum(profundidades) / qtd,
+        'sem_bert': sum(1 for profundidade in profundidades if profundidade == 0) / qtd,
+        'tempo_economizado': tempo_economizado / tempo_total if tempo_total else 0,
+        'concordancia_top1': concordancia_top1 / qtd,
+        'acerto@1': acertos / qtd,
+        'acerto@1_completa': acertos_completa / qtd,
+        'mrr': rr / qtd,
+        'mrr_completa': rr_completa / qtd,
+    }
+
+def gerar_relatorio(url_arquivo_entrada, num_documentos=5, margens=(0,), janelas=(0,), orcamento=0, url_arquivo_saida=None):
+    resultados = carregar_resultados(url_arquivo_entrada)
+    print(f'{len(resultados)} perguntas em {url_arquivo_entrada} ({num_documentos} documentos por pergunta)')
+    linhas = [
+        avaliar_configuracao(resultados, num_documentos, margem, janela, orcamento)
+        for margem in margens for janela in janelas]
+
+    print(f"{'margem':>7} {'janela':>7} {'prof.':>6} {'sem Bert':>9} {'economia':>9} {'top1=':>6} {'ac@1':>6} {'MRR':>6} {'(compl.)':>9}")
+    for linha in linhas:
+        print(f"{linha['margem_dominancia']:>7.3f} {linha['janela']:>7.3f} {linha['profundidade_media']:>6.2f} {linha['sem_bert']:>9.1%} "
+              f"{linha['tempo_economizado']:>9.1%} {linha['concordancia_top1']:>6.1%} {linha['acerto@1']:>6.3f} {linha['mrr']:>6.3f} "
+              f"{linha['mrr_completa']:>9.3f}")
+    if url_arquivo_saida:
+        with open(url_arquivo_saida, 'w', encoding='utf-8') as arq:
+            json.dump(linhas, arq, indent=4, ensure_ascii=False)
+    return linhas
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara o tempo economizado e a qualidade da ordenação com a profundidade adaptativa do Bert")
+
+    parser.add_argument('--url_entrada', type=str, required=True, help="resultados de avaliar_recuperacao_documentos.py (.json ou .jsonl)")
+    parser.add_argument('--num_documentos', type=int, default=5, help="documentos considerados por pergunta (NUM_DOCUMENTOS_RETORNADOS)")
+    parser.add_argument('--margens', type=float, nargs='+', default=[0, 0.01, 0.02, 0.03, 0.05, 0.1], help="margens de dominância avaliadas")
+    parser.add_argument('--janelas', type=float, nargs='+', default=[0, 0.02, 0.05], help="janelas avaliadas")
+    parser.add_argument('--orcamento', type=float, default=0, help="orçamento de tempo, em segundos (0 desativa)")
+    parser.add_argument('--url_saida', type=str, help="caminho para arquivo em que será salvo o relatório (JSON)")
+
+    args = parser.parse_args()
+    gerar_relatorio(args.url_entrada, args.num_documentos, args.margens, args.janelas, args.orcamento, args.url_saida)
@@ -0,0 +1,96 @@
+## Servidores que imitam a API do Ollama (/api/generate com stream, /api/tags e /api/ps), para testar o
+## RoteadorOllama sem GPU. Com --verificar, sobe vários simuladores (um deles com falha e outro fora do ar),
+## envia gerações simultâneas pelo roteador e mostra a distribuição entre os servidores
+import argparse
+import asyncio
+import json
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ..utils.utils import RoteadorOllama
+
+
+def criar_simulador(nome_modelo: str, num_tokens: int=20, atraso_token: float=0.02, falhar: bool=False, modelo_carregado: bool=True):
+    app = FastAPI()
+    app.state.requisicoes = 0
+    app.state.geracoes = 0
+
+    @app.post('/api/generate')
+    async def gerar(dados: dict):
+        app.state.requisicoes += 1
+        if falhar: return JSONResponse({'error': 'falha simulada'}, status_code=500)
+        # Como o Ollama, responde 404 para modelos que não conhece
+        if dados.get('model') not in (nome_modelo, f'{nome_modelo}:latest'):
+            return JSONResponse({'error': f'model "{dados.get("model")}" not found, try pulling it first'}, status_code=404)
+        app.state.geracoes += 1
+        if not dados.get('stream', True):
+            return {'model': nome_modelo, 'response': 'ok', 'done': True, 'context': [1, 2, 3]}
+
+        async def gerar_stream():
+            for idx in range(num_tokens):
+                await asyncio.sleep(atraso_token)
+                yield json.dumps({'model': nome_modelo, 'response': f' token{idx}', 'done': False}) + '\n'
+            yield json.dumps({'model': nome_modelo, 'response': '', 'done': True, 'context': [1, 2, 3],
+                              'eval_count': num_tokens, 'eval_duration': int(num_tokens * atraso_token * 10**9)}) + '\n'
+        return StreamingResponse(gerar_stream(), media_type='application/x-ndjson')
+
+    @app.get('/api/tags')
+    async def listar_modelos(): return {'models': [{'name': f'{nome_modelo}:latest'}]}
+
+    @app.get('/api/ps')
+    async def listar_modelos_carregados(): return {'models': [{'name': f'{nome_modelo}:latest'}] if modelo_carregado else []}
+
+    return app
+
+async def iniciar_simulador(app, porta: int):
+    servidor = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=porta, log_level='error'))
+    tarefa = asyncio.create_task(servidor.serve())
+    while not servidor.started: await asyncio.sleep(0.05)
+    return servidor, tarefa
+
+async def verificar(nome_modelo: str, porta_inicial: int, num_servidores: int, num_requisicoes: int, atraso_token: float):
+    # num_servidores saudáveis, mais um que responde com erro e um endereço sem servidor
+    simuladores = [criar_simulador(nome_modelo, atraso_token=atraso_token) for _ in range(num_servidores)]
+    simuladores.append(criar_simulador(nome_modelo, falhar=True))
+    servidores = [await iniciar_simulador(app, porta_inicial + idx) for idx, app in enumerate(simuladores)]
+    urls = [f'http://127.0.0.1:{porta_inicial + idx}' for idx in range(len(simuladores) + 1)]
+
+    roteador = RoteadorOllama(nome_modelo=nome_modelo, urls_llama=urls, intervalo_verificacao=0)
+    roteador.iniciar()
+    # Antes da verificação, todos são considerados saudáveis: as primeiras falhas exercitam o failover
+    async def consumir():
+        return [registro async for registro in roteador.stream(prompt='teste')]
+    respostas = await asyncio.gather(*[consumir() for _ in range(num_requisicoes)], return_exceptions=True)
+    falhas = [resposta for resposta in respostas if isinstance(resposta, BaseException)]
+    print(f'{num_requisicoes - len(falhas)} de {num_requisicoes} gerações concluídas; {roteador.failovers} failover(s)')
+
+    await roteador.verificar_todos()
+    for estatisticas, app in zip(roteador.estatisticas()['backends'], simuladores + [None]):
+        geracoes = app.state.geracoes if app else '-'
+        print(f"{estatisticas['url_llama']:<24} saudável={estatisticas['saudavel']!s:<5} gerações={geracoes!s:<4} falhas={estatisticas['falhas']}")
+
+    await roteador.encerrar()
+    for servidor, tarefa in servidores:
+        servidor.should_exit = True
+        await tarefa
+    return not falhas
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulador da API do Ollama para testes do roteamento entre servidores")
+
+    parser.add_argument('--modelo', type=str, default='llama3.1', help="nome do modelo informado pelo simulador")
+    parser.add_argument('--porta', type=int, default=11500, help="porta do simulador (ou a primeira, com --verificar)")
+    parser.add_argument('--atraso_token', type=float, default=0.02, help="intervalo, em segundos, entre os tokens gerados")
+    parser.add_argument('--falhar', action='store_true', help="responde a todas as gerações com erro 500")
+    parser.add_argument('--verificar', action='store_true', help="sobe vários simuladores e testa o RoteadorOllama com eles")
+    parser.add_argument('--num_servidores', type=int, default=3, help="simuladores saudáveis usados com --verificar")
+    parser.add_argument('--num_requisicoes', type=int, default=30, help="gerações simultâneas enviadas com --verificar")
+
+    args = parser.parse_args()
+    if args.verificar:
+        sucesso = asyncio.run(verificar(args.modelo, args.porta, args.num_servidores, args.num_requisicoes, args.atraso_token))
+        raise SystemExit(0 if sucesso else 1)
+    uvicorn.run(criar_simulador(args.modelo, atraso_token=args.atraso_token, falhar=args.falhar), host='127.0.0.1', port=args.porta)
@@ -7,6 +7,7 @@ from torch import cuda
 
 from sentence_transformers import SentenceTransformer
 
+from ..utils.decodificador_ndjson import DecodificadorNDJSON
 from ..utils.utils import FuncaoEmbeddings
 from ..environment.environment import environment
 URL_LLAMA = 'http://localhost:11434/api/generate'
@@ -41,10 +42,12 @@ class ValidadorPerguntas:
         resposta = requests.post(self.URL_LLAMA, json=payload, stream=True)
         resposta.raise_for_status()
         retorno = ''
+        decodificador = DecodificadorNDJSON()
         for fragmento in resposta.iter_content(chunk_size=None):
-            if fragmento:
-                dados = json.loads(fragmento.decode())
+            for dados in decodificador.alimentar(fragmento):
                 retorno += dados['response']
+        for dados in decodificador.finalizar():
+            retorno += dados['response']
         return retorno
 
     def run(self, url_arquivo='documentos_perguntas.json'):
@@ -0,0 +1,104 @@
+## Verifica que o ControleAdmissao (ver api/utils/controle_admissao.py) não perde vagas quando o cliente desconecta:
+## as respostas são servidas por StreamingResponse (como na rota /chat/enviar_pergunta/) para um cliente ASGI
+## simulado que desconecta antes do primeiro fragmento (falha no envio do início da resposta ou desconexão
+## imediata), na fila ou no meio do stream. Ao final, não deve haver vagas ocupadas nem perguntas na fila.
+## Não usa modelos, o banco de vetores nem o Ollama
+import argparse
+import asyncio
+import gc
+
+from starlette.responses import StreamingResponse
+
+from ..utils.controle_admissao import ControleAdmissao
+
+
+async def gerar_mensagens(num_mensagens: int, atraso: float):
+    for idx in range(num_mensagens):
+        await asyncio.sleep(atraso)
+        yield f'mensagem {idx}\n'
+
+def criar_cliente(falhar_no_inicio: bool=False, desconectar_apos: int=None, desconectar_imediatamente: bool=False):
+    '''Funções receive e send de um cliente ASGI que desconecta no ponto indicado.'''
+    enviados = []
+    desconectado = asyncio.Event()
+    if desconectar_imediatamente: desconectado.set()
+
+    async def receive():
+        await desconectado.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(mensagem):
+        if mensagem['type'] == 'http.response.start' and falhar_no_inicio:
+            raise OSError('conexão encerrada pelo cliente')
+        if mensagem['type'] == 'http.response.body' and mensagem.get('body'):
+            enviados.append(mensagem['body'])
+            if desconectar_apos is not None and len(enviados) >= desconectar_apos:
+                desconectado.set()
+                raise OSError('conexão encerrada pelo cliente')
+    return receive, send, enviados
+
+async def servir(controle: ControleAdmissao, receive, send, num_mensagens: int, atraso: float, versao_asgi: str='2.4'):
+    resposta = StreamingResponse(controle.atender(gerar_mensagens(num_mensagens, atraso)), media_type='text/plain')
+    escopo = {'type': 'http', 'asgi': {'spec_version': versao_asgi}}
+    try:
+        await resposta(escopo, receive, send)
+    except Exception:
+        # ClientDisconnect/OSError: o servidor encerra a requisição
+        pass
+
+async def aguardar_finalizacao():
+    # Geradores interrompidos sem aclose são finalizados pelo event loop quando coletados
+    gc.collect()
+    for _ in range(5): await asyncio.sleep(0.01)
+
+async def verificar(num_mensagens: int, atraso: float):
+    casos = []
+
+    controle = ControleAdmissao(max_concorrentes=1, max_fila=2, tempo_max_espera=5)
+    receive, send, _ = criar_cliente(falhar_no_inicio=True)
+    await servir(controle, receive, send, num_mensagens, atraso)
+    await aguardar_finalizacao()
+    casos.append(('falha no início da resposta', controle))
+
+    controle = ControleAdmissao(max_concorrentes=1, max_fila=2, tempo_max_espera=5)
+    receive, send, _ = criar_cliente(desconectar_imediatamente=True)
+    await servir(controle, receive, send, num_mensagens, atraso, versao_asgi='2.0')
+    await aguardar_finalizacao()
+    casos.append(('desconexão imediata', controle))
+
+    controle = ControleAdmissao(max_concorrentes=1, max_fila=2, tempo_max_espera=5)
+    receive, send, _ = criar_cliente(desconectar_apos=2)
+    await servir(controle, receive, send, num_mensagens, atraso)
+    await aguardar_finalizacao()
+    casos.append(('desconexão no meio do stream', controle))
+
+    # Com a vaga ocupada por A, B desconecta antes de entrar na fila e C desconecta enquanto aguarda na fila
+    controle = ControleAdmissao(max_concorrentes=1, max_fila=2, tempo_max_espera=5)
+    receive_a, send_a, enviados_a = criar_cliente()
+    tarefa_a = asyncio.create_task(servir(controle, receive_a, send_a, num_mensagens, atraso))
+    while not enviados_a: await asyncio.sleep(0.005)
+    receive_b, send_b, _ = criar_cliente(falhar_no_inicio=True)
+    await servir(controle, receive_b, send_b, num_mensagens, atraso)
+    receive_c, send_c, _ = criar_cliente(desconectar_apos=1)
+    await servir(controle, receive_c, send_c, num_mensagens, atraso)
+    await tarefa_a
+    await aguardar_finalizacao()
+    casos.append((f'fila ({len(enviados_a)} mensagens de A)', controle))
+
+    sucesso = True
+    for nome, controle in casos:
+        estatisticas = controle.estatisticas()
+        ok = estatisticas['ativos'] == 0 and estatisticas['fila'] == 0
+        sucesso = sucesso and ok
+        print(f"{'OK   ' if ok else 'FALHA'} {nome:<36} ativos {estatisticas['ativos']}, fila {estatisticas['fila']}, admitidas {estatisticas['admitidas']}")
+    return sucesso
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verifica que as vagas do controle de admissão são liberadas quando o cliente desconecta")
+
+    parser.add_argument('--num_mensagens', type=int, default=10, help="mensagens geradas em cada resposta")
+    parser.add_argument('--atraso', type=float, default=0.02, help="intervalo, em segundos, entre as mensagens")
+
+    args = parser.parse_args()
+    sucesso = asyncio.run(verificar(args.num_mensagens, args.atraso))
+    raise SystemExit(0 if sucesso else 1)
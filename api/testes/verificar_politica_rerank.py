@@ -0,0 +1,74 @@
+## Verifica a PoliticaRerank (ver api/utils/politica_rerank.py) com as entradas de cada método de recuperação:
+## na densa, a margem de dominância e a janela se aplicam; no BM25 (sem distância do cosseno) e na fusão RRF
+## (ordem que não segue o cosseno), o Bert avalia todos os documentos. Não usa modelos nem o banco de vetores
+import argparse
+
+from ..utils.indice_bm25 import IndiceBM25, fundir_rrf
+from ..utils.politica_rerank import PoliticaRerank
+
+IDS = [f'lei:{idx}' for idx in range(6)]
+METADADOS = [{'titulo': 'Lei', 'subtitulo': f'Art. {idx} - 1'} for idx in range(6)]
+DOCUMENTOS = [
+    'Art. 0. A medida protetiva de urgência será concedida pelo juiz.',
+    'Art. 1. A autoridade policial registrará a ocorrência.',
+    'Art. 2. A ofendida será encaminhada ao atendimento.',
+    'Art. 3. Medida protetiva de afastamento do lar.',
+    'Art. 4. O juiz poderá determinar a prisão preventiva.',
+    'Art. 5. A assistência judiciária é garantida.',
+]
+PERGUNTA = 'medida protetiva de urgência'
+
+
+def scores_distancia(documentos: dict):
+    # Como em GeradorDeRespostas.formatar_lista_documentos
+    return [1 - distancia if distancia is not None else None for distancia in documentos['distances'][0]]
+
+def verificar(margem_dominancia: float=0.05, janela: float=0.1):
+    politica = PoliticaRerank(margem_dominancia=margem_dominancia, janela=janela)
+    indice = IndiceBM25(IDS, METADADOS, DOCUMENTOS)
+    # Resultado denso simulado: distâncias do cosseno em ordem crescente, com o primeiro bem à frente
+    densa = {
+        'ids': [['lei:3', 'lei:0', 'lei:4', 'lei:1']],
+        'distances': [[0.10, 0.30, 0.32, 0.35]],
+        'metadatas': [[METADADOS[3], METADADOS[0], METADADOS[4], METADADOS[1]]],
+        'documents': [[DOCUMENTOS[3], DOCUMENTOS[0], DOCUMENTOS[4], DOCUMENTOS[1]]]
+    }
+    bm25 = indice.buscar(PERGUNTA, 4)
+    fusao = fundir_rrf([densa, bm25], 4)
+
+    casos = []
+    decisao = politica.decidir(scores_distancia(densa), recuperacao='densa')
+    casos.append(('densa', decisao, decisao['profundidade'] == 0 and decisao['motivos'] == ['dominante']))
+
+    decisao = politica.decidir([0.98, 0.95, 0.80, 0.79], recuperacao='densa')
+    casos.append(('densa (janela)', decisao, decisao['profundidade'] == 2 and decisao['motivos'] == ['janela']))
+
+    assert all(distancia is None for distancia in bm25['distances'][0]), 'o BM25 não deve ter distância do cosseno'
+    decisao = politica.decidir(scores_distancia(bm25), recuperacao='bm25')
+    casos.append(('bm25', decisao, decisao['profundidade'] == len(bm25['ids'][0]) and decisao['motivos'] == ['completa']))
+
+    # Na fusão, as distâncias vêm só da lista densa (as demais ficam nulas até completar_distancias)
+    ids_densa = set(densa['ids'][0])
+    assert all((distancia is None) == (id_fragmento not in ids_densa)
+               for id_fragmento, distancia in zip(fusao['ids'][0], fusao['distances'][0])), 'distâncias da fusão fora da escala do cosseno'
+    # Mesmo com todas as distâncias (e uma grande diferença entre os dois primeiros), a ordem é a da fusão
+    completas = [distancia if distancia is not None else 0.5 for distancia in fusao['distances'][0]]
+    decisao = politica.decidir([1 - distancia for distancia in completas], recuperacao='fusao_rrf')
+    casos.append(('fusao_rrf', decisao, decisao['profundidade'] == len(fusao['ids'][0]) and decisao['motivos'] == ['completa']))
+
+    decisao = politica.decidir([1.0, 1.0], recuperacao='indice_artigos')
+    casos.append(('indice_artigos', decisao, decisao['profundidade'] == 2))
+
+    for nome, decisao, ok in casos:
+        print(f"{'OK   ' if ok else 'FALHA'} {nome:<16} profundidade {decisao['profundidade']} de {decisao['candidatos']} ({', '.join(decisao['motivos'])})")
+    assert all(ok for _, _, ok in casos), 'decisões inesperadas da política de rerank'
+    return casos
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verifica as decisões da política de rerank para cada método de recuperação")
+
+    parser.add_argument('--margem_dominancia', type=float, default=0.05, help="margem de dominância usada na verificação")
+    parser.add_argument('--janela', type=float, default=0.1, help="janela usada na verificação")
+
+    args = parser.parse_args()
+    verificar(args.margem_dominancia, args.janela)
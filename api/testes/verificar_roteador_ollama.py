@@ -0,0 +1,120 @@
+## Verifica o RoteadorOllama (ver api/utils/utils.py) com simuladores do Ollama (ver simulador_ollama.py):
+## cada geração vai para o servidor com menos gerações em andamento; uma falha antes do primeiro token
+## (erro 5xx ou servidor fora do ar) leva ao servidor seguinte; e um erro 4xx, causado pela própria
+## requisição, é repassado sem failover e sem tirar servidores de circulação. Não usa GPU nem modelos
+import argparse
+import asyncio
+
+import httpx
+
+from ..utils.utils import RoteadorOllama
+from .simulador_ollama import criar_simulador, iniciar_simulador
+
+
+async def subir_simuladores(simuladores: list, porta_inicial: int):
+    servidores = [await iniciar_simulador(app, porta_inicial + idx) for idx, app in enumerate(simuladores)]
+    urls = [f'http://127.0.0.1:{porta_inicial + idx}' for idx in range(len(simuladores))]
+    return servidores, urls
+
+async def derrubar_simuladores(servidores: list):
+    for servidor, tarefa in servidores:
+        servidor.should_exit = True
+        await tarefa
+
+async def verificar_menor_carga(nome_modelo: str, porta_inicial: int, num_servidores: int, streams_por_servidor: int):
+    '''Streams iniciados um a um (cada um já gerando): a cada rodada, todos os servidores ficam com a mesma carga.'''
+    simuladores = [criar_simulador(nome_modelo, num_tokens=100, atraso_token=0.02) for _ in range(num_servidores)]
+    servidores, urls = await subir_simuladores(simuladores, porta_inicial)
+    roteador = RoteadorOllama(nome_modelo=nome_modelo, urls_llama=urls, intervalo_verificacao=0)
+    roteador.iniciar()
+    await roteador.verificar_todos()
+
+    async def consumir(primeiro_token: asyncio.Event):
+        async for _ in roteador.stream(prompt='teste'): primeiro_token.set()
+
+    tarefas, cargas = [], []
+    ok = True
+    for idx in range(num_servidores * streams_por_servidor):
+        primeiro_token = asyncio.Event()
+        tarefas.append(asyncio.create_task(consumir(primeiro_token)))
+        await primeiro_token.wait()
+        carga = [cliente.streams_ativos for cliente in roteador.clientes]
+        cargas.append(carga)
+        # Depois de idx + 1 streams, nenhum servidor tem mais que um stream a mais que outro
+        ok = ok and sum(carga) == idx + 1 and max(carga) - min(carga) <= 1
+    await asyncio.gather(*tarefas)
+    geracoes = [app.state.geracoes for app in simuladores]
+    ok = ok and geracoes == [streams_por_servidor] * num_servidores and roteador.failovers == 0
+
+    await roteador.encerrar()
+    await derrubar_simuladores(servidores)
+    return ok, f'cargas {cargas[-1]} após {len(cargas)} streams, gerações {geracoes}'
+
+async def verificar_failover(nome_modelo: str, porta_inicial: int):
+    '''Um servidor com erro 500 e outro fora do ar à frente do saudável: a geração chega a ele, sem erro.'''
+    simuladores = [criar_simulador(nome_modelo, falhar=True), criar_simulador(nome_modelo, num_tokens=5, atraso_token=0.01)]
+    servidores, urls = await subir_simuladores(simuladores, porta_inicial)
+    # Sem verificação prévia, todos são considerados saudáveis e tentados na ordem da lista
+    url_fora_do_ar = f'http://127.0.0.1:{porta_inicial + len(simuladores)}'
+    roteador = RoteadorOllama(nome_modelo=nome_modelo, urls_llama=[urls[0], url_fora_do_ar, urls[1]], intervalo_verificacao=0)
+    roteador.iniciar()
+
+    registros = [registro async for registro in roteador.stream(prompt='teste')]
+    saude = [cliente.saudavel for cliente in roteador.clientes]
+    ok = (
+        len(registros) > 0 and registros[-1].get('done')
+        and roteador.failovers == 2 and saude == [False, False, True]
+        and simuladores[0].state.requisicoes == 1 and simuladores[1].state.geracoes == 1)
+
+    await roteador.encerrar()
+    await derrubar_simuladores(servidores)
+    return ok, f'{len(registros)} registros, {roteador.failovers} failover(s), saudáveis {saude}'
+
+async def verificar_erro_requisicao(nome_modelo: str, porta_inicial: int, num_servidores: int):
+    '''Modelo inexistente (404): o erro chega a quem chamou, sem failover, e os servidores continuam saudáveis.'''
+    simuladores = [criar_simulador(nome_modelo) for _ in range(num_servidores)]
+    servidores, urls = await subir_simuladores(simuladores, porta_inicial)
+    roteador = RoteadorOllama(nome_modelo=f'{nome_modelo}-inexistente', urls_llama=urls, intervalo_verificacao=0)
+    roteador.iniciar()
+
+    codigos = []
+    for _ in range(num_servidores):
+        try:
+            async for _ in roteador.stream(prompt='teste'): pass
+        except httpx.HTTPStatusError as excecao:
+            codigos.append(excecao.response.status_code)
+    try:
+        await roteador.gerar(prompt='teste')
+    except httpx.HTTPStatusError as excecao:
+        codigos.append(excecao.response.status_code)
+    saude = [cliente.saudavel for cliente in roteador.clientes]
+    requisicoes = [app.state.requisicoes for app in simuladores]
+    ok = (
+        codigos == [404] * (num_servidores + 1) and roteador.failovers == 0
+        and all(saude) and sum(requisicoes) == num_servidores + 1)
+
+    await roteador.encerrar()
+    await derrubar_simuladores(servidores)
+    return ok, f'códigos {codigos}, {roteador.failovers} failover(s), requisições {requisicoes}, saudáveis {saude}'
+
+async def verificar(nome_modelo: str, porta_inicial: int, num_servidores: int, streams_por_servidor: int):
+    casos = [
+        ('menor carga', await verificar_menor_carga(nome_modelo, porta_inicial, num_servidores, streams_por_servidor)),
+        ('failover antes do 1º token', await verificar_failover(nome_modelo, porta_inicial + 10)),
+        ('erro 4xx sem failover', await verificar_erro_requisicao(nome_modelo, porta_inicial + 20, num_servidores)),
+    ]
+    for nome, (ok, detalhes) in casos:
+        print(f"{'OK   ' if ok else 'FALHA'} {nome:<28} {detalhes}")
+    return all(ok for _, (ok, _) in casos)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verifica a escolha de servidor e o failover do RoteadorOllama com simuladores do Ollama")
+
+    parser.add_argument('--modelo', type=str, default='llama3.1', help="nome do modelo informado pelos simuladores")
+    parser.add_argument('--porta', type=int, default=11700, help="primeira porta usada pelos simuladores")
+    parser.add_argument('--num_servidores', type=int, default=3, help="simuladores saudáveis")
+    parser.add_argument('--streams_por_servidor', type=int, default=2, help="streams simultâneos por servidor na verificação da carga")
+
+    args = parser.parse_args()
+    sucesso = asyncio.run(verificar(args.modelo, args.porta, args.num_servidores, args.streams_por_servidor))
+    raise SystemExit(0 if sucesso else 1)
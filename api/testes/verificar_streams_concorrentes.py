@@ -0,0 +1,109 @@
+## Verifica que um stream em andamento continua fluindo enquanto outra pergunta está na recuperação (embeddings)
+## ou no Bert: o stream A é iniciado e, após o primeiro token, chega a pergunta B, com embeddings e Bert lentos
+## (time.sleep, que bloquearia o event loop se executado nele). Os intervalos entre os tokens de A durante essas
+## etapas de B devem ficar próximos do intervalo do simulador do Ollama. Não usa modelos nem o banco de vetores
+import argparse
+import asyncio
+import json
+from time import monotonic, sleep
+
+from ..gerador_de_respostas import GeradorDeRespostas
+from ..utils.utils import DadosChat, InterfaceOllama
+from .simulador_ollama import criar_simulador, iniciar_simulador
+
+
+class InterfaceChromaLenta:
+    '''Substitui a InterfaceChroma: embeddings com atraso bloqueante e consulta com documentos fixos.'''
+    nome_colecao = 'verificacao'
+    funcao_de_embeddings = None
+
+    def __init__(self, tempo_embeddings: float, fases: list):
+        self.tempo_embeddings = tempo_embeddings
+        self.fases = fases
+
+    def gerar_embeddings_consulta(self, termos_de_consulta: str):
+        inicio = monotonic()
+        sleep(self.tempo_embeddings)
+        self.fases.append(('embeddings', termos_de_consulta, inicio, monotonic()))
+        return [[1.0, 0.0]]
+
+    def consultar_documentos_por_embeddings(self, embeddings, num_resultados=5):
+        return {
+            'ids': [['lei:1', 'lei:2']],
+            'distances': [[0.1, 0.2]],
+            'metadatas': [[{'titulo': 'Lei', 'subtitulo': 'Art. 1 - 1'}, {'titulo': 'Lei', 'subtitulo': 'Art. 2 - 1'}]],
+            'documents': [['Art. 1. texto', 'Art. 2. texto']]
+        }
+
+    def versao_colecao(self):
+        return 'verificacao'
+
+def criar_bert_lento(tempo_bert: float, fases: list):
+    def aplicar_bert(pergunta, textos_documentos, comprimento_max_resposta=15):
+        inicio = monotonic()
+        sleep(tempo_bert)
+        fases.append(('bert', pergunta, inicio, monotonic()))
+        return [{'resposta': ('', ''), 'score': (0.0, 0.0, 0.0), 'score_ponderado': 0.0} for _ in textos_documentos]
+    return aplicar_bert
+
+async def consumir(gerador: GeradorDeRespostas, pergunta: str, instantes_tokens: list, primeiro_token: asyncio.Event=None):
+    async for mensagem in gerador.consultar(DadosChat(pergunta=pergunta, contexto=[]), fazer_log=False):
+        for linha in mensagem.split('\n'):
+            if not linha.strip(): continue
+            dados = json.loads(linha).get('dados') or {}
+            if dados.get('tag') == 'frag-resposta-llm':
+                instantes_tokens.append(monotonic())
+                if primeiro_token is not None: primeiro_token.set()
+
+async def verificar(porta: int, num_tokens: int, atraso_token: float, tempo_embeddings: float, tempo_bert: float, intervalo_max: float):
+    servidor, tarefa_servidor = await iniciar_simulador(criar_simulador('llama3.1', num_tokens=num_tokens, atraso_token=atraso_token), porta)
+
+    fases = []
+    gerador = GeradorDeRespostas(fazer_log=False, device='cpu', carregar_modelos=False, usar_indice_artigos=False, sobrepor_bert_e_llm=False)
+    gerador.interface_chromadb = InterfaceChromaLenta(tempo_embeddings, fases)
+    gerador.aplicar_bert = criar_bert_lento(tempo_bert, fases)
+    gerador.interface_ollama = InterfaceOllama(nome_modelo='llama3.1', url_llama=f'http://127.0.0.1:{porta}')
+
+    tokens_a, tokens_b = [], []
+    primeiro_token_a = asyncio.Event()
+    tarefa_a = asyncio.create_task(consumir(gerador, 'A', tokens_a, primeiro_token_a))
+    await primeiro_token_a.wait()
+    # B chega com A já em stream: passa pelos embeddings e pelo Bert enquanto A gera a resposta
+    await asyncio.gather(tarefa_a, consumir(gerador, 'B', tokens_b))
+
+    await gerador.interface_ollama.encerrar()
+    servidor.should_exit = True
+    await tarefa_servidor
+
+    fases_b = [(etapa, inicio, fim) for etapa, pergunta, inicio, fim in fases if pergunta == 'B']
+    sucesso = True
+    for etapa, inicio, fim in fases_b:
+        # Intervalos entre tokens de A que se sobrepõem à etapa de B
+        intervalos = [
+            posterior - anterior for anterior, posterior in zip(tokens_a, tokens_a[1:])
+            if posterior > inicio and anterior < fim]
+        tokens_durante = sum(1 for instante in tokens_a if inicio <= instante <= fim)
+        maior_intervalo = max(intervalos) if intervalos else None
+        ok = tokens_durante > 0 and maior_intervalo is not None and maior_intervalo <= intervalo_max
+        sucesso = sucesso and ok
+        print(f"{'OK   ' if ok else 'FALHA'} B em {etapa:<10} ({fim - inicio:.2f} s): {tokens_durante} token(s) de A, "
+              f"maior intervalo {maior_intervalo if maior_intervalo is None else round(maior_intervalo, 3)} s (limite {intervalo_max} s)")
+    if len(fases_b) < 2:
+        print(f'FALHA: etapas de B registradas: {[etapa for etapa, _, _ in fases_b]}')
+        sucesso = False
+    print(f'A: {len(tokens_a)} tokens; B: {len(tokens_b)} tokens')
+    return sucesso
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verifica que os streams em andamento não param durante a recuperação e o Bert de outra pergunta")
+
+    parser.add_argument('--porta', type=int, default=11600, help="porta do simulador do Ollama")
+    parser.add_argument('--num_tokens', type=int, default=150, help="tokens gerados em cada resposta")
+    parser.add_argument('--atraso_token', type=float, default=0.02, help="intervalo, em segundos, entre os tokens gerados")
+    parser.add_argument('--tempo_embeddings', type=float, default=0.8, help="duração (bloqueante) dos embeddings simulados, em segundos")
+    parser.add_argument('--tempo_bert', type=float, default=0.8, help="duração (bloqueante) do Bert simulado, em segundos")
+    parser.add_argument('--intervalo_max', type=float, default=0.2, help="maior intervalo aceito entre tokens de A, em segundos")
+
+    args = parser.parse_args()
+    sucesso = asyncio.run(verificar(args.porta, args.num_tokens, args.atraso_token, args.tempo_embeddings, args.tempo_bert, args.intervalo_max))
+    raise SystemExit(0 if sucesso else 1)
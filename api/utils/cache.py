@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Any, Hashable
+
+import json
+import numpy as np
+import os
+
+
+class CacheLRU:
+    '''
+    Cache em memória com capacidade limitada (descarta o item usado há mais tempo) e, opcionalmente,
+    tempo de vida (ttl, em segundos) para cada item. Pode ser salvo em disco e recarregado, para
+    manter os itens entre reinicializações. É seguro para uso a partir de várias threads.
+    Opcionalmente, os itens pertencem a um escopo (ex.: versão da coleção): ao mudar o escopo
+    (definir_escopo), o cache é esvaziado. O escopo é salvo junto com os itens.
+    '''
+    def __init__(self, capacidade: int, ttl: float=None, url_arquivo: str=None):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.url_arquivo = url_arquivo
+        self.itens = OrderedDict()
+        self.trava = Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.escopo = None
+
+        if self.url_arquivo and os.path.exists(self.url_arquivo): self.carregar()
+
+    def __len__(self):
+        return len(self.itens)
+
+    def expirado(self, instante: float):
+        return self.ttl is not None and time() - instante > self.ttl
+
+    def obter(self, chave: Hashable, padrao: Any=None):
+        with self.trava:
+            item = self.itens.get(chave)
+            if item is None or self.expirado(item[1]):
+                if item is not None: del self.itens[chave]
+                self.falhas += 1
+                return padrao
+            self.itens.move_to_end(chave)
+            self.acertos += 1
+            return item[0]
+
+    def inserir(self, chave: Hashable, valor: Any):
+        with self.trava:
+            self.itens[chave] = (valor, time())
+            self.itens.move_to_end(chave)
+            while len(self.itens) > self.capacidade:
+                self.itens.popitem(last=False)
+
+    def remover(self, chave: Hashable):
+        with self.trava:
+            return self.itens.pop(chave, (None,))[0]
+
+    def limpar(self):
+        with self.trava:
+            self.itens.clear()
+
+    def definir_escopo(self, escopo: str):
+        with self.trava:
+            if escopo == self.escopo: return
+            self.itens.clear()
+            self.escopo = escopo
+
+    def estatisticas(self):
+        total = self.acertos + self.falhas
+        return {
+            'itens': len(self.itens),
+            'capacidade': self.capacidade,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': self.acertos / total if total else 0
+        }
+
+    def salvar(self):
+        # As chaves (tuplas) são gravadas como listas em JSON e convertidas de volta ao carregar
+        if not self.url_arquivo: return
+        with self.trava:
+            itens = [[list(chave) if isinstance(chave, tuple) else chave, valor, instante]
+                     for chave, (valor, instante) in self.itens.items()
+                     if not self.expirado(instante)]
+        os.makedirs(os.path.dirname(os.path.abspath(self.url_arquivo)), exist_ok=True)
+        with open(self.url_arquivo, 'w', encoding='utf-8') as arq:
+            json.dump(itens if self.escopo is None else {'escopo': self.escopo, 'itens': itens}, arq, ensure_ascii=False)
+
+    def carregar(self):
+        try:
+            with open(self.url_arquivo, 'r', encoding='utf-8') as arq:
+                itens = json.load(arq)
+        except (OSError, ValueError) as excecao:
+            print(f'ERRO: falha ao carregar o cache de {self.url_arquivo} ({excecao.__class__.__name__})')
+            return
+        with self.trava:
+            if isinstance(itens, dict):
+                self.escopo = itens['escopo']
+                itens = itens['itens']
+            for chave, valor, instante in itens[-self.capacidade:]:
+                if not self.expirado(instante):
+                    self.itens[tuple(chave) if isinstance(chave, list) else chave] = (valor, instante)
+
+
+class CacheSemanticoRespostas:
+    '''
+    Cache de respostas completas, consultado pela similaridade (cosseno) entre o embedding da pergunta
+    recebida e os das perguntas já respondidas. Cada resposta pertence a um escopo (coleção, versão da
+    coleção e modelos usados), de forma que respostas de um escopo nunca são devolvidas para outro.
+    '''
+    def __init__(self, capacidade: int, limiar_similaridade: float=0.97, ttl: float=None):
+        self.capacidade = capacidade
+        self.limiar_similaridade = limiar_similaridade
+        self.ttl = ttl
+        self.entradas = OrderedDict()
+        self.trava = Lock()
+        self.proxima_chave = 0
+        self.acertos = 0
+        self.falhas = 0
+
+    def __len__(self):
+        return len(self.entradas)
+
+    @staticmethod
+    def normalizar_vetor(embedding):
+        vetor = np.asarray(embedding, dtype=np.float32)
+        norma = np.linalg.norm(vetor)
+        return vetor / norma if norma else vetor
+
+    def buscar(self, escopo: tuple, embedding):
+        '''Retorna a entrada mais similar do escopo (com a similaridade calculada) ou None, se abaixo do limiar.'''
+        vetor = self.normalizar_vetor(embedding)
+        with self.trava:
+            if self.ttl is not None:
+                for chave in [chave for chave, entrada in self.entradas.items() if time() - entrada['instante'] > self.ttl]:
+                    del self.entradas[chave]
+
+            candidatos = [(chave, entrada) for chave, entrada in self.entradas.items() if entrada['escopo'] == escopo]
+            if candidatos:
+                similaridades = np.stack([entrada['vetor'] for _, entrada in candidatos]) @ vetor
+                idx = int(similaridades.argmax())
+                if similaridades[idx] >= self.limiar_similaridade:
+                    chave, entrada = candidatos[idx]
+                    self.entradas.move_to_end(chave)
+                    self.acertos += 1
+                    return dict(entrada, similaridade=float(similaridades[idx]))
+            self.falhas += 1
+            return None
+
+    def inserir(self, escopo: tuple, embedding, pergunta: str, fragmentos: list, conteudo: dict):
+        with self.trava:
+            self.entradas[self.proxima_chave] = {
+                'escopo': escopo,
+                'vetor': self.normalizar_vetor(embedding),
+                'pergunta': pergunta,
+                'fragmentos': fragmentos,
+                'conteudo': conteudo,
+                'instante': time()
+            }
+            self.proxima_chave += 1
+            while len(self.entradas) > self.capacidade:
+                self.entradas.popitem(last=False)
+
+    def invalidar(self, escopo: tuple=None):
+        '''Remove as respostas de um escopo (ou todas, se nenhum for informado), p. ex. ao regerar o banco de vetores.'''
+        with self.trava:
+            if escopo is None:
+                self.entradas.clear()
+                return
+            for chave in [chave for chave, entrada in self.entradas.items() if entrada['escopo'] == escopo]:
+                del self.entradas[chave]
+
+    def estatisticas(self):
+        total = self.acertos + self.falhas
+        return {
+            'itens': len(self.entradas),
+            'capacidade': self.capacidade,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': self.acertos / total if total else 0
+        }
@@ -0,0 +1,156 @@
+import asyncio
+import math
+from collections import deque
+from time import time
+from typing import AsyncIterator
+
+from api.utils import metricas
+from api.utils.mensagem import MensagemControle, MensagemErro
+
+
+class ControleAdmissao:
+    '''
+    Limita a quantidade de perguntas em atendimento. As excedentes aguardam em uma fila (FIFO) de tamanho
+    limitado e com tempo máximo de espera; com a fila cheia, a requisição é recusada logo na chegada
+    (ver tempo_estimado_espera, usado no Retry-After). max_concorrentes <= 0 desativa o controle.
+    '''
+    # Intervalo, em segundos, entre as verificações da posição na fila
+    INTERVALO_ATUALIZACAO = 1
+
+    def __init__(self, max_concorrentes: int, max_fila: int, tempo_max_espera: float):
+        self.max_concorrentes = max_concorrentes
+        self.max_fila = max_fila
+        self.tempo_max_espera = tempo_max_espera
+        self.ativos = 0
+        self.fila = deque()
+        # Média móvel da duração dos atendimentos, para estimar a espera
+        self.tempo_medio_atendimento = None
+        self.admitidas = 0
+        self.recusadas = 0
+        self.expiradas = 0
+
+    def fila_cheia(self):
+        '''Se uma nova pergunta seria recusada agora (sem vaga e sem espaço na fila). Não altera o estado.'''
+        if self.max_concorrentes <= 0 or (self.ativos < self.max_concorrentes and not self.fila): return False
+        return len(self.fila) >= self.max_fila
+
+    def recusar(self):
+        self.recusadas += 1
+        metricas.erros.incrementar(tipo='sobrecarga')
+
+    def solicitar(self):
+        '''
+        Retorna um futuro que é concluído quando a pergunta puder ser atendida (já concluído, se houver vaga)
+        ou None, se a fila estiver cheia.
+        '''
+        if self.fila_cheia():
+            self.recusar()
+            return None
+        futuro = asyncio.get_running_loop().create_future()
+        if self.max_concorrentes <= 0 or (self.ativos < self.max_concorrentes and not self.fila):
+            self.ativos += 1
+            self.admitidas += 1
+            futuro.set_result(True)
+        else:
+            self.fila.append(futuro)
+        return futuro
+
+    def liberar(self):
+        self.ativos -= 1
+        # A vaga passa diretamente para o primeiro da fila (ignorando os que já desistiram)
+        while self.fila:
+            futuro = self.fila.popleft()
+            if not futuro.done():
+                self.ativos += 1
+                self.admitidas += 1
+                futuro.set_result(True)
+                break
+
+    def desistir(self, futuro):
+        if futuro.done() and not futuro.cancelled():
+            # A vaga foi concedida entre o fim da espera e a desistência
+            self.liberar()
+        else:
+            futuro.cancel()
+            if futuro in self.fila: self.fila.remove(futuro)
+
+    def posicao(self, futuro):
+        return self.fila.index(futuro) + 1 if futuro in self.fila else 0
+
+    def registrar_atendimento(self, duracao: float):
+        self.tempo_medio_atendimento = duracao if self.tempo_medio_atendimento is None else 0.8 * self.tempo_medio_atendimento + 0.2 * duracao
+
+    def tempo_estimado_espera(self, posicao: int=None):
+        '''Estimativa (em segundos inteiros) de espera para a posição informada (por padrão, o fim da fila).'''
+        if posicao is None: posicao = len(self.fila) + 1
+        tempo_medio_atendimento = self.tempo_medio_atendimento or 10
+        return max(1, math.ceil(tempo_medio_atendimento * posicao / max(1, self.max_concorrentes)))
+
+    async def atender(self, mensagens: AsyncIterator[str]) -> AsyncIterator[str]:
+        '''
+        Solicita a vaga e aguarda a vez da pergunta, informando a posição na fila (MensagemControle com status
+        "Na fila"), e então repassa as mensagens da consulta. A vaga só é ocupada quando o stream começa (se o
+        cliente desconectar antes, nada fica reservado) e é liberada ao final, mesmo se o cliente desconectar.
+        '''
+        futuro = self.solicitar()
+        if futuro is None:
+            # A fila encheu entre a verificação na rota (ver fila_cheia) e o início do stream
+            yield MensagemErro(
+                descricao='Servidor sobrecarregado',
+                mensagem=f'O servidor está com muitas perguntas no momento. Por favor, tente novamente em {self.tempo_estimado_espera()} segundos.'
+            ).json() + '\n'
+            await mensagens.aclose()
+            return
+        inicio_espera = time()
+        posicao_informada = None
+        try:
+            while not futuro.done():
+                tempo_restante = self.tempo_max_espera - (time() - inicio_espera)
+                if tempo_restante <= 0: break
+                posicao = self.posicao(futuro)
+                if posicao != posicao_informada:
+                    posicao_informada = posicao
+                    yield MensagemControle(
+                        descricao='Informação de Status',
+                        dados={'tag':'status', 'conteudo':f'Na fila (posição {posicao})'}
+                    ).json() + '\n'
+                try:
+                    await asyncio.wait_for(asyncio.shield(futuro), timeout=min(self.INTERVALO_ATUALIZACAO, tempo_restante))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # Cliente desconectado durante a espera
+            self.desistir(futuro)
+            await mensagens.aclose()
+            raise
+
+        if not futuro.done():
+            self.desistir(futuro)
+            self.expiradas += 1
+            metricas.erros.incrementar(tipo='fila_expirada')
+            yield MensagemErro(
+                descricao='Tempo máximo de espera na fila excedido',
+                mensagem='O servidor está com muitas perguntas no momento. Por favor, tente novamente em alguns instantes.'
+            ).json() + '\n'
+            await mensagens.aclose()
+            return
+
+        inicio_atendimento = time()
+        try:
+            async for mensagem in mensagens: yield mensagem
+        finally:
+            await mensagens.aclose()
+            self.liberar()
+            self.registrar_atendimento(time() - inicio_atendimento)
+
+    def estatisticas(self):
+        return {
+            'ativos': self.ativos,
+            'fila': len(self.fila),
+            'max_concorrentes': self.max_concorrentes,
+            'max_fila': self.max_fila,
+            'admitidas': self.admitidas,
+            'recusadas': self.recusadas,
+            'expiradas': self.expiradas,
+            'tempo_medio_atendimento': self.tempo_medio_atendimento
+        }
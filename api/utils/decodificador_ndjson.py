@@ -0,0 +1,52 @@
+import json
+
+# orjson é opcional: se estiver instalado, é usado para decodificar as linhas, por ser mais rápido
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class DecodificadorNDJSON:
+    '''
+    Decodificador incremental de streams NDJSON (um objeto JSON por linha), como os retornados pelo Ollama.
+    Os fragmentos recebidos da rede podem conter várias linhas ou só parte de uma. Por isso, os bytes são
+    acumulados em um buffer e só as linhas completas são decodificadas.
+    '''
+    def __init__(self, usar_orjson: bool=True):
+        self.buffer = bytearray()
+        self.carregar_json = orjson.loads if usar_orjson and orjson else json.loads
+
+    def decodificar_linha(self, linha):
+        try:
+            return self.carregar_json(linha)
+        except ValueError:
+            print('ERRO: falha na serialização do fragmento\n' + bytes(linha).decode(errors='replace'))
+            return None
+
+    def alimentar(self, fragmento: bytes):
+        '''Recebe um fragmento de bytes e retorna a lista de objetos das linhas que ficaram completas.'''
+        if not self.buffer and fragmento.endswith(b'\n'):
+            # Caso mais comum: o fragmento contém somente linhas completas, sem necessidade do buffer
+            linhas = fragmento.split(b'\n')
+        else:
+            self.buffer += fragmento
+            fim = self.buffer.rfind(b'\n')
+            if fim == -1: return []
+            linhas = self.buffer[:fim].split(b'\n')
+            del self.buffer[:fim + 1]
+
+        registros = []
+        for linha in linhas:
+            if linha.strip():
+                registro = self.decodificar_linha(linha)
+                if registro is not None: registros.append(registro)
+        return registros
+
+    def finalizar(self):
+        '''Decodifica o que restou no buffer (última linha sem quebra de linha ao final).'''
+        restante = bytes(self.buffer)
+        self.buffer.clear()
+        if not restante.strip(): return []
+        registro = self.decodificar_linha(restante)
+        return [registro] if registro is not None else []
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+URL_SCRIPT_SQLITE = os.path.join(os.path.dirname(__file__), '..', 'banco_dados', 'scripts_geracao_sqlite.sql')
+# Colocado na fila por encerrar: a tarefa grava o lote em andamento e termina
+FIM_GRAVACAO = object()
+
+
+def nanossegundos_para_segundos(valor):
+    return valor / 10**9 if valor is not None else None
+
+
+class GravadorInteracoes:
+    '''
+    Grava as interações concluídas (tabelas Interacao e Documento_em_Interacao) em segundo plano.
+    registrar só coloca a interação em uma fila limitada, sem atrasar o stream; uma tarefa assíncrona
+    grava em lotes, a cada tamanho_lote interações ou intervalo_gravacao segundos. Com a fila cheia, a
+    interação é descartada (politica_fila_cheia='descartar') ou quem registra aguarda espaço ('bloquear').
+    '''
+    def __init__(self,
+                 url_banco: str,
+                 tamanho_fila: int=1000,
+                 tamanho_lote: int=50,
+                 intervalo_gravacao: float=2,
+                 politica_fila_cheia: str='descartar',
+                 tipo_dispositivo: str=None):
+        if politica_fila_cheia not in ('descartar', 'bloquear'):
+            raise ValueError(f'Política de fila cheia desconhecida: {politica_fila_cheia}')
+        self.url_banco = url_banco
+        self.tamanho_fila = tamanho_fila
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_gravacao = intervalo_gravacao
+        self.politica_fila_cheia = politica_fila_cheia
+        self.tipo_dispositivo = tipo_dispositivo
+
+        self.fila = None
+        self.tarefa_gravacao = None
+        # Interações já retiradas da fila e ainda não gravadas
+        self.lote = []
+        # A conexão só é usada pela thread do executor
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gravador_interacoes')
+        self.conexao = None
+
+        self.gravadas = 0
+        self.descartadas = 0
+        self.falhas = 0
+
+    def conectar(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.url_banco)), exist_ok=True)
+        self.conexao = sqlite3.connect(self.url_banco, check_same_thread=False, timeout=10)
+        self.conexao.execute('PRAGMA journal_mode=WAL')
+        with open(URL_SCRIPT_SQLITE, 'r', encoding='utf-8') as arq:
+            self.conexao.executescript(arq.read())
+        self.conexao.commit()
+
+    def iniciar(self):
+        if self.tarefa_gravacao is not None: return
+        self.fila = asyncio.Queue(maxsize=self.tamanho_fila)
+        self.tarefa_gravacao = asyncio.get_running_loop().create_task(self.gravar_continuamente())
+
+    def ativo(self):
+        return self.tarefa_gravacao is not None and not self.tarefa_gravacao.done()
+
+    async def registrar(self, conteudo: dict):
+        '''Enfileira o conteúdo da resposta completa (ver GeradorDeRespostas.consultar) para gravação.'''
+        if self.fila is None: return
+        if not self.ativo():
+            # Sem a tarefa de gravação, ninguém esvazia a fila: aguardar espaço travaria o stream
+            self.descartadas += 1
+            return
+        if self.politica_fila_cheia == 'bloquear':
+            await self.fila.put(conteudo)
+            return
+        try:
+            self.fila.put_nowait(conteudo)
+        except asyncio.QueueFull:
+            self.descartadas += 1
+
+    async def gravar_continuamente(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.conectar)
+        except Exception as excecao:
+            print(f'ERRO: falha ao abrir o banco de interações {self.url_banco} ({excecao.__class__.__name__}: {excecao}). As interações serão descartadas')
+            # Libera quem aguarda espaço na fila (politica_fila_cheia='bloquear')
+            while not self.fila.empty():
+                if self.fila.get_nowait() is not FIM_GRAVACAO: self.descartadas += 1
+            return
+        while True:
+            conteudo = await self.fila.get()
+            if conteudo is FIM_GRAVACAO: return
+            self.lote.append(conteudo)
+            # Completa o lote com o que chegar até o fim do intervalo
+            prazo = time() + self.intervalo_gravacao
+            fim = False
+            while len(self.lote) < self.tamanho_lote:
+                tempo_restante = prazo - time()
+                if tempo_restante <= 0: break
+                try:
+                    conteudo = await asyncio.wait_for(self.fila.get(), timeout=tempo_restante)
+                except asyncio.TimeoutError:
+                    break
+                if conteudo is FIM_GRAVACAO:
+                    fim = True
+                    break
+                self.lote.append(conteudo)
+            lote, self.lote = self.lote, []
+            await self.gravar(lote)
+            if fim: return
+
+    async def gravar(self, lote):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.gravar_lote, lote)
+            self.gravadas += len(lote)
+        except Exception as excecao:
+            self.falhas += len(lote)
+            print(f'ERRO: falha na gravação de {len(lote)} interação(ões) ({excecao.__class__.__name__}: {excecao})')
+
+    def montar_interacao(self, conteudo: dict):
+        resposta_llama = conteudo['resposta_llama']
+        return (
+            conteudo['pergunta'],
+            self.tipo_dispositivo,
+            None,
+            resposta_llama.get('model'),
+            nanossegundos_para_segundos(resposta_llama.get('total_duration')),
+            nanossegundos_para_segundos(resposta_llama.get('load_duration')),
+            resposta_llama.get('prompt_eval_count'),
+            nanossegundos_para_segundos(resposta_llama.get('prompt_eval_duration')),
+            resposta_llama.get('eval_count'),
+            nanossegundos_para_segundos(resposta_llama.get('eval_duration')),
+            json.dumps(resposta_llama.get('context')),
+            conteudo['resposta'],
+            conteudo['tempo_inicio_resposta'],
+            conteudo['tempo_consulta'],
+            conteudo['tempo_bert'])
+
+    def montar_documentos(self, conteudo: dict, id_interacao: int):
+        return [
+            (
+                json.dumps(documento.get('resposta_bert'), ensure_ascii=False),
+                documento['score_bert'][0] if documento.get('score_bert') else None,
+                documento.get('score_distancia'),
+                documento.get('score_ponderado'),
+                documento['id'],
+                id_interacao)
+            for documento in conteudo['documentos']]
+
+    def gravar_lote(self, lote):
+        # Uma única transação por lote
+        with self.conexao:
+            for conteudo in lote:
+                cursor = self.conexao.execute(
+                    '''INSERT INTO Interacao (
+                        Pergunta, Tipo_Dispositivo_Aplicacao, Tipo_Dispositivo_LLM, LLM_Nome_Modelo, LLM_Tempo_Total,
+                        LLM_Tempo_Carregamento, LLM_Num_Tokens_Prompt, LLM_Tempo_Processamento_Prompt, LLM_Num_Tokens_Resposta,
+                        LLM_Tempo_Processamento_Resposta, LLM_Contexto_Interacao, LLM_Resposta, LLM_Tempo_Inicio_Stream,
+                        Tempo_Recuperacao_Documentos, Tempo_Avaliacao_Bert)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    self.montar_interacao(conteudo))
+                self.conexao.executemany(
+                    '''INSERT INTO Documento_em_Interacao (
+                        Resposta_Bert, Score_Bert, Score_Distancia, Score_Ponderado, Id_Documento, Id_Interacao)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
+                    self.montar_documentos(conteudo, cursor.lastrowid))
+
+    async def encerrar(self):
+        '''Grava o que ainda estiver na fila (e o lote em andamento) e fecha a conexão.'''
+        if self.tarefa_gravacao is None: return
+        if self.ativo():
+            # A tarefa esvazia a fila até o marcador, gravando tudo o que veio antes dele
+            await self.fila.put(FIM_GRAVACAO)
+        try:
+            await self.tarefa_gravacao
+        except asyncio.CancelledError:
+            pass
+        self.tarefa_gravacao = None
+        # Restos: lote interrompido (tarefa cancelada) e interações registradas depois do marcador
+        pendentes, self.lote = self.lote, []
+        while not self.fila.empty():
+            conteudo = self.fila.get_nowait()
+            if conteudo is not FIM_GRAVACAO: pendentes.append(conteudo)
+        if pendentes:
+            try:
+                if self.conexao is None: await asyncio.get_running_loop().run_in_executor(self.executor, self.conectar)
+            except Exception as excecao:
+                print(f'ERRO: falha ao abrir o banco de interações {self.url_banco} ({excecao.__class__.__name__}: {excecao})')
+                self.descartadas += len(pendentes)
+                pendentes = []
+        if pendentes:
+            await self.gravar(pendentes)
+        if self.conexao is not None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.conexao.close)
+            self.conexao = None
+
+    def estatisticas(self):
+        return {
+            'fila': self.fila.qsize() if self.fila is not None else 0,
+            'gravadas': self.gravadas,
+            'descartadas': self.descartadas,
+            'falhas': self.falhas
+        }
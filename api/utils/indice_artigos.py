@@ -0,0 +1,117 @@
+import re
+import unicodedata
+from typing import Dict, List, Tuple
+
+# Subtítulo dos fragmentos de textos articulados (ver processar_textos_articulado em gerador_banco_vetores.py)
+SUBTITULO_ARTIGO = re.compile(r'^Art\. (\d+(?:-[A-Z])?) - \d+$')
+# Parágrafos no texto dos fragmentos: o "º" de "§ 1º" a "§ 9º" é trocado por "." na geração do banco
+PARAGRAFO_FRAGMENTO = re.compile(r'§ (\d+)[.º]')
+
+# Citações nas perguntas (já normalizadas: minúsculas e sem acentos), como "art. 22", "artigo 10-a",
+# "§ 1º do art. 9", "art. 9, § 1º" ou "paragrafo unico do artigo 7"
+CITACAO_ARTIGO = re.compile(r'\bart(?:igo)?s?\.?\s*(\d+)\s*(?:º|°|o\b)?(?:\s*-\s*([a-z])\b)?')
+CITACAO_PARAGRAFO = re.compile(r'§\s*(\d+)|\bparagrafo\s+(unico|\d+)')
+NUMERO_LEI = re.compile(r'\b(\d{1,2}\.\d{3})\b')
+# Menções a outras normas, que impedem atribuir o artigo citado ao único documento que o contém
+LEI_CITADA = re.compile(r'\blei\s*(?:n[º°o.]*\s*)?(\d{1,2}\.?\d{3})\b')
+OUTRAS_NORMAS = re.compile(r'\b(?:constituicao|codigo|decreto|cf|clt|eca|estatuto)\b')
+
+
+def normalizar(texto: str):
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ' '.join(''.join(caractere for caractere in texto if not unicodedata.combining(caractere)).split())
+
+
+class IndiceArtigos:
+    '''
+    Índice em memória de (documento, artigo, parágrafo) para os ids dos fragmentos, montado a partir dos
+    metadados da coleção. Perguntas que citam um dispositivo ("o que diz o art. 22", "§ 1º do art. 9") são
+    respondidas pelo índice, sem o modelo de embeddings nem a busca no banco de vetores.
+    '''
+    def __init__(self, ids: List[str], metadados: List[dict], documentos: List[str], versao: str=None):
+        self.versao = versao
+        self.fragmentos = {}
+        # (documento, artigo, parágrafo ou None) -> ids dos fragmentos, na ordem do texto
+        self.indice: Dict[Tuple[str, str, str], List[str]] = {}
+        # apelido normalizado -> documento (rótulo usado nos ids, "rotulo:n")
+        self.apelidos = {}
+
+        for id_fragmento, metadado, documento in sorted(zip(ids, metadados, documentos), key=lambda item: self.ordem(item[0])):
+            correspondencia = SUBTITULO_ARTIGO.match(metadado.get('subtitulo') or '')
+            if not correspondencia: continue
+            rotulo = id_fragmento.rsplit(':', 1)[0]
+            artigo = correspondencia.group(1).lower()
+            self.fragmentos[id_fragmento] = (metadado, documento)
+            self.indice.setdefault((rotulo, artigo, None), []).append(id_fragmento)
+            # Cada fragmento de um artigo longo repete o caput e traz só parte dos parágrafos
+            paragrafos = set(PARAGRAFO_FRAGMENTO.findall(documento))
+            if 'Parágrafo único' in documento: paragrafos.add('unico')
+            for paragrafo in paragrafos:
+                self.indice.setdefault((rotulo, artigo, paragrafo), []).append(id_fragmento)
+            if rotulo not in self.apelidos.values(): self.registrar_apelidos(rotulo, metadado.get('titulo') or '')
+
+    @staticmethod
+    def ordem(id_fragmento: str):
+        rotulo, _, numero = id_fragmento.rpartition(':')
+        return (rotulo, int(numero) if numero.isdigit() else 0)
+
+    @classmethod
+    def construir(cls, colecao, versao: str=None):
+        dados = colecao.get(include=['metadatas', 'documents'])
+        return cls(dados['ids'], dados['metadatas'], dados['documents'], versao)
+
+    def registrar_apelidos(self, rotulo: str, titulo: str):
+        # Ex.: "lei_maria_da_penha" e "LEI Nº 11.340, DE 7 DE AGOSTO DE 2006 - Lei Maria da Penha" geram
+        # "lei maria da penha", "11.340" e "11340"
+        apelidos = {normalizar(rotulo.replace('_', ' '))}
+        if ' - ' in titulo: apelidos.add(normalizar(titulo.split(' - ', 1)[1]))
+        for numero in NUMERO_LEI.findall(titulo):
+            apelidos.update((numero, numero.replace('.', '')))
+        for apelido in apelidos:
+            if apelido: self.apelidos[apelido] = rotulo
+
+    def interpretar(self, pergunta: str):
+        '''Retorna (documento ou None, artigo, parágrafo ou None) se a pergunta citar um único artigo; senão, None.'''
+        texto = normalizar(pergunta)
+        artigos = {numero + (f'-{letra}' if letra else '') for numero, letra in CITACAO_ARTIGO.findall(texto)}
+        if len(artigos) != 1: return None
+        paragrafos = {numero or unico for numero, unico in CITACAO_PARAGRAFO.findall(texto)}
+        documentos = {rotulo for apelido, rotulo in self.apelidos.items() if re.search(rf'(?<![\w.]){re.escape(apelido)}(?![\w.])', texto)}
+        if not documentos:
+            # A pergunta cita uma lei que não está no banco (ou outra norma)
+            if any(numero not in self.apelidos for numero in LEI_CITADA.findall(texto)) or OUTRAS_NORMAS.search(texto): return None
+        return (
+            documentos.pop() if len(documentos) == 1 else None,
+            artigos.pop(),
+            paragrafos.pop() if len(paragrafos) == 1 else None)
+
+    def buscar(self, pergunta: str, num_resultados: int):
+        '''
+        Fragmentos do dispositivo citado na pergunta, no formato de resultado de consulta do ChromaDB (com
+        distância 0), ou None se a pergunta não citar um artigo existente em um único documento.
+        '''
+        citacao = self.interpretar(pergunta)
+        if citacao is None: return None
+        documento, artigo, paragrafo = citacao
+        if documento is None:
+            # Sem o documento na pergunta, só vale se o artigo existir em um único documento
+            documentos = {rotulo for rotulo, artigo_indice, _ in self.indice if artigo_indice == artigo}
+            if len(documentos) != 1: return None
+            documento = documentos.pop()
+        # Parágrafo não localizado: usa o artigo inteiro
+        ids = self.indice.get((documento, artigo, paragrafo)) or self.indice.get((documento, artigo, None))
+        if not ids: return None
+        ids = ids[:num_resultados]
+        return {
+            'ids': [ids],
+            'distances': [[0.0] * len(ids)],
+            'metadatas': [[self.fragmentos[id_fragmento][0] for id_fragmento in ids]],
+            'documents': [[self.fragmentos[id_fragmento][1] for id_fragmento in ids]]
+        }
+
+    def estatisticas(self):
+        return {
+            'fragmentos': len(self.fragmentos),
+            'artigos': sum(1 for _, _, paragrafo in self.indice if paragrafo is None),
+            'documentos': len(set(self.apelidos.values()))
+        }
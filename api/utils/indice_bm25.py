@@ -0,0 +1,125 @@
+import re
+from typing import List
+
+import numpy as np
+
+from api.utils.indice_artigos import normalizar
+
+TERMO = re.compile(r'\w+')
+PALAVRAS_VAZIAS = frozenset('''
+    a o e as os de da do das dos em no na nos nas um uma uns umas para por pelo pela pelos pelas com sem que se
+    ao aos ou como mais menos sua seu suas seus ser sao foi ha qual quais quando onde este esta estes estas isso
+    esse essa esses essas ele ela eles elas lhe me minha meu nao sim ja entre sobre ate apos
+'''.split())
+
+
+def tokenizar(texto: str):
+    return [termo for termo in TERMO.findall(normalizar(texto)) if termo not in PALAVRAS_VAZIAS]
+
+
+class IndiceBM25:
+    '''
+    Índice léxico (BM25) dos fragmentos da coleção, em arrays compactos: as listas invertidas ficam em
+    arrays contíguos (posição inicial de cada termo, documentos e pesos), com o peso BM25 de cada par
+    (termo, documento) já calculado. A consulta só soma os pesos dos termos da pergunta e seleciona os maiores.
+    '''
+    def __init__(self, ids: List[str], metadados: List[dict], documentos: List[str], k1: float=1.5, b: float=0.75, versao: str=None):
+        self.versao = versao
+        self.ids = list(ids)
+        self.metadados = list(metadados)
+        self.documentos = list(documentos)
+
+        vocabulario = {}
+        docs_por_termo, freqs_por_termo = [], []
+        comprimentos = np.zeros(len(documentos), dtype=np.float32)
+        for idx_documento, documento in enumerate(documentos):
+            termos = tokenizar(documento)
+            comprimentos[idx_documento] = len(termos)
+            frequencias = {}
+            for termo in termos: frequencias[termo] = frequencias.get(termo, 0) + 1
+            for termo, frequencia in frequencias.items():
+                idx_termo = vocabulario.setdefault(termo, len(vocabulario))
+                if idx_termo == len(docs_por_termo):
+                    docs_por_termo.append([])
+                    freqs_por_termo.append([])
+                docs_por_termo[idx_termo].append(idx_documento)
+                freqs_por_termo[idx_termo].append(frequencia)
+
+        self.vocabulario = vocabulario
+        qtd_documentos = max(1, len(documentos))
+        comprimento_medio = comprimentos.mean() if len(documentos) else 1
+        tamanhos = np.array([len(docs) for docs in docs_por_termo], dtype=np.int64)
+        self.inicio_postings = np.zeros(len(vocabulario) + 1, dtype=np.int64)
+        np.cumsum(tamanhos, out=self.inicio_postings[1:])
+        self.docs_postings = np.fromiter((doc for docs in docs_por_termo for doc in docs), dtype=np.int32, count=int(tamanhos.sum()))
+        frequencias = np.fromiter((freq for freqs in freqs_por_termo for freq in freqs), dtype=np.float32, count=int(tamanhos.sum()))
+        idf = np.log(1 + (qtd_documentos - tamanhos + 0.5) / (tamanhos + 0.5)).astype(np.float32)
+        normalizacao = k1 * (1 - b + b * comprimentos[self.docs_postings] / comprimento_medio)
+        self.pesos_postings = (np.repeat(idf, tamanhos) * frequencias * (k1 + 1) / (frequencias + normalizacao)).astype(np.float32)
+
+    @classmethod
+    def construir(cls, colecao, versao: str=None):
+        dados = colecao.get(include=['metadatas', 'documents'])
+        return cls(dados['ids'], dados['metadatas'], dados['documents'], versao=versao)
+
+    def pontuar(self, pergunta: str):
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for termo in set(tokenizar(pergunta)):
+            idx_termo = self.vocabulario.get(termo)
+            if idx_termo is None: continue
+            inicio, fim = self.inicio_postings[idx_termo], self.inicio_postings[idx_termo + 1]
+            # Cada documento aparece uma só vez na lista de um termo
+            scores[self.docs_postings[inicio:fim]] += self.pesos_postings[inicio:fim]
+        return scores
+
+    def buscar(self, pergunta: str, num_resultados: int):
+        '''
+        Fragmentos com maior score BM25, no formato de resultado de consulta do ChromaDB. O BM25 não tem
+        distância do cosseno: distances fica nulo e o score vai em scores_bm25.
+        '''
+        scores = self.pontuar(pergunta)
+        candidatos = np.flatnonzero(scores)
+        if len(candidatos) > num_resultados:
+            candidatos = candidatos[np.argpartition(-scores[candidatos], num_resultados - 1)[:num_resultados]]
+        candidatos = candidatos[np.argsort(-scores[candidatos], kind='stable')]
+        return {
+            'ids': [[self.ids[idx] for idx in candidatos]],
+            'distances': [[None] * len(candidatos)],
+            'metadatas': [[self.metadados[idx] for idx in candidatos]],
+            'documents': [[self.documentos[idx] for idx in candidatos]],
+            'scores_bm25': [[float(scores[idx]) for idx in candidatos]]
+        }
+
+    def estatisticas(self):
+        return {
+            'fragmentos': len(self.ids),
+            'termos': len(self.vocabulario),
+            'postings': len(self.docs_postings),
+            'bytes': self.inicio_postings.nbytes + self.docs_postings.nbytes + self.pesos_postings.nbytes
+        }
+
+
+def fundir_rrf(resultados: List[dict], num_resultados: int, k: int=60):
+    '''
+    Reciprocal rank fusion de resultados no formato do ChromaDB: cada fragmento soma 1 / (k + posição) em cada
+    lista. O score da fusão vai em scores_rrf (e o BM25, se houver, em scores_bm25). distances só traz a
+    distância do cosseno, das listas que a têm; fragmentos vindos só do BM25 ficam com distância nula
+    (ver InterfaceChroma.completar_distancias).
+    '''
+    scores, dados, distancias, scores_bm25 = {}, {}, {}, {}
+    for resultado in resultados:
+        for posicao, id_fragmento in enumerate(resultado['ids'][0]):
+            scores[id_fragmento] = scores.get(id_fragmento, 0) + 1 / (k + posicao + 1)
+            if id_fragmento not in dados:
+                dados[id_fragmento] = (resultado['metadatas'][0][posicao], resultado['documents'][0][posicao])
+            if resultado['distances'][0][posicao] is not None: distancias.setdefault(id_fragmento, resultado['distances'][0][posicao])
+            if 'scores_bm25' in resultado: scores_bm25[id_fragmento] = resultado['scores_bm25'][0][posicao]
+    ids = sorted(scores, key=lambda id_fragmento: -scores[id_fragmento])[:num_resultados]
+    return {
+        'ids': [ids],
+        'distances': [[distancias.get(id_fragmento) for id_fragmento in ids]],
+        'metadatas': [[dados[id_fragmento][0] for id_fragmento in ids]],
+        'documents': [[dados[id_fragmento][1] for id_fragmento in ids]],
+        'scores_rrf': [[scores[id_fragmento] for id_fragmento in ids]],
+        'scores_bm25': [[scores_bm25.get(id_fragmento) for id_fragmento in ids]]
+    }
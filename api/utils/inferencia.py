@@ -0,0 +1,97 @@
+import os
+import re
+from types import SimpleNamespace
+
+import torch
+from transformers import BertTokenizer, BertForQuestionAnswering
+
+# Backends de inferência disponíveis. 'int8' usa quantização dinâmica do PyTorch (pesos das camadas lineares
+# em int8, só em CPU); 'onnx' e 'onnx_int8' usam um grafo exportado para o ONNX Runtime (dependência opcional)
+BACKENDS_EMBEDDINGS = ('fp32', 'int8')
+BACKENDS_BERT = ('fp32', 'int8', 'onnx', 'onnx_int8')
+
+
+def validar_backend(backend: str, backends_validos, device: str):
+    if backend not in backends_validos:
+        raise ValueError(f'Backend de inferência desconhecido: {backend} (opções: {", ".join(backends_validos)})')
+    if backend != 'fp32' and device != 'cpu':
+        # A quantização dinâmica e o ONNX Runtime (sem provedores de GPU) só se aplicam à CPU
+        print(f'AVISO: backend {backend} só é usado com device=cpu; mantendo fp32 em {device}')
+        return 'fp32'
+    return backend
+
+def importar_onnxruntime(exportar: bool=False):
+    try:
+        import onnxruntime
+        # O pacote onnx só é necessário para exportar o grafo
+        if exportar: import onnx
+    except ImportError:
+        raise ImportError('Os backends onnx requerem os pacotes onnx e onnxruntime (pip install onnx onnxruntime)')
+    return onnxruntime
+
+def quantizar_dinamicamente(modelo: torch.nn.Module):
+    '''Quantização dinâmica: pesos das camadas lineares em int8, ativações quantizadas durante a execução.'''
+    return torch.quantization.quantize_dynamic(modelo, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class ModeloBertOnnx:
+    '''
+    Executa o BertForQuestionAnswering exportado para ONNX com o ONNX Runtime. Pode ser usado no lugar do modelo
+    do transformers em aplicar_bert: recebe as entradas do tokenizador e retorna start_logits e end_logits.
+    '''
+    def __init__(self, url_modelo: str, num_threads: int=0):
+        onnxruntime = importar_onnxruntime()
+        opcoes = onnxruntime.SessionOptions()
+        if num_threads: opcoes.intra_op_num_threads = num_threads
+        self.sessao = onnxruntime.InferenceSession(url_modelo, sess_options=opcoes, providers=['CPUExecutionProvider'])
+        self.nomes_entradas = [entrada.name for entrada in self.sessao.get_inputs()]
+
+    def __call__(self, **entradas):
+        saidas = self.sessao.run(
+            ['start_logits', 'end_logits'],
+            {nome: entradas[nome].cpu().numpy() for nome in self.nomes_entradas})
+        return SimpleNamespace(start_logits=torch.from_numpy(saidas[0]), end_logits=torch.from_numpy(saidas[1]))
+
+def exportar_bert_onnx(modelo: BertForQuestionAnswering, tokenizador: BertTokenizer, url_modelo: str, quantizar: bool=False):
+    os.makedirs(os.path.dirname(os.path.abspath(url_modelo)), exist_ok=True)
+    exemplo = tokenizador(['pergunta'], ['documento'], return_tensors='pt')
+    nomes_entradas = ['input_ids', 'attention_mask', 'token_type_ids']
+    eixos_dinamicos = {nome: {0: 'lote', 1: 'sequencia'} for nome in nomes_entradas + ['start_logits', 'end_logits']}
+    url_fp32 = url_modelo if not quantizar else url_modelo.replace('.onnx', '_fp32.onnx')
+    modelo.eval()
+    torch.onnx.export(
+        modelo,
+        tuple(exemplo[nome] for nome in nomes_entradas),
+        url_fp32,
+        input_names=nomes_entradas,
+        output_names=['start_logits', 'end_logits'],
+        dynamic_axes=eixos_dinamicos,
+        opset_version=17,
+        dynamo=False)
+    if quantizar:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(url_fp32, url_modelo, weight_type=QuantType.QInt8)
+        os.remove(url_fp32)
+
+def url_modelo_onnx(url_modelos_onnx: str, nome_modelo: str, backend: str):
+    return os.path.join(url_modelos_onnx, f"{re.sub(r'[^0-9A-Za-z_.-]', '_', nome_modelo)}_{backend}.onnx")
+
+def carregar_bert_qa(nome_modelo: str, device: str, backend: str='fp32', url_modelos_onnx: str=None, fazer_log: bool=True):
+    '''
+    Retorna o modelo (ou um equivalente, nos backends onnx) e o tokenizador do Bert de question-answering.
+    No backend onnx, o grafo é exportado na primeira execução e reaproveitado nas seguintes.
+    '''
+    backend = validar_backend(backend, BACKENDS_BERT, device)
+    tokenizador = BertTokenizer.from_pretrained(nome_modelo, device=device)
+    if backend in ('onnx', 'onnx_int8'):
+        url_modelo = url_modelo_onnx(url_modelos_onnx, nome_modelo, backend)
+        if not os.path.exists(url_modelo):
+            importar_onnxruntime(exportar=True)
+            if fazer_log: print(f'--- exportando {nome_modelo} para ONNX ({url_modelo})...')
+            exportar_bert_onnx(BertForQuestionAnswering.from_pretrained(nome_modelo), tokenizador, url_modelo, quantizar=backend == 'onnx_int8')
+        return ModeloBertOnnx(url_modelo, num_threads=torch.get_num_threads()), tokenizador
+
+    modelo = BertForQuestionAnswering.from_pretrained(nome_modelo).to(device)
+    modelo.eval()
+    if backend == 'int8': modelo = quantizar_dinamicamente(modelo)
+    return modelo, tokenizador
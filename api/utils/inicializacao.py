@@ -0,0 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Callable, List
+
+
+class CarregadorComponentes:
+    '''
+    Carrega em paralelo (cada um em uma thread) os componentes demorados da API, como os modelos e o banco de
+    vetores, registrando a situação e o tempo de carregamento de cada um. A API fica pronta (ver /health/ready)
+    quando todos os componentes obrigatórios estão carregados.
+    '''
+    def __init__(self, fazer_log: bool=True):
+        self.fazer_log = fazer_log
+        self.componentes = {}
+        self.inicio = None
+        self.tempo_total = None
+
+    def registrar(self, nome: str, carregar: Callable, obrigatorio: bool=True):
+        self.componentes[nome] = {'carregar': carregar, 'obrigatorio': obrigatorio, 'situacao': 'pendente', 'tempo': None, 'erro': None}
+
+    def registrar_tempo(self, nome: str, tempo: float):
+        '''Inclui no detalhamento uma etapa já concluída (como a importação das bibliotecas).'''
+        self.componentes[nome] = {'carregar': None, 'obrigatorio': False, 'situacao': 'pronto', 'tempo': tempo, 'erro': None}
+
+    def carregar_componente(self, nome: str):
+        componente = self.componentes[nome]
+        componente['situacao'] = 'carregando'
+        if self.fazer_log: print(f'-- carregando {nome}...')
+        marcador_tempo_inicio = time()
+        try:
+            componente['carregar']()
+            componente['situacao'] = 'pronto'
+        except Exception as excecao:
+            componente['situacao'] = 'falha'
+            componente['erro'] = f'{excecao.__class__.__name__}: {excecao}'
+            print(f'ERRO: falha no carregamento de {nome} ({componente["erro"]})')
+        componente['tempo'] = time() - marcador_tempo_inicio
+        if self.fazer_log and componente['situacao'] == 'pronto': print(f'-- {nome} carregado ({componente["tempo"]} segundos)')
+
+    async def carregar(self):
+        self.inicio = time()
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self.componentes)), thread_name_prefix='inicializacao')
+        try:
+            await asyncio.gather(*[
+                loop.run_in_executor(executor, self.carregar_componente, nome)
+                for nome, componente in self.componentes.items() if componente['carregar'] is not None])
+        finally:
+            # Sem esperar pelas threads, para não travar o encerramento da API durante o carregamento
+            executor.shutdown(wait=False)
+        self.tempo_total = time() - self.inicio
+        if self.fazer_log:
+            detalhamento = ', '.join(f'{nome}: {componente["tempo"]:.2f}s' for nome, componente in self.componentes.items())
+            print(f'Componentes carregados em {self.tempo_total:.2f} segundos ({detalhamento})')
+
+    def pronto(self):
+        return all(componente['situacao'] == 'pronto' for componente in self.componentes.values() if componente['obrigatorio'])
+
+    def pendentes(self) -> List[str]:
+        return [nome for nome, componente in self.componentes.items() if componente['obrigatorio'] and componente['situacao'] != 'pronto']
+
+    def estatisticas(self):
+        return {
+            'pronto': self.pronto(),
+            'tempo_total': self.tempo_total if self.tempo_total is not None else (time() - self.inicio if self.inicio else None),
+            'componentes': {
+                nome: {chave: valor for chave, valor in componente.items() if chave != 'carregar'}
+                for nome, componente in self.componentes.items()}
+        }
@@ -0,0 +1,129 @@
+import math
+import threading
+from typing import Callable, Dict, List, Tuple
+
+
+# Limites (em segundos) dos buckets dos histogramas de latência
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+# Limites do histograma de quantidade de documentos avaliados pelo Bert
+BUCKETS_PROFUNDIDADE = (0, 1, 2, 3, 5, 10, 20)
+# Limites (em tokens/s) do histograma de vazão do LLM
+BUCKETS_TOKENS_POR_SEGUNDO = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+
+
+def formatar_rotulos(rotulos: dict):
+    if not rotulos: return ''
+    def escapar(valor):
+        return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{chave}="{escapar(valor)}"' for chave, valor in rotulos.items()) + '}'
+
+def formatar_valor(valor):
+    if valor == math.inf: return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    '''Valor que só aumenta (total de ocorrências), separado por rótulos.'''
+    tipo = 'counter'
+
+    def __init__(self, nome: str, descricao: str):
+        self.nome = nome
+        self.descricao = descricao
+        self.valores = {}
+        self.trava = threading.Lock()
+
+    def incrementar(self, valor: float=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self.trava:
+            self.valores[chave] = self.valores.get(chave, 0) + valor
+
+    def amostras(self):
+        with self.trava:
+            return [(self.nome, dict(chave), valor) for chave, valor in self.valores.items()]
+
+
+class Histograma:
+    '''Distribuição de valores em buckets cumulativos, com soma e contagem, no formato do Prometheus.'''
+    tipo = 'histogram'
+
+    def __init__(self, nome: str, descricao: str, buckets: Tuple[float]=BUCKETS_LATENCIA):
+        self.nome = nome
+        self.descricao = descricao
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.contagens = [0] * len(self.buckets)
+        self.soma = 0
+        self.quantidade = 0
+        self.trava = threading.Lock()
+
+    def observar(self, valor: float):
+        if valor is None: return
+        with self.trava:
+            for idx, limite in enumerate(self.buckets):
+                if valor <= limite: self.contagens[idx] += 1
+            self.soma += valor
+            self.quantidade += 1
+
+    def amostras(self):
+        with self.trava:
+            return (
+                [(f'{self.nome}_bucket', {'le': formatar_valor(limite)}, contagem) for limite, contagem in zip(self.buckets, self.contagens)]
+                + [(f'{self.nome}_sum', {}, self.soma), (f'{self.nome}_count', {}, self.quantidade)])
+
+
+class RegistroMetricas:
+    '''
+    Reúne as métricas da API e as exporta no formato de texto do Prometheus (/metrics). Além das métricas
+    atualizadas durante o atendimento, coletores registrados com adicionar_coletor são consultados a cada
+    exportação (medidores como perguntas em andamento, streams do Ollama, estatísticas de caches...).
+    '''
+    def __init__(self):
+        self.metricas = []
+        # Coletores: funções que retornam uma lista de (nome, tipo, descrição, [(rótulos, valor)])
+        self.coletores: List[Callable[[], List[Tuple[str, str, str, List[Tuple[Dict, float]]]]]] = []
+
+    def registrar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+
+    def contador(self, nome: str, descricao: str):
+        return self.registrar(Contador(nome, descricao))
+
+    def histograma(self, nome: str, descricao: str, buckets: Tuple[float]=BUCKETS_LATENCIA):
+        return self.registrar(Histograma(nome, descricao, buckets))
+
+    def adicionar_coletor(self, coletor: Callable):
+        self.coletores.append(coletor)
+
+    def exportar(self):
+        linhas = []
+        def incluir(nome, tipo, descricao, amostras):
+            linhas.append(f'# HELP {nome} {descricao}')
+            linhas.append(f'# TYPE {nome} {tipo}')
+            for nome_amostra, rotulos, valor in amostras:
+                linhas.append(f'{nome_amostra}{formatar_rotulos(rotulos)} {formatar_valor(valor)}')
+
+        for metrica in self.metricas:
+            incluir(metrica.nome, metrica.tipo, metrica.descricao, metrica.amostras())
+        for coletor in self.coletores:
+            try:
+                for nome, tipo, descricao, valores in coletor():
+                    incluir(nome, tipo, descricao, [(nome, rotulos, valor) for rotulos, valor in valores if valor is not None])
+            except Exception as excecao:
+                # Uma falha em um coletor não impede a exportação das demais métricas
+                print(f'AVISO: falha em coletor de métricas ({excecao.__class__.__name__}: {excecao})')
+        return '\n'.join(linhas) + '\n'
+
+
+metricas = RegistroMetricas()
+
+tempo_consulta = metricas.histograma('daphane_tempo_consulta_segundos', 'Tempo do embedding da pergunta e da consulta ao banco de vetores')
+tempo_bert = metricas.histograma('daphane_tempo_bert_segundos', 'Tempo de aplicação do Bert aos documentos recuperados')
+profundidade_rerank = metricas.histograma('daphane_profundidade_rerank', 'Documentos avaliados pelo Bert em cada pergunta (ver PoliticaRerank)', BUCKETS_PROFUNDIDADE)
+tempo_inicio_resposta = metricas.histograma('daphane_tempo_inicio_resposta_segundos', 'Tempo até o primeiro token do LLM')
+tempo_llama_total = metricas.histograma('daphane_tempo_llama_total_segundos', 'Tempo total de geração da resposta pelo LLM')
+tokens_por_segundo = metricas.histograma('daphane_llm_tokens_por_segundo', 'Vazão de cada geração do LLM (eval_count / eval_duration)', BUCKETS_TOKENS_POR_SEGUNDO)
+tokens_gerados = metricas.contador('daphane_llm_tokens_gerados_total', 'Tokens gerados pelo LLM (eval_count)')
+tempo_geracao_tokens = metricas.contador('daphane_llm_tempo_geracao_segundos_total', 'Tempo de geração de tokens informado pelo Ollama (eval_duration)')
+recuperacoes = metricas.contador('daphane_recuperacoes_total', 'Consultas de documentos, por método de recuperação (densa, indice_artigos, bm25 ou fusao_rrf)')
+respostas = metricas.contador('daphane_respostas_total', 'Respostas concluídas, por origem (llm ou cache)')
+erros = metricas.contador('daphane_erros_total', 'Mensagens de erro enviadas aos clientes, por tipo')
@@ -0,0 +1,77 @@
+import math
+from typing import List
+
+
+class PoliticaRerank:
+    '''
+    Decide quantos dos documentos recuperados passam pelo Bert (possivelmente nenhum):
+    - margem_dominancia: se o primeiro documento supera o segundo em score_distancia por pelo menos essa margem,
+      a recuperação é considerada confiável e o Bert não é aplicado;
+    - janela: só são avaliados os documentos com score_distancia até essa distância do primeiro;
+    - orcamento: tempo máximo (em segundos, desde a chegada da pergunta) para os scores ficarem prontos,
+      com o tempo do Bert estimado pela média móvel do tempo por documento;
+    - limiar_fila e profundidade_sob_carga: com limiar_fila ou mais perguntas aguardando o Bert, avalia no
+      máximo profundidade_sob_carga documentos.
+    Parâmetros com valor 0 ficam desativados. A decisão (profundidade e motivos) é incluída na resposta.
+    Margem e janela só valem para a recuperação densa, em que score_distancia (cosseno) está em ordem
+    decrescente; no BM25 e na fusão (RRF), a ordem não segue o cosseno.
+    '''
+    def __init__(self,
+                 margem_dominancia: float=0,
+                 janela: float=0,
+                 orcamento: float=0,
+                 limiar_fila: int=0,
+                 profundidade_sob_carga: int=1,
+                 profundidade_min: int=1):
+        self.margem_dominancia = margem_dominancia
+        self.janela = janela
+        self.orcamento = orcamento
+        self.limiar_fila = limiar_fila
+        self.profundidade_sob_carga = profundidade_sob_carga
+        self.profundidade_min = profundidade_min
+        # Média móvel do tempo do Bert por documento
+        self.tempo_por_documento = None
+
+    def registrar_tempo(self, tempo_bert: float, qtd_documentos: int):
+        if qtd_documentos <= 0: return
+        tempo = tempo_bert / qtd_documentos
+        self.tempo_por_documento = tempo if self.tempo_por_documento is None else 0.8 * self.tempo_por_documento + 0.2 * tempo
+
+    def decidir(self, scores_distancia: List[float], tempo_decorrido: float=0, fila_bert: int=0, recuperacao: str='densa'):
+        '''scores_distancia na ordem da recuperação; recuperacao: método (ver GeradorDeRespostas.consultar).'''
+        qtd_documentos = len(scores_distancia)
+        profundidade = qtd_documentos
+        motivos = []
+        # Margem e janela pressupõem scores do cosseno em ordem decrescente
+        com_distancias = recuperacao == 'densa' and qtd_documentos > 0 and None not in scores_distancia
+        margem = scores_distancia[0] - scores_distancia[1] if com_distancias and qtd_documentos > 1 else None
+
+        if self.margem_dominancia and margem is not None and margem >= self.margem_dominancia:
+            profundidade = 0
+            motivos.append('dominante')
+        elif self.janela and com_distancias:
+            na_janela = sum(1 for score in scores_distancia if scores_distancia[0] - score <= self.janela)
+            if na_janela < profundidade:
+                profundidade = max(min(self.profundidade_min, qtd_documentos), na_janela)
+                motivos.append('janela')
+
+        if profundidade and self.limiar_fila and fila_bert >= self.limiar_fila and profundidade > self.profundidade_sob_carga:
+            profundidade = self.profundidade_sob_carga
+            motivos.append('carga')
+
+        tempo_estimado = profundidade * self.tempo_por_documento if self.tempo_por_documento is not None else None
+        if profundidade and self.orcamento and tempo_estimado is not None and tempo_decorrido + tempo_estimado > self.orcamento:
+            profundidade = max(0, min(profundidade, math.floor((self.orcamento - tempo_decorrido) / self.tempo_por_documento)))
+            tempo_estimado = profundidade * self.tempo_por_documento
+            motivos.append('orcamento')
+
+        return {
+            'profundidade': profundidade,
+            'candidatos': qtd_documentos,
+            'motivos': motivos or ['completa'],
+            'margem': margem,
+            'recuperacao': recuperacao,
+            'tempo_decorrido': tempo_decorrido,
+            'fila_bert': fila_bert,
+            'tempo_estimado_bert': tempo_estimado
+        }
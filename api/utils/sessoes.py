@@ -0,0 +1,142 @@
+from array import array
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import List
+
+import os
+import sqlite3
+
+# O contexto do Ollama é uma lista de ids de tokens. Armazenado como array de inteiros sem sinal
+# de 32 bits, ocupa 4 bytes por token (em vez de uma lista de objetos int do Python)
+TIPO_ARRAY_CONTEXTO = 'I'
+
+
+class ArmazenamentoSessoesMemoria:
+    '''
+    Armazena, no próprio processo, o contexto do Ollama de cada sessão de conversa. Sessões são descartadas
+    por tempo sem uso (ttl) e, quando excedidos a quantidade máxima de sessões ou o limite de memória,
+    a partir da usada há mais tempo.
+    '''
+    def __init__(self, max_sessoes: int, ttl: float=None, max_memoria_mb: float=None):
+        self.max_sessoes = max_sessoes
+        self.ttl = ttl
+        self.max_bytes = int(max_memoria_mb * 1024 * 1024) if max_memoria_mb else None
+        self.sessoes = OrderedDict()
+        self.total_bytes = 0
+        self.trava = Lock()
+
+    def descartar(self, id_sessao: str):
+        contexto, _ = self.sessoes.pop(id_sessao)
+        self.total_bytes -= contexto.itemsize * len(contexto)
+
+    def obter_contexto(self, id_sessao: str) -> List[int]:
+        with self.trava:
+            sessao = self.sessoes.get(id_sessao)
+            if sessao is None: return None
+            if self.ttl is not None and time() - sessao[1] > self.ttl:
+                self.descartar(id_sessao)
+                return None
+            self.sessoes.move_to_end(id_sessao)
+            return sessao[0].tolist()
+
+    def salvar_contexto(self, id_sessao: str, contexto: List[int]):
+        contexto = array(TIPO_ARRAY_CONTEXTO, contexto or [])
+        with self.trava:
+            if id_sessao in self.sessoes: self.descartar(id_sessao)
+            self.sessoes[id_sessao] = (contexto, time())
+            self.total_bytes += contexto.itemsize * len(contexto)
+            while len(self.sessoes) > 1 and (
+                    len(self.sessoes) > self.max_sessoes or
+                    (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+                self.descartar(next(iter(self.sessoes)))
+
+    def remover(self, id_sessao: str):
+        with self.trava:
+            if id_sessao in self.sessoes: self.descartar(id_sessao)
+
+    def estatisticas(self):
+        return {'sessoes': len(self.sessoes), 'bytes': self.total_bytes}
+
+    def encerrar(self):
+        pass
+
+
+class ArmazenamentoSessoesSQLite:
+    '''
+    Armazena o contexto das sessões em um banco SQLite, de forma que vários workers da API compartilhem
+    as sessões. Segue as mesmas regras de descarte do armazenamento em memória.
+    '''
+    def __init__(self, url_banco: str, max_sessoes: int, ttl: float=None, max_memoria_mb: float=None):
+        self.url_banco = url_banco
+        self.max_sessoes = max_sessoes
+        self.ttl = ttl
+        self.max_bytes = int(max_memoria_mb * 1024 * 1024) if max_memoria_mb else None
+        self.trava = Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(url_banco)), exist_ok=True)
+        self.conexao = sqlite3.connect(url_banco, check_same_thread=False, timeout=10)
+        # WAL permite leituras simultâneas de outros processos durante as escritas
+        self.conexao.execute('PRAGMA journal_mode=WAL')
+        self.conexao.execute('''CREATE TABLE IF NOT EXISTS Sessao (
+            Id_Sessao TEXT NOT NULL PRIMARY KEY,
+            Contexto BLOB,
+            Num_Bytes INTEGER,
+            Ultimo_Acesso REAL)''')
+        self.conexao.execute('CREATE INDEX IF NOT EXISTS Ix_Sessao_Ultimo_Acesso ON Sessao (Ultimo_Acesso)')
+        self.conexao.commit()
+
+    def obter_contexto(self, id_sessao: str) -> List[int]:
+        with self.trava:
+            registro = self.conexao.execute('SELECT Contexto, Ultimo_Acesso FROM Sessao WHERE Id_Sessao = ?', (id_sessao,)).fetchone()
+            if registro is None: return None
+            if self.ttl is not None and time() - registro[1] > self.ttl:
+                self.conexao.execute('DELETE FROM Sessao WHERE Id_Sessao = ?', (id_sessao,))
+                self.conexao.commit()
+                return None
+            self.conexao.execute('UPDATE Sessao SET Ultimo_Acesso = ? WHERE Id_Sessao = ?', (time(), id_sessao))
+            self.conexao.commit()
+        contexto = array(TIPO_ARRAY_CONTEXTO)
+        contexto.frombytes(registro[0])
+        return contexto.tolist()
+
+    def salvar_contexto(self, id_sessao: str, contexto: List[int]):
+        contexto = array(TIPO_ARRAY_CONTEXTO, contexto or []).tobytes()
+        agora = time()
+        with self.trava:
+            self.conexao.execute(
+                'INSERT OR REPLACE INTO Sessao (Id_Sessao, Contexto, Num_Bytes, Ultimo_Acesso) VALUES (?, ?, ?, ?)',
+                (id_sessao, contexto, len(contexto), agora))
+            if self.ttl is not None:
+                self.conexao.execute('DELETE FROM Sessao WHERE Ultimo_Acesso < ?', (agora - self.ttl,))
+            # Descarta as sessões usadas há mais tempo, até respeitar os limites
+            self.conexao.execute(
+                'DELETE FROM Sessao WHERE Id_Sessao IN (SELECT Id_Sessao FROM Sessao ORDER BY Ultimo_Acesso DESC LIMIT -1 OFFSET ?)',
+                (self.max_sessoes,))
+            if self.max_bytes is not None:
+                self.conexao.execute('''DELETE FROM Sessao WHERE Id_Sessao IN (
+                    SELECT Id_Sessao FROM (
+                        SELECT Id_Sessao, SUM(Num_Bytes) OVER (ORDER BY Ultimo_Acesso DESC, Id_Sessao) AS Acumulado FROM Sessao)
+                    WHERE Acumulado > ? AND Id_Sessao <> ?)''', (self.max_bytes, id_sessao))
+            self.conexao.commit()
+
+    def remover(self, id_sessao: str):
+        with self.trava:
+            self.conexao.execute('DELETE FROM Sessao WHERE Id_Sessao = ?', (id_sessao,))
+            self.conexao.commit()
+
+    def estatisticas(self):
+        with self.trava:
+            sessoes, num_bytes = self.conexao.execute('SELECT COUNT(*), COALESCE(SUM(Num_Bytes), 0) FROM Sessao').fetchone()
+        return {'sessoes': sessoes, 'bytes': num_bytes}
+
+    def encerrar(self):
+        self.conexao.close()
+
+
+def criar_armazenamento_sessoes(tipo: str, max_sessoes: int, ttl: float=None, max_memoria_mb: float=None, url_banco: str=None):
+    if tipo == 'memoria':
+        return ArmazenamentoSessoesMemoria(max_sessoes=max_sessoes, ttl=ttl, max_memoria_mb=max_memoria_mb)
+    if tipo == 'sqlite':
+        return ArmazenamentoSessoesSQLite(url_banco=url_banco, max_sessoes=max_sessoes, ttl=ttl, max_memoria_mb=max_memoria_mb)
+    raise ValueError(f'Tipo de armazenamento de sessões desconhecido: {tipo}')
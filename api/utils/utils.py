@@ -3,30 +3,69 @@ from pydantic import BaseModel
 from sentence_transformers import SentenceTransformer
 from torch import cuda
 
+import asyncio
 import httpx
 import json
+import numpy as np
+import os
+import threading
+import unicodedata
+from time import time
 from api.environment.environment import environment
+from api.utils.cache import CacheLRU
+from api.utils.decodificador_ndjson import DecodificadorNDJSON
+from api.utils.inferencia import BACKENDS_EMBEDDINGS, quantizar_dinamicamente, validar_backend
 from typing import List
 
 
+def url_manifesto_colecao(url_banco_vetores: str, nome_colecao: str):
+    # Manifesto com os hashes dos documentos de uma coleção (ver api/conteudo/gerador_banco_vetores.py)
+    return os.path.join(url_banco_vetores, f'manifesto_{nome_colecao}.json')
+
 class DadosChat(BaseModel):
     pergunta: str
-    contexto: list
+    # O contexto pode ser enviado diretamente ou, com sessões habilitadas, mantido no servidor e
+    # identificado somente pelo id da sessão
+    contexto: list = []
+    id_sessao: str = None
 
 class FuncaoEmbeddings(EmbeddingFunction):
     # A instrução oferecida tem melhor resultado em inglês e no formato proposto no artigo do instructor. (Represent the legislative document question for retrieving supporting documents)
-    def __init__(self, nome_modelo: str, tipo_modelo=SentenceTransformer, device: str=None, instrucao: str="Represent the legislative document for retrieval:"):
+    def __init__(self, nome_modelo: str, tipo_modelo=SentenceTransformer, device: str=None, instrucao: str="Represent the legislative document for retrieval:", cache: CacheLRU=None, carregar_modelo: bool=True, backend: str='fp32'):
         if device:
             self.device = device
         else:
             self.device = 'cuda' if cuda.is_available() else 'cpu'
+        # 'int8' aplica quantização dinâmica ao modelo (só em CPU, ver api/utils/inferencia.py)
+        self.backend = validar_backend(backend, BACKENDS_EMBEDDINGS, self.device)
 
-        # Carrega o modelo pre-treinado a partir do tipo de modelo escolhido
-        self.model = tipo_modelo(nome_modelo, device=self.device)
-        self.model.to(self.device)
+        self.nome_modelo = nome_modelo
+        self.tipo_modelo = tipo_modelo
+        self.model = None
+        self.trava_carregamento = threading.Lock()
+        # Com carregar_modelo=False, o modelo é carregado depois (com carregar) ou no primeiro uso
+        if carregar_modelo: self.carregar()
         self.instrucao = instrucao
+        # Cache opcional dos embeddings já calculados, com chave (instrução, texto normalizado)
+        self.cache = cache
 
-    def __call__(self, input: Documents) -> Embeddings:
+    def carregar(self):
+        with self.trava_carregamento:
+            if self.model is not None: return
+            # Carrega o modelo pre-treinado a partir do tipo de modelo escolhido
+            model = self.tipo_modelo(self.nome_modelo, device=self.device)
+            model.to(self.device)
+            if self.backend == 'int8': model = quantizar_dinamicamente(model)
+            self.model = model
+
+    @staticmethod
+    def normalizar_texto(texto: str):
+        # Perguntas que diferem só em maiúsculas, espaços ou pontuação final compartilham o embedding
+        texto = unicodedata.normalize('NFC', texto)
+        return ' '.join(texto.lower().split()).rstrip('?!.; ')
+
+    def gerar_embeddings(self, input: Documents) -> Embeddings:
+        if self.model is None: self.carregar()
         # obtém os embeddings do texto
         if self.instrucao:
             input_instrucao = [(self.instrucao, doc) for doc in input]
@@ -34,12 +73,95 @@ class FuncaoEmbeddings(EmbeddingFunction):
         else:
             embeddings = self.model.encode(input, convert_to_numpy=True, device=self.device)
         return embeddings.tolist()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if self.cache is None: return self.gerar_embeddings(input)
+
+        chaves = [(self.instrucao or '', self.normalizar_texto(doc)) for doc in input]
+        embeddings = [self.cache.obter(chave) for chave in chaves]
+        pendentes = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if pendentes:
+            # Só os textos ausentes do cache passam pelo modelo, em uma única chamada
+            novos_embeddings = self.gerar_embeddings([input[idx] for idx in pendentes])
+            for idx, embedding in zip(pendentes, novos_embeddings):
+                embeddings[idx] = embedding
+                self.cache.inserir(chaves[idx], embedding)
+        return embeddings
     
 class ClienteOllama:
-    def __init__(self, nome_modelo: str, url_llama: str, temperature: float=0):
+    def __init__(self,
+                 nome_modelo: str,
+                 url_llama: str,
+                 temperature: float=0,
+                 max_conexoes: int=environment.OLLAMA_MAX_CONEXOES,
+                 max_conexoes_keepalive: int=environment.OLLAMA_MAX_CONEXOES_KEEPALIVE,
+                 tempo_keepalive: float=environment.OLLAMA_TEMPO_KEEPALIVE,
+                 timeout_conexao: float=environment.OLLAMA_TIMEOUT_CONEXAO,
+                 timeout_primeiro_byte: float=environment.OLLAMA_TIMEOUT_PRIMEIRO_BYTE,
+                 timeout_entre_tokens: float=environment.OLLAMA_TIMEOUT_ENTRE_TOKENS,
+                 keep_alive: str=environment.OLLAMA_KEEP_ALIVE):
         self.modelo = nome_modelo
         self.url_llama = url_llama
         self.temperature = temperature
+        # Tempo que o Ollama mantém o modelo carregado após cada requisição
+        self.keep_alive = keep_alive
+
+        self.max_conexoes = max_conexoes
+        self.max_conexoes_keepalive = max_conexoes_keepalive
+        self.tempo_keepalive = tempo_keepalive
+        self.timeout_conexao = timeout_conexao
+        self.timeout_primeiro_byte = timeout_primeiro_byte
+        self.timeout_entre_tokens = timeout_entre_tokens
+
+        # Um único cliente HTTP (e pool de conexões) por processo, criado em iniciar() e fechado em encerrar()
+        self.cliente_http = None
+
+        # Estado do backend, atualizado pelas verificações de saúde e falhas (ver RoteadorOllama)
+        self.saudavel = True
+        self.modelo_carregado = False
+        self.falhas = 0
+        self.falhas_consecutivas = 0
+        self.ultimo_envio = 0
+
+        # Dados para acompanhar a saturação do pool de conexões
+        self.streams_ativos = 0
+        self.max_streams_ativos = 0
+        self.requisicoes_com_pool_saturado = 0
+        self.total_requisicoes = 0
+
+    def iniciar(self):
+        if self.cliente_http is not None: return
+        self.cliente_http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_conexoes,
+                max_keepalive_connections=self.max_conexoes_keepalive,
+                keepalive_expiry=self.tempo_keepalive),
+            # O tempo até o primeiro byte e entre os tokens é controlado em stream(). O timeout de
+            # leitura do httpx fica só como salvaguarda. O de pool é o tempo de espera por uma conexão livre
+            timeout=httpx.Timeout(
+                connect=self.timeout_conexao,
+                read=max(self.timeout_primeiro_byte, self.timeout_entre_tokens),
+                write=self.timeout_conexao,
+                pool=self.timeout_primeiro_byte))
+
+    async def encerrar(self):
+        if self.cliente_http is None: return
+        await self.cliente_http.aclose()
+        self.cliente_http = None
+
+    def estatisticas(self):
+        return {
+            'url_llama': self.url_llama,
+            'saudavel': self.saudavel,
+            'modelo_carregado': self.modelo_carregado,
+            'falhas': self.falhas,
+            'falhas_consecutivas': self.falhas_consecutivas,
+            'streams_ativos': self.streams_ativos,
+            'max_streams_ativos': self.max_streams_ativos,
+            'max_conexoes': self.max_conexoes,
+            'total_requisicoes': self.total_requisicoes,
+            'requisicoes_com_pool_saturado': self.requisicoes_com_pool_saturado
+        }
 
     async def stream(self, prompt: str, contexto=[]):
         url = f"{self.url_llama}/api/generate"
@@ -50,25 +172,204 @@ class ClienteOllama:
             "temperature": self.temperature,
             "context": contexto,
             "stream": True,
-            "max_new_tokens": 4096
+            "max_new_tokens": 4096,
+            "keep_alive": self.keep_alive
         }
         
-        # Using httpx in synchronous mode
-        async with httpx.AsyncClient() as client:
-            async with client.stream("POST", url, json=payload, timeout=120) as resposta:
+        if self.cliente_http is None: self.iniciar()
+
+        self.total_requisicoes += 1
+        self.ultimo_envio = time()
+        if self.streams_ativos >= self.max_conexoes: self.requisicoes_com_pool_saturado += 1
+        self.streams_ativos += 1
+        self.max_streams_ativos = max(self.max_streams_ativos, self.streams_ativos)
+        try:
+            requisicao = self.cliente_http.build_request("POST", url, json=payload)
+            resposta = await asyncio.wait_for(self.cliente_http.send(requisicao, stream=True), timeout=self.timeout_primeiro_byte)
+            try:
                 resposta.raise_for_status()
 
-                async for fragmento in resposta.aiter_bytes():
-                    if fragmento:
-                        try:
-                            yield json.loads(fragmento.decode())
-                        except:
-                            print('ERRO: falha na serialização do fragmento\n' + fragmento.decode())
+                # Os fragmentos de bytes não respeitam os limites das linhas do NDJSON
+                decodificador = DecodificadorNDJSON()
+                fragmentos = resposta.aiter_bytes()
+                while True:
+                    try:
+                        fragmento = await asyncio.wait_for(fragmentos.__anext__(), timeout=self.timeout_entre_tokens)
+                    except StopAsyncIteration:
+                        break
+                    for registro in decodificador.alimentar(fragmento):
+                        yield registro
+                for registro in decodificador.finalizar():
+                    yield registro
+            finally:
+                await resposta.aclose()
+        finally:
+            self.streams_ativos -= 1
 
-class InterfaceOllama:
-    def __init__(self, nome_modelo: str, url_llama: str, temperature: float=0):
+    async def gerar(self, prompt: str, contexto=[], opcoes: dict=None):
+        '''Geração sem stream, retornando o objeto de resposta completo do Ollama.'''
+        if self.cliente_http is None: self.iniciar()
+        payload = {
+            "model": self.modelo,
+            "prompt": prompt,
+            "context": contexto,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": opcoes or {}
+        }
+        resposta = await self.cliente_http.post(f"{self.url_llama}/api/generate", json=payload, timeout=self.timeout_primeiro_byte)
+        resposta.raise_for_status()
+        return resposta.json()
+
+class RoteadorOllama:
+    '''
+    Distribui as gerações entre vários servidores do Ollama (um ClienteOllama por servidor). Cada requisição
+    vai para o servidor saudável com menos gerações em andamento; se ele falhar antes do primeiro token
+    (conexão, tempo esgotado ou erro 5xx), a requisição é repetida no seguinte. A saúde dos servidores é verificada periodicamente em /api/tags
+    (o modelo está disponível?) e /api/ps (o modelo está carregado?).
+    '''
+    def __init__(self,
+                 nome_modelo: str,
+                 urls_llama: List[str],
+                 temperature: float=0,
+                 intervalo_verificacao: float=environment.OLLAMA_INTERVALO_VERIFICACAO,
+                 timeout_verificacao: float=environment.OLLAMA_TIMEOUT_CONEXAO):
+        self.modelo = nome_modelo
+        self.clientes = [ClienteOllama(url_llama=url_llama, nome_modelo=nome_modelo, temperature=temperature) for url_llama in urls_llama]
+        self.intervalo_verificacao = intervalo_verificacao
+        self.timeout_verificacao = timeout_verificacao
+        # As verificações usam um cliente HTTP próprio, para não disputar as conexões dos streams
+        self.cliente_verificacao = None
+        self.tarefa_verificacao = None
+        self.failovers = 0
 
-        self.cliente_ollama = ClienteOllama(url_llama= url_llama, nome_modelo=nome_modelo, temperature=temperature)
+    def iniciar(self):
+        for cliente in self.clientes: cliente.iniciar()
+        if self.cliente_verificacao is None:
+            self.cliente_verificacao = httpx.AsyncClient(timeout=self.timeout_verificacao)
+        if self.tarefa_verificacao is None and self.intervalo_verificacao > 0:
+            try:
+                self.tarefa_verificacao = asyncio.get_running_loop().create_task(self.verificar_periodicamente())
+            except RuntimeError:
+                # Fora de um event loop (scripts), não há verificação periódica
+                pass
+
+    async def encerrar(self):
+        if self.tarefa_verificacao is not None:
+            self.tarefa_verificacao.cancel()
+            self.tarefa_verificacao = None
+        if self.cliente_verificacao is not None:
+            await self.cliente_verificacao.aclose()
+            self.cliente_verificacao = None
+        for cliente in self.clientes: await cliente.encerrar()
+
+    def contem_modelo(self, nomes_modelos):
+        return self.modelo in nomes_modelos or f'{self.modelo}:latest' in nomes_modelos
+
+    async def verificar_saude(self, cliente: ClienteOllama):
+        if self.cliente_verificacao is None: self.iniciar()
+        try:
+            resposta = await self.cliente_verificacao.get(f'{cliente.url_llama}/api/tags')
+            resposta.raise_for_status()
+            modelo_disponivel = self.contem_modelo({modelo['name'] for modelo in resposta.json().get('models', [])})
+            resposta = await self.cliente_verificacao.get(f'{cliente.url_llama}/api/ps')
+            resposta.raise_for_status()
+            cliente.modelo_carregado = self.contem_modelo({modelo['name'] for modelo in resposta.json().get('models', [])})
+            if cliente.saudavel != modelo_disponivel:
+                print(f'Ollama em {cliente.url_llama}: {"disponível" if modelo_disponivel else f"{self.modelo} não disponível"}')
+            cliente.saudavel = modelo_disponivel
+            # Servidores que falharam nas gerações voltam a ser tentados normalmente a cada verificação bem-sucedida
+            if modelo_disponivel: cliente.falhas_consecutivas = 0
+        except Exception as excecao:
+            if cliente.saudavel: print(f'AVISO: Ollama em {cliente.url_llama} indisponível ({excecao.__class__.__name__})')
+            cliente.saudavel = False
+            cliente.modelo_carregado = False
+        return cliente.saudavel
+
+    async def verificar_todos(self):
+        return await asyncio.gather(*[self.verificar_saude(cliente) for cliente in self.clientes])
+
+    async def verificar_periodicamente(self):
+        while True:
+            await self.verificar_todos()
+            await asyncio.sleep(self.intervalo_verificacao)
+
+    def escolher_cliente(self, clientes_tentados):
+        # Saudáveis e sem falhas recentes primeiro; depois, menos gerações em andamento, modelo já carregado e
+        # envio mais antigo (revezamento). Os não saudáveis são a última opção (a verificação pode estar defasada)
+        candidatos = [cliente for cliente in self.clientes if cliente not in clientes_tentados]
+        if not candidatos: return None
+        return min(candidatos, key=lambda cliente: (
+            not cliente.saudavel, cliente.falhas_consecutivas > 0, cliente.streams_ativos, not cliente.modelo_carregado, cliente.ultimo_envio))
+
+    @staticmethod
+    def falha_do_servidor(excecao: Exception):
+        '''
+        Se a falha é do servidor (conexão, tempo esgotado ou erro 5xx) e justifica tentar outro. Erros 4xx vêm
+        da própria requisição (modelo inexistente, payload inválido) e se repetiriam em todos os servidores.
+        '''
+        if isinstance(excecao, httpx.HTTPStatusError): return excecao.response.status_code >= 500
+        return isinstance(excecao, (httpx.TransportError, asyncio.TimeoutError, TimeoutError))
+
+    def registrar_falha(self, cliente: ClienteOllama, excecao: Exception):
+        cliente.saudavel = False
+        cliente.falhas += 1
+        cliente.falhas_consecutivas += 1
+        self.failovers += 1
+        print(f'AVISO: falha no Ollama em {cliente.url_llama} ({excecao.__class__.__name__}). Tentando outro servidor')
+
+    async def stream(self, prompt: str, contexto=[]):
+        # A escolha é refeita a cada tentativa, com a carga atual dos servidores ainda não tentados
+        clientes_tentados = []
+        ultima_excecao = RuntimeError('Nenhum servidor do Ollama configurado')
+        while (cliente := self.escolher_cliente(clientes_tentados)) is not None:
+            clientes_tentados.append(cliente)
+            recebeu_token = False
+            try:
+                async for registro in cliente.stream(prompt=prompt, contexto=contexto):
+                    recebeu_token = True
+                    yield registro
+                cliente.falhas_consecutivas = 0
+                return
+            except Exception as excecao:
+                # Depois do primeiro token, parte da resposta já foi enviada: não há como repetir
+                if recebeu_token or not self.falha_do_servidor(excecao): raise
+                self.registrar_falha(cliente, excecao)
+                ultima_excecao = excecao
+        raise ultima_excecao
+
+    async def gerar(self, prompt: str, contexto=[], opcoes: dict=None):
+        clientes_tentados = []
+        ultima_excecao = RuntimeError('Nenhum servidor do Ollama configurado')
+        while (cliente := self.escolher_cliente(clientes_tentados)) is not None:
+            clientes_tentados.append(cliente)
+            try:
+                resposta = await cliente.gerar(prompt=prompt, contexto=contexto, opcoes=opcoes)
+                cliente.falhas_consecutivas = 0
+                return resposta
+            except Exception as excecao:
+                if not self.falha_do_servidor(excecao): raise
+                self.registrar_falha(cliente, excecao)
+                ultima_excecao = excecao
+        raise ultima_excecao
+
+    def estatisticas(self):
+        estatisticas_clientes = [cliente.estatisticas() for cliente in self.clientes]
+        return {
+            'streams_ativos': sum(estatisticas['streams_ativos'] for estatisticas in estatisticas_clientes),
+            'max_conexoes': sum(estatisticas['max_conexoes'] for estatisticas in estatisticas_clientes),
+            'total_requisicoes': sum(estatisticas['total_requisicoes'] for estatisticas in estatisticas_clientes),
+            'requisicoes_com_pool_saturado': sum(estatisticas['requisicoes_com_pool_saturado'] for estatisticas in estatisticas_clientes),
+            'backends_saudaveis': sum(1 for estatisticas in estatisticas_clientes if estatisticas['saudavel']),
+            'failovers': self.failovers,
+            'backends': estatisticas_clientes
+        }
+
+class InterfaceOllama:
+    def __init__(self, nome_modelo: str, url_llama, temperature: float=0):
+        # url_llama: um endereço, vários separados por vírgula ou uma lista de endereços
+        urls_llama = [url.strip() for url in url_llama.split(',')] if isinstance(url_llama, str) else list(url_llama)
+        self.cliente_ollama = RoteadorOllama(urls_llama=[url for url in urls_llama if url], nome_modelo=nome_modelo, temperature=temperature)
 
         self.papel_do_LLM = '''Você é uma assistente que responde a dúvidas de mulheres sobre a Lei Maria da Penha.
 Assuma um tom formal, porém caloroso, com gentileza nas respostas. Utilize palavras e termos que sejam claros, autoexplicativos e linguagem simples, próximo do que o cidadão comum utiliza.'''
@@ -78,13 +379,38 @@ Na resposta, não mencione que foi fornecido documentos de referência. Cite os
 A resposta não deve ter saudação, vocativo, nem qualquer tipo de introdução que dê a entender que não houve interação anterior.
 Se você não souber a resposta, assuma um tom gentil e diga que não tem informações suficientes para responder.'''
 
+        # O prefixo com as definições do sistema é igual em todas as requisições. Montado uma única vez,
+        # permite que o Ollama reaproveite a avaliação já feita desse trecho (ver aquecer)
+        definicoes_sistema = f'''PAPEL: {self.papel_do_LLM}. DIRETRIZES PARA AS RESPOSTAS: {self.diretrizes}'''
+        self.prefixo_sistema = f'<s>[INST]<<SYS>>\n{definicoes_sistema}\n<</SYS>>\n'
+
     def formatar_prompt_usuario(self, pergunta: str, documentos: List[str]):
         return 'DOCUMENTOS:\n{}\nPERGUNTA: {}'.format('\n'.join(documentos), pergunta)
 
     def criar_prompt_llama(self, prompt_usuario: str):
-        definicoes_sistema = f'''PAPEL: {self.papel_do_LLM}. DIRETRIZES PARA AS RESPOSTAS: {self.diretrizes}'''
-        return f'<s>[INST]<<SYS>>\n{definicoes_sistema}\n<</SYS>>\n{prompt_usuario}[/INST]'
+        return f'{self.prefixo_sistema}{prompt_usuario}[/INST]'
     
+    def iniciar(self):
+        self.cliente_ollama.iniciar()
+
+    async def aquecer(self, num_requisicoes: int=1):
+        '''
+        Carrega o modelo no Ollama (mantido em memória pelo keep_alive) e avalia o prefixo do sistema,
+        gerando um único token. Como o Ollama reaproveita o cache do prompt com o maior prefixo em comum,
+        as requisições seguintes não precisam reavaliar esse trecho. Uma requisição por slot paralelo.
+        '''
+        marcador_tempo_inicio = time()
+        # Cada servidor é aquecido separadamente. Basta que um deles responda
+        respostas = await asyncio.gather(*[
+            cliente.gerar(prompt=self.prefixo_sistema, opcoes={'num_predict': 1})
+            for cliente in self.cliente_ollama.clientes
+            for _ in range(num_requisicoes)], return_exceptions=True)
+        if all(isinstance(resposta, BaseException) for resposta in respostas): raise respostas[0]
+        return time() - marcador_tempo_inicio
+
+    async def encerrar(self):
+        await self.cliente_ollama.encerrar()
+
     async def gerar_resposta_llama(self, pergunta: str, documentos: List[str], contexto:List[int]=environment.CONTEXTO_BASE):
         prompt_usuario = self.formatar_prompt_usuario(pergunta, documentos)
         prompt = self.criar_prompt_llama(prompt_usuario=prompt_usuario)
@@ -108,7 +434,38 @@ class InterfaceChroma:
         self.banco_de_vetores = chromadb.PersistentClient(path=url_banco_vetores)
 
         if fazer_log: print(f'--- definindo a coleção a ser usada ({colecao_de_documentos})...')
+        self.funcao_de_embeddings = funcao_de_embeddings
+        self.nome_colecao = colecao_de_documentos
+        self.url_manifesto = url_manifesto_colecao(url_banco_vetores, colecao_de_documentos)
         self.colecao_documentos = self.banco_de_vetores.get_collection(name=colecao_de_documentos, embedding_function=funcao_de_embeddings)
     
     def consultar_documentos(self, termos_de_consulta: str, num_resultados=environment.NUM_DOCUMENTOS_RETORNADOS):
-        return self.colecao_documentos.query(query_texts=[termos_de_consulta], n_results=num_resultados)
\ No newline at end of file
+        return self.colecao_documentos.query(query_texts=[termos_de_consulta], n_results=num_resultados)
+
+    # As duas etapas de consultar_documentos separadas, para que possam ser executadas em executores distintos
+    def gerar_embeddings_consulta(self, termos_de_consulta: str):
+        return self.funcao_de_embeddings([termos_de_consulta])
+
+    def consultar_documentos_por_embeddings(self, embeddings: Embeddings, num_resultados=environment.NUM_DOCUMENTOS_RETORNADOS):
+        return self.colecao_documentos.query(query_embeddings=embeddings, n_results=num_resultados)
+
+    def completar_distancias(self, documentos: dict, embeddings: Embeddings):
+        '''Calcula a distância do cosseno dos fragmentos sem distância (ex.: vindos só do BM25 na fusão).'''
+        ausentes = [idx for idx, distancia in enumerate(documentos['distances'][0]) if distancia is None]
+        if not ausentes: return documentos
+        ids = [documentos['ids'][0][idx] for idx in ausentes]
+        dados = self.colecao_documentos.get(ids=ids, include=['embeddings'])
+        vetores = dict(zip(dados['ids'], dados['embeddings']))
+        consulta = np.asarray(embeddings[0], dtype=np.float32)
+        consulta = consulta / np.linalg.norm(consulta)
+        for idx, id_fragmento in zip(ausentes, ids):
+            if id_fragmento not in vetores: continue
+            vetor = np.asarray(vetores[id_fragmento], dtype=np.float32)
+            documentos['distances'][0][idx] = 1 - float(consulta @ vetor / np.linalg.norm(vetor))
+        return documentos
+
+    def versao_colecao(self):
+        # O id muda quando a coleção é recriada e a contagem, quando documentos são incluídos ou removidos.
+        # Atualizações incrementais que só alteram fragmentos são identificadas pela data do manifesto
+        data_manifesto = os.path.getmtime(self.url_manifesto) if os.path.exists(self.url_manifesto) else None
+        return f'{self.colecao_documentos.id}:{self.colecao_documentos.count()}:{data_manifesto}'